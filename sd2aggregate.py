@@ -0,0 +1,169 @@
+"""
+Rolling-window aggregation of numeric fields in lines (requires NumPy)
+- AggregatingByteProcessor parses the configured numeric fields of every line and keeps them in NumPy window buffers
+- on window close it pushes along a single aggregate record (count, mean, min and max of every field) instead of all lines
+- tumbling windows (slide equals window) and sliding windows (slide less than window) are supported
+- windows are based on the BytesRead timestamps and aligned to multiples of the slide (in seconds since the epoch)
+- a window also closes when nothing arrives anymore: a timer closes it when it would have closed had the timestamps kept advancing with the wall clock
+- when pushing along an aggregate record fails, the BytesRead is not consumed (and the window stays open), so pushing it again aggregates the same window again
+- aggregate record: AGG,<window start>,<window end>,<field name>,<count>,<mean>,<min>,<max>[,<field name>,...]
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2aggregate.AggregatingByteProcessor(sd2.UDPByteConsumer(2222),{'lat':2,'lon':4},window=10.0)))
+"""
+
+import math
+import threading
+import time
+import numpy
+import serialdata2 as sd2
+
+class AggregatingByteProcessor(sd2.ByteProcessor):
+	# fields: the numeric fields to aggregate as a dictionary of field index (after splitting by separator) by field name
+	def __init__(self,nextByteConsumer=None,fields=None,window=1.0,slide=None,separator=b',',capacity=1024):
+		super().__init__(nextByteConsumer)
+		if not isinstance(fields,dict) or len(fields)==0:
+			raise Exception("No fields to aggregate specified.")
+		if not isinstance(window,(int,float)) or window<=0:
+			raise Exception("Invalid window.")
+		if slide is None:
+			slide=window # tumbling
+		if not isinstance(slide,(int,float)) or slide<=0 or slide>window:
+			raise Exception("Invalid slide: should be positive and not exceed the window.")
+		self.__fieldNames=list(fields.keys())
+		self.__fieldIndices=[fields[fieldName] for fieldName in self.__fieldNames]
+		self.__maxFieldIndex=max(self.__fieldIndices)
+		self.__window=window
+		self.__slide=slide
+		self.__separator=separator
+		# the samples of the current window(s) are kept in self.__times[self.__start:self.__end] and self.__values[self.__start:self.__end]
+		self.__times=numpy.empty(capacity)
+		self.__values=numpy.empty((capacity,len(self.__fieldNames)))
+		self.__start=0
+		self.__end=0
+		self.__closeTime=None # when the next window closes
+		self.__lastTime=None # the timestamp of the last sample
+		self.__lastArrival=None # when the last sample arrived (wall clock)
+		self.__timer=None # closing the window(s) when nothing arrives anymore
+		self.__lock=threading.RLock() # the timer closes windows on its own thread
+		self.__row=[math.nan]*len(self.__fieldNames)
+		self.numberOfLines=0
+		self.numberOfUnparsed=0 # lines without any parsable field
+		self.numberOfAggregates=0
+		self.lastAggregates=None # the last aggregates by field name: (count,mean,min,max)
+
+	def __appended(self,time_,row):
+		if self.__end==len(self.__times): # no room at the end: move what's left to the front (and grow if still more than half full)
+			numberOfSamples=self.__end-self.__start
+			if 2*numberOfSamples>len(self.__times):
+				times=numpy.empty(2*len(self.__times))
+				values=numpy.empty((2*len(self.__times),len(self.__fieldNames)))
+			else:
+				times=self.__times
+				values=self.__values
+			times[:numberOfSamples]=self.__times[self.__start:self.__end]
+			values[:numberOfSamples]=self.__values[self.__start:self.__end]
+			(self.__times,self.__values,self.__start,self.__end)=(times,values,0,numberOfSamples)
+		self.__times[self.__end]=time_
+		self.__values[self.__end]=row
+		self.__end+=1
+
+	def __aggregated(self,closeTime):
+		windowStart=closeTime-self.__window
+		times=self.__times[self.__start:self.__end]
+		# NOTE samples are (mostly) in time order, so the window is a slice found by binary search
+		first=self.__start+int(numpy.searchsorted(times,windowStart,'left'))
+		last=self.__start+int(numpy.searchsorted(times,closeTime,'left'))
+		if last>first:
+			values=self.__values[first:last]
+			missing=numpy.isnan(values) # unparsable fields
+			counts=values.shape[0]-numpy.count_nonzero(missing,axis=0)
+			with numpy.errstate(all='ignore'):
+				means=numpy.where(missing,0.0,values).sum(axis=0)/counts
+			minima=numpy.where(counts>0,numpy.where(missing,numpy.inf,values).min(axis=0),math.nan)
+			maxima=numpy.where(counts>0,numpy.where(missing,-numpy.inf,values).max(axis=0),math.nan)
+			self.lastAggregates={}
+			record=['AGG',repr(windowStart),repr(closeTime)]
+			for column in range(len(self.__fieldNames)):
+				aggregates=(int(counts[column]),float(means[column]),float(minima[column]),float(maxima[column]))
+				self.lastAggregates[self.__fieldNames[column]]=aggregates
+				record+=[self.__fieldNames[column]]+[repr(aggregate) for aggregate in aggregates]
+			if not self._pushed(sd2.BytesRead(','.join(record).encode('ascii'),float(closeTime))):
+				return False # keeping the window as is (to aggregate it again)
+			self.numberOfAggregates+=1
+		# dispose of what's not in the next window
+		self.__start+=int(numpy.searchsorted(self.__times[self.__start:self.__end],windowStart+self.__slide,'left'))
+		return True
+
+	# _closed() closes all windows that closed before the given time, returns False (leaving the failing window open) when pushing along an aggregate failed
+	def _closed(self,time_):
+		with self.__lock:
+			if self.__closeTime is None:
+				self.__closeTime=(math.floor(time_/self.__slide)+1)*self.__slide
+			while time_>=self.__closeTime:
+				if self.__start==self.__end: # nothing to aggregate: skip the empty windows
+					self.__closeTime=(math.floor(time_/self.__slide)+1)*self.__slide
+					break
+				if not self.__aggregated(self.__closeTime):
+					return False
+				self.__closeTime+=self.__slide
+			return True
+
+	def __timedOut(self):
+		with self.__lock:
+			self.__timer=None
+			# the timestamp it would have been now
+			if self.__start<self.__end and not self._closed(self.__lastTime+time.time()-self.__lastArrival):
+				self.__started(self.__slide) # retry later
+			else:
+				self.__started()
+
+	# __started() starts the timer closing the next window (if not running already and anything's buffered)
+	def __started(self,minDelay=0.0):
+		if self.__timer is None and self.__start<self.__end:
+			delay=self.__closeTime-self.__lastTime-(time.time()-self.__lastArrival)
+			self.__timer=threading.Timer(max(minDelay,delay,0.0),self.__timedOut)
+			self.__timer.daemon=True
+			self.__timer.start()
+
+	def _processed(self,bytesRead):
+		with self.__lock:
+			time_=bytesRead.getTime()
+			if not self._closed(time_): # NOTE not appending the sample (yet), as the BytesRead will be pushed again
+				return False
+			self.numberOfLines+=1
+			fields=bytes(bytesRead).split(self.__separator,self.__maxFieldIndex+1)
+			row=self.__row
+			parsed=False
+			for column in range(len(self.__fieldIndices)):
+				try:
+					row[column]=float(fields[self.__fieldIndices[column]])
+					parsed=True
+				except (IndexError,ValueError):
+					row[column]=math.nan
+			if parsed:
+				self.__appended(time_,row)
+				self.__lastTime=time_
+				self.__lastArrival=time.time()
+				self.__started()
+			else:
+				self.numberOfUnparsed+=1
+			return True
+
+	# flush() closes the current window(s) e.g. when the source stopped
+	def flush(self):
+		with self.__lock:
+			if self.__closeTime is not None:
+				return self._closed(self.__closeTime+self.__window)
+			return True
+
+	# close() closes the current window(s) and stops the timer
+	def close(self):
+		with self.__lock:
+			if self.__timer is not None:
+				self.__timer.cancel()
+				self.__timer=None
+			return self.flush()
+
+	def __repr__(self):
+		return super().__repr__()+" - lines: "+str(self.numberOfLines)+" - unparsed: "+str(self.numberOfUnparsed)+" - aggregates: "+str(self.numberOfAggregates)+" - buffered: "+str(self.__end-self.__start)
@@ -0,0 +1,312 @@
+"""
+Compressed rotating archive of BytesRead with a time index for random access
+- ArchiveByteConsumer collects what it consumes (with timestamp and source id) in blocks of about blockSize bytes (or blockInterval seconds)
+  and a writer thread compresses every block (zlib or lzma from the standard library) and writes (and fsyncs) it to the current archive file
+  so compressing (lzma manages only a few MiB/s) never blocks the serial thread, at most maxQueued blocks wait to be written (beyond that blocks are dropped and counted)
+- a new archive file is started when the current one exceeds maxFileSize bytes or maxFileAge seconds
+- the writer also seals the current block after blockInterval seconds and closes the archive file after maxFileAge seconds (wall clock), so also when nothing arrives anymore
+- next to every archive file (.sd2a) a sidecar index (.sd2i) holds the first and last timestamp and the file offset of every block (written once the block is on disk)
+- a block truncated by a crash (at the end of an archive file) is skipped when reading
+- ArchiveReader binary-searches the index and decompresses only the blocks covering the requested interval, readArchive() does so for an entire directory
+- the compression ratio and write throughput are available through getCompressionRatio() and getThroughput(), run this module from the command line to benchmark:
+  python sd2archive.py [zlib|lzma]
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2archive.ArchiveByteConsumer('/var/log/port1')))
+for bytesRead in sd2archive.readArchive('/var/log/port1',startTime,endTime): ...
+"""
+
+import bisect
+import collections
+import datetime
+import lzma
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+import serialdata2 as sd2
+
+FILEHEADER=struct.Struct('<4sB') # magic, compression
+MAGIC=b'SD2A'
+COMPRESSIONS={'zlib':1,'lzma':2}
+BLOCKHEADER=struct.Struct('<II') # compressed length, uncompressed length
+RECORDHEADER=struct.Struct('<dIH') # time, data length, source id length (NOSOURCEID if none)
+NOSOURCEID=0xFFFF
+INDEXENTRY=struct.Struct('<ddQ') # first time, last time, block offset
+ARCHIVEEXTENSION='.sd2a'
+INDEXEXTENSION='.sd2i'
+
+def _compressor(compression,level):
+	if compression==COMPRESSIONS['zlib']:
+		return lambda data:zlib.compress(data,level if level is not None else 6)
+	return lambda data:lzma.compress(data,preset=level if level is not None else 6)
+
+def _decompressor(compression):
+	if compression==COMPRESSIONS['zlib']:
+		return zlib.decompress
+	if compression==COMPRESSIONS['lzma']:
+		return lzma.decompress
+	raise Exception("Unknown compression "+str(compression)+".")
+
+class ArchiveByteConsumer(sd2.ByteConsumer):
+	# maxQueued: the maximum number of blocks waiting to be compressed and written, beyond that blocks are dropped (and counted) when the disk (or compression) can't keep up
+	def __init__(self,directory,compression='zlib',level=None,blockSize=1<<16,blockInterval=10.0,maxFileSize=1<<26,maxFileAge=3600.0,prefix='archive',maxQueued=256):
+		super().__init__()
+		if compression not in COMPRESSIONS:
+			raise Exception("Invalid compression: should be one of "+str(tuple(COMPRESSIONS.keys()))+".")
+		if not isinstance(maxQueued,int) or maxQueued<=0:
+			raise Exception("Invalid maximum number of queued blocks.")
+		os.makedirs(directory,exist_ok=True)
+		self.__directory=directory
+		self.__compression=COMPRESSIONS[compression]
+		self.__compress=_compressor(self.__compression,level)
+		self.__blockSize=blockSize
+		self.__blockInterval=blockInterval
+		self.__maxFileSize=maxFileSize
+		self.__maxFileAge=maxFileAge
+		self.__prefix=prefix
+		self.__maxQueued=maxQueued
+		self.__condition=threading.Condition() # guards the current block and the queued blocks
+		self.__block=bytearray() # the records of the current block (uncompressed)
+		self.__blockFirstTime=None
+		self.__blockLastTime=None
+		self.__blockStarted=None # when the current block got its first record (wall clock)
+		self.__queued=collections.deque() # (block,first time,last time) tuples waiting to be written
+		self.__writing=False # whether the writer is writing a block (taken off the queue)
+		# the archive file is used by the writer thread only
+		self.__file=None
+		self.__indexFile=None
+		self.__fileStartTime=None
+		self.__fileOpened=None # wall clock
+		self.numberOfBytes=0 # uncompressed (records included)
+		self.numberOfCompressedBytes=0 # written (block headers included)
+		self.numberOfBlocks=0
+		self.numberOfFiles=0
+		self.numberOfDroppedBlocks=0
+		self.numberOfDroppedBytes=0
+		self.writeTime=0.0 # spent writing (compressing and syncing included)
+		self.__running=True
+		self.__writer=threading.Thread(target=self.__write,name='sd2archivewriter',daemon=True)
+		self.__writer.start()
+	def __opened(self,time_):
+		self.__closeFile()
+		self.numberOfFiles+=1
+		name=self.__prefix+datetime.datetime.fromtimestamp(time_).strftime('%Y%m%d%H%M%S%f')
+		self.__file=open(os.path.join(self.__directory,name+ARCHIVEEXTENSION),'wb')
+		self.__file.write(FILEHEADER.pack(MAGIC,self.__compression))
+		self.__indexFile=open(os.path.join(self.__directory,name+INDEXEXTENSION),'wb')
+		self.__fileStartTime=time_
+		self.__fileOpened=time.time()
+		self._reporting("Archiving to '"+self.__file.name+"'.")
+	def __closeFile(self):
+		if self.__file is not None:
+			self.__file.close()
+			self.__indexFile.close()
+			self.__file=None
+			self.__indexFile=None
+	# NOTE __sealed() should be called with the condition acquired
+	def __sealed(self):
+		if self.__block:
+			if len(self.__queued)>=self.__maxQueued:
+				self.numberOfDroppedBlocks+=1
+				self.numberOfDroppedBytes+=len(self.__block)
+			else:
+				self.__queued.append((self.__block,self.__blockFirstTime,self.__blockLastTime))
+				self.__condition.notify_all()
+			self.__block=bytearray()
+			self.__blockFirstTime=self.__blockLastTime=self.__blockStarted=None
+	def __written(self,block,firstTime,lastTime):
+		startTime=time.perf_counter()
+		if self.__file is None or self.__file.tell()>=self.__maxFileSize or firstTime-self.__fileStartTime>=self.__maxFileAge:
+			self.__opened(firstTime)
+		compressed=self.__compress(bytes(block))
+		offset=self.__file.tell()
+		self.__file.write(BLOCKHEADER.pack(len(compressed),len(block))+compressed)
+		self.__file.flush()
+		os.fsync(self.__file.fileno())
+		# the index entry only once the block is on disk, so the index never refers to a block that isn't
+		self.__indexFile.write(INDEXENTRY.pack(firstTime,lastTime,offset))
+		self.__indexFile.flush()
+		os.fsync(self.__indexFile.fileno())
+		self.numberOfBytes+=len(block)
+		self.numberOfCompressedBytes+=BLOCKHEADER.size+len(compressed)
+		self.numberOfBlocks+=1
+		self.writeTime+=time.perf_counter()-startTime
+	# __write() compresses and writes the queued blocks on the writer thread
+	# also sealing the current block after blockInterval seconds and closing the archive file after maxFileAge seconds (wall clock) when nothing arrives
+	def __write(self):
+		while True:
+			with self.__condition:
+				if self.__running and not self.__queued:
+					now=time.time()
+					timeout=self.__blockInterval
+					if self.__blockStarted is not None:
+						timeout=max(0.0,self.__blockStarted+self.__blockInterval-now)
+					if self.__file is not None:
+						timeout=min(timeout,max(0.0,self.__fileOpened+self.__maxFileAge-now))
+					self.__condition.wait(timeout)
+				now=time.time()
+				if self.__blockStarted is not None and now-self.__blockStarted>=self.__blockInterval:
+					self.__sealed()
+				queued=self.__queued.popleft() if self.__queued else None
+				self.__writing=queued is not None
+				running=self.__running or len(self.__queued)>0 # write everything queued before stopping
+			if queued is not None:
+				try:
+					self.__written(*queued)
+				except Exception as ex:
+					self.numberOfDroppedBlocks+=1
+					self.numberOfDroppedBytes+=len(queued[0])
+					self._reporting("ERROR: '"+str(ex)+"' writing a block of "+str(len(queued[0]))+" bytes to '"+self.__directory+"'.")
+				with self.__condition:
+					self.__writing=False
+					self.__condition.notify_all()
+			elif self.__file is not None and now-self.__fileOpened>=self.__maxFileAge:
+				self.__closeFile() # the next block starts a new archive file
+			if not running and queued is None:
+				break
+		self.__closeFile()
+	# flush() writes the current block (if any) and waits (at most timeout seconds) until everything queued is written
+	def flush(self,timeout=None):
+		with self.__condition:
+			self.__sealed()
+			return self.__condition.wait_for(lambda:not self.__queued and not self.__writing,timeout)
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			time_=bytesRead.getTime()
+			sourceId=bytesRead.getSourceId()
+			if sourceId is None:
+				record=RECORDHEADER.pack(time_,len(bytesRead),NOSOURCEID)
+			else:
+				sourceId=str(sourceId).encode('utf-8')
+				record=RECORDHEADER.pack(time_,len(bytesRead),len(sourceId))+sourceId
+			with self.__condition:
+				if self.__block and time_-self.__blockFirstTime>=self.__blockInterval: # e.g. replaying
+					self.__sealed()
+				self.__block+=record
+				self.__block+=bytesRead
+				if self.__blockFirstTime is None:
+					self.__blockFirstTime=time_
+					self.__blockStarted=time.time()
+					self.__condition.notify_all() # the writer should seal this block after blockInterval seconds
+				self.__blockLastTime=max(time_,self.__blockLastTime or time_)
+				if len(self.__block)>=self.__blockSize:
+					self.__sealed()
+			return True
+		return False
+	# close() writes what is still queued (waiting at most timeout seconds) and closes the archive file
+	def close(self,timeout=None):
+		with self.__condition:
+			self.__sealed()
+			self.__running=False
+			self.__condition.notify_all()
+		self.__writer.join(timeout)
+	def getNumberOfQueued(self):
+		return len(self.__queued)
+	def getCompressionRatio(self):
+		return self.numberOfBytes/self.numberOfCompressedBytes if self.numberOfCompressedBytes else 0.0
+	# getThroughput() returns the number of (uncompressed) bytes written per second spent writing
+	def getThroughput(self):
+		return self.numberOfBytes/self.writeTime if self.writeTime else 0.0
+	def __repr__(self):
+		return super().__repr__()+" - files: "+str(self.numberOfFiles)+" - blocks: "+str(self.numberOfBlocks)+" - bytes: "+str(self.numberOfBytes)+" - compressed: "+str(self.numberOfCompressedBytes)+" - ratio: "+str(round(self.getCompressionRatio(),2))+" - throughput: "+str(round(self.getThroughput()/(1<<20),1))+" MiB/s - queued: "+str(len(self.__queued))+" - dropped: "+str(self.numberOfDroppedBlocks)+" blocks ("+str(self.numberOfDroppedBytes)+" bytes)"
+
+class ArchiveReader:
+	def __init__(self,path):
+		self.__path=path
+		with open(os.path.splitext(path)[0]+INDEXEXTENSION,'rb') as indexFile:
+			index=indexFile.read()
+		entries=list(INDEXENTRY.iter_unpack(index[:len(index)-len(index)%INDEXENTRY.size]))
+		# after a crash the index may refer to a block that didn't make it to the archive file (entirely)
+		fileSize=os.path.getsize(path)
+		entries=[entry for entry in entries if entry[2]+BLOCKHEADER.size<=fileSize]
+		self.__firstTimes=[entry[0] for entry in entries]
+		# the running maximum of the last times, so it's sorted (even if the timestamps are not entirely)
+		self.__maxLastTimes=[]
+		maxLastTime=None
+		for entry in entries:
+			maxLastTime=entry[1] if maxLastTime is None else max(maxLastTime,entry[1])
+			self.__maxLastTimes.append(maxLastTime)
+		self.__offsets=[entry[2] for entry in entries]
+	def getNumberOfBlocks(self):
+		return len(self.__offsets)
+	def getTimeRange(self):
+		if not self.__offsets:
+			return None
+		return (min(self.__firstTimes),self.__maxLastTimes[-1])
+	# read() returns the BytesRead with a timestamp in the given interval (startTime included, endTime excluded), decompressing only the blocks covering it
+	def read(self,startTime=None,endTime=None):
+		first=0 if startTime is None else bisect.bisect_left(self.__maxLastTimes,startTime)
+		with open(self.__path,'rb') as archiveFile:
+			header=archiveFile.read(FILEHEADER.size)
+			if not self.__offsets and len(header)<FILEHEADER.size: # crashed before writing anything
+				return
+			(magic,compression)=FILEHEADER.unpack(header)
+			if magic!=MAGIC:
+				raise Exception("'"+self.__path+"' is not an archive.")
+			decompress=_decompressor(compression)
+			lastBlockIndex=len(self.__offsets)-1
+			for blockIndex in range(first,len(self.__offsets)):
+				if endTime is not None and self.__firstTimes[blockIndex]>=endTime:
+					continue # NOTE a later block may still start earlier (if the timestamps are not entirely in order)
+				archiveFile.seek(self.__offsets[blockIndex])
+				(compressedLength,length)=BLOCKHEADER.unpack(archiveFile.read(BLOCKHEADER.size))
+				compressed=archiveFile.read(compressedLength)
+				try:
+					if len(compressed)<compressedLength:
+						raise Exception("Truncated block.")
+					block=decompress(compressed)
+					if len(block)!=length:
+						raise Exception("Block of "+str(len(block))+" instead of "+str(length)+" bytes.")
+				except Exception as ex:
+					if blockIndex==lastBlockIndex: # the last block written when crashing: skip it
+						return
+					raise Exception("Block #"+str(blockIndex)+" of '"+self.__path+"' is corrupt: "+str(ex))
+				offset=0
+				while offset<len(block):
+					(time_,dataLength,sourceIdLength)=RECORDHEADER.unpack_from(block,offset)
+					offset+=RECORDHEADER.size
+					sourceId=None
+					if sourceIdLength!=NOSOURCEID:
+						sourceId=block[offset:offset+sourceIdLength].decode('utf-8')
+						offset+=sourceIdLength
+					if (startTime is None or time_>=startTime) and (endTime is None or time_<endTime):
+						yield sd2.BytesRead(block[offset:offset+dataLength],time_,sourceId)
+					offset+=dataLength
+
+# readArchive() returns the BytesRead in the given interval from all archive files in the given directory (in file order)
+def readArchive(directory,startTime=None,endTime=None,prefix='archive'):
+	for fileName in sorted(os.listdir(directory)):
+		if fileName.startswith(prefix) and fileName.endswith(ARCHIVEEXTENSION):
+			archiveReader=ArchiveReader(os.path.join(directory,fileName))
+			timeRange=archiveReader.getTimeRange()
+			if timeRange is None or (endTime is not None and timeRange[0]>=endTime) or (startTime is not None and timeRange[1]<startTime):
+				continue
+			yield from archiveReader.read(startTime,endTime)
+
+def benchmark(compression='zlib',numberOfLines=500000):
+	directory=tempfile.mkdtemp(prefix='sd2archive')
+	# NOTE queueing everything (instead of dropping what the writer can't keep up with) to read it all back
+	archiveByteConsumer=ArchiveByteConsumer(directory,compression,maxFileSize=1<<20,maxQueued=numberOfLines)
+	startTime=time.time()
+	for index in range(numberOfLines):
+		archiveByteConsumer.consumed(sd2.BytesRead(b'$GPGGA,%06d,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47' % (index%240000),startTime+index*0.001,'port1'))
+	consumingTime=time.time()-startTime # what the serial thread spends
+	archiveByteConsumer.close()
+	elapsed=time.time()-startTime
+	print(compression+": "+str(numberOfLines)+" lines consumed in "+str(round(consumingTime,2))+" s and written in "+str(round(elapsed,2))+" s ("+str(round(archiveByteConsumer.numberOfBytes/elapsed/(1<<20),1))+" MiB/s overall) - files: "+str(archiveByteConsumer.numberOfFiles)+" - compression ratio: "+str(round(archiveByteConsumer.getCompressionRatio(),2))+" - write throughput: "+str(round(archiveByteConsumer.getThroughput()/(1<<20),1))+" MiB/s")
+	# reading a single second from the middle
+	readStartTime=time.time()
+	numberOfRead=sum(1 for _ in readArchive(directory,startTime+numberOfLines*0.0005,startTime+numberOfLines*0.0005+1.0))
+	print("Read "+str(numberOfRead)+" lines of a one second interval in "+str(round(1000*(time.time()-readStartTime),1))+" ms")
+	if sum(1 for _ in readArchive(directory))!=numberOfLines:
+		print("ERROR: Not everything archived was read back.")
+	for fileName in os.listdir(directory):
+		os.remove(os.path.join(directory,fileName))
+	os.rmdir(directory)
+
+if __name__=='__main__':
+	benchmark(*sys.argv[1:2])
@@ -0,0 +1,139 @@
+"""
+Trigger-based capture of what was read around an event (for fault analysis)
+- TriggerCaptureByteProcessor keeps the most recent BytesRead in a fixed-size ring (bounded by number and total bytes) and pushes everything along unchanged
+- when the trigger fires the ring (the pre-trigger window) is written to a new capture file, followed by what arrives in the next postSeconds seconds
+- trigger: any of the given patterns matching (combined into a single precompiled regular expression), a checksum failure (BytesRead.isValid() returning False, see sd2checksum) and/or any callable
+- a trigger firing while capturing extends the post-trigger window of the current capture file instead of starting a new one
+- a capture file is closed as soon as its post-trigger window ends (by a timer, so also when nothing arrives anymore)
+- a capture file holds a line per BytesRead: timestamp, source id and contents (as in str(bytesRead)), trigger lines are marked with TRIGGER
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2checksum.ChecksumByteProcessor(sd2capture.TriggerCaptureByteProcessor(None,'/var/tmp/captures',patterns=(rb'ERR',rb'^\$GPTXT')),drop=False)))
+"""
+
+import collections
+import datetime
+import os
+import re
+import threading
+import time
+import serialdata2 as sd2
+
+class TriggerCaptureByteProcessor(sd2.ByteProcessor):
+	# patterns: regular expressions (bytes) a BytesRead should match (re.search()) to fire the trigger
+	# invalid: whether a BytesRead tagged invalid fires the trigger
+	# trigger: a callable returning True when the BytesRead it receives should fire the trigger
+	# maxCount and maxBytes: the size of the ring holding the pre-trigger window
+	def __init__(self,nextByteConsumer=None,directory='.',patterns=None,invalid=True,trigger=None,maxCount=1000,maxBytes=1<<20,postSeconds=5.0,prefix='capture'):
+		super().__init__(nextByteConsumer)
+		if not patterns and not invalid and trigger is None:
+			raise Exception("No trigger specified.")
+		if trigger is not None and not callable(trigger):
+			raise Exception("Invalid trigger: should be callable.")
+		if not isinstance(maxCount,int) or maxCount<=0 or not isinstance(maxBytes,int) or maxBytes<=0:
+			raise Exception("Invalid ring size.")
+		os.makedirs(directory,exist_ok=True)
+		self.__directory=directory
+		self.__prefix=prefix
+		self.__search=re.compile(b'|'.join(b'(?:'+pattern+b')' for pattern in patterns)).search if patterns else None
+		self.__invalid=invalid
+		self.__trigger=trigger
+		self.__maxBytes=maxBytes
+		self.__postSeconds=postSeconds
+		self.__ring=collections.deque(maxlen=maxCount) # (time,source id,bytes) tuples
+		self.__ringBytes=0
+		self.__file=None # the capture file being written (if any)
+		self.__endTime=None # when the current capture ends
+		self.__deadline=None # when the timer should close the current capture (the wall clock equivalent of the end time)
+		self.__timer=None # closing the current capture at its deadline (when nothing arrives to close it)
+		self.__lock=threading.RLock() # the timer closes the capture file on its own thread
+		self.numberOfTriggers=0
+		self.numberOfCaptures=0
+		self.lastCapturePath=None
+
+	def __triggered(self,bytesRead):
+		if self.__invalid and not bytesRead.isValid():
+			return True
+		if self.__search is not None and self.__search(bytesRead) is not None:
+			return True
+		return self.__trigger is not None and self.__trigger(bytesRead)
+
+	def __written(self,time_,sourceId,data,marker=''):
+		self.__file.write(marker+str(datetime.datetime.fromtimestamp(time_))+"\t"+str(sourceId)+"\t"+str(data)+"\n")
+
+	def __opened(self,time_):
+		self.numberOfCaptures+=1
+		path=os.path.join(self.__directory,self.__prefix+datetime.datetime.fromtimestamp(time_).strftime('%Y%m%d%H%M%S%f')+'_'+str(self.numberOfCaptures)+'.txt')
+		self.__file=open(path,'w')
+		self.lastCapturePath=path
+		for (ringTime,sourceId,data) in self.__ring:
+			self.__written(ringTime,sourceId,data)
+		self.__ring.clear()
+		self.__ringBytes=0
+		self._reporting("Capture started in '"+path+"'.")
+
+	# close() ends the current capture (if any)
+	def close(self):
+		with self.__lock:
+			if self.__timer is not None:
+				self.__timer.cancel()
+				self.__timer=None
+			if self.__file is not None:
+				self.__file.close()
+				self.__file=None
+				self.__endTime=None
+				self._reporting("Capture written to '"+self.lastCapturePath+"'.")
+
+	def __timedOut(self):
+		with self.__lock:
+			self.__timer=None
+			if self.__file is not None:
+				if time.time()>=self.__deadline:
+					self.close()
+				else: # extended meanwhile
+					self.__started()
+
+	# __started() starts the timer closing the current capture at its deadline (if not running already)
+	def __started(self):
+		if self.__timer is None:
+			self.__timer=threading.Timer(max(0.0,self.__deadline-time.time()),self.__timedOut)
+			self.__timer.daemon=True
+			self.__timer.start()
+
+	def _captured(self,bytesRead):
+		with self.__lock:
+			time_=bytesRead.getTime()
+			if self.__file is not None and time_>self.__endTime:
+				self.close()
+			if self.__triggered(bytesRead):
+				self.numberOfTriggers+=1
+				if self.__file is None:
+					self.__opened(time_)
+				self.__endTime=time_+self.__postSeconds
+				self.__deadline=time.time()+self.__postSeconds
+				self.__written(time_,bytesRead.getSourceId(),bytes(bytesRead),'TRIGGER\t')
+				self.__started()
+			elif self.__file is not None:
+				self.__written(time_,bytesRead.getSourceId(),bytes(bytesRead))
+			else:
+				if len(self.__ring)==self.__ring.maxlen: # about to be dropped by append()
+					self.__ringBytes-=len(self.__ring[0][2])
+				self.__ring.append((time_,bytesRead.getSourceId(),bytes(bytesRead)))
+				self.__ringBytes+=len(bytesRead)
+				while self.__ringBytes>self.__maxBytes:
+					self.__ringBytes-=len(self.__ring.popleft()[2])
+
+	def _processed(self,bytesRead):
+		self._captured(bytesRead)
+		return self._pushed(bytesRead) if self._byteConsumer else True
+
+	def _processedBatch(self,bytesReadList):
+		for bytesRead in bytesReadList:
+			self._captured(bytesRead)
+		return self._pushedBatch(bytesReadList) if self._byteConsumer else len(bytesReadList)
+
+	def isCapturing(self):
+		return self.__file is not None
+
+	def __repr__(self):
+		return super().__repr__()+" - ring: "+str(len(self.__ring))+" ("+str(self.__ringBytes)+" bytes) - triggers: "+str(self.numberOfTriggers)+" - captures: "+str(self.numberOfCaptures)+("",", capturing")[self.__file is not None]
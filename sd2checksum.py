@@ -0,0 +1,142 @@
+"""
+Early checksum validation of the lines (or frames) extracted by e.g. LineByteProcessor
+- ChecksumByteProcessor is to be placed directly behind the line or frame extraction so corrupt frames do not travel down the chain
+- supported checksums: NMEA XOR (*HH), CRC16 (CCITT through binascii.crc_hqx, MODBUS table-driven), CRC32 (through zlib.crc32) and additive (8 bits)
+- corrupt frames are dropped (default) or tagged (BytesRead.isValid() returns False) and counted per source id
+- a frame that failed to be pushed along is counted once, not again when it is pushed (processed) again
+"""
+
+import binascii
+import functools
+import operator
+import zlib
+import serialdata2 as sd2
+
+# table for the (reflected) MODBUS CRC16 polynomial 0xA001
+def _getCRC16ModbusTable():
+	table=[]
+	for byte in range(256):
+		crc=byte
+		for bit in range(8):
+			crc=((crc>>1)^0xA001,crc>>1)[(crc&1)==0]
+		table.append(crc)
+	return tuple(table)
+CRC16MODBUSTABLE=_getCRC16ModbusTable()
+
+def crc16modbus(data,crc=0xFFFF):
+	table=CRC16MODBUSTABLE
+	for byte in data:
+		crc=(crc>>8)^table[(crc^byte)&0xFF]
+	return crc
+
+# the checksum functions return None if the frame is too short to contain a checksum at all
+def isValidNMEA(frame):
+	# $<data>*HH with the XOR of all data bytes between $ (or !) and *
+	starPos=frame.rfind(b'*')
+	if starPos<1 or len(frame)<starPos+3 or frame[0] not in b'$!':
+		return None
+	try:
+		return functools.reduce(operator.xor,frame[1:starPos],0)==int(frame[starPos+1:starPos+3],16)
+	except ValueError: # not hexadecimal
+		return False
+
+def isValidCRC16(frame,byteorder='big'):
+	if len(frame)<3:
+		return None
+	return binascii.crc_hqx(frame[:-2],0xFFFF)==int.from_bytes(frame[-2:],byteorder)
+
+def isValidCRC16Modbus(frame,byteorder='little'):
+	if len(frame)<3:
+		return None
+	return crc16modbus(frame[:-2])==int.from_bytes(frame[-2:],byteorder)
+
+def isValidCRC32(frame,byteorder='little'):
+	if len(frame)<5:
+		return None
+	return zlib.crc32(frame[:-4])==int.from_bytes(frame[-4:],byteorder)
+
+# NOTE a single checksum byte, so no byte order
+def isValidAdditive(frame):
+	if len(frame)<2:
+		return None
+	return (sum(frame[:-1])&0xFF)==frame[-1]
+
+CHECKSUMS={'nmea':isValidNMEA,'crc16':isValidCRC16,'crc16modbus':isValidCRC16Modbus,'crc32':isValidCRC32,'additive':isValidAdditive}
+BYTEORDERCHECKSUMS=('crc16','crc16modbus','crc32') # the checksums with a byte order
+
+# byteorder: 'big' or 'little' (for the checksums in BYTEORDERCHECKSUMS only), None for the default of the checksum
+class ChecksumByteProcessor(sd2.ByteProcessor):
+	def __init__(self,nextByteConsumer=None,checksum='nmea',drop=True,byteorder=None):
+		super().__init__(nextByteConsumer)
+		if not checksum in CHECKSUMS:
+			raise Exception("Invalid checksum: should be one of "+str(tuple(CHECKSUMS.keys()))+".")
+		self.__checksum=checksum
+		if byteorder is None:
+			self.__isValid=CHECKSUMS[checksum]
+		elif checksum not in BYTEORDERCHECKSUMS:
+			raise Exception("Invalid checksum byte order: checksum '"+checksum+"' has no byte order.")
+		elif byteorder in ('big','little'):
+			self.__isValid=functools.partial(CHECKSUMS[checksum],byteorder=byteorder)
+		else:
+			raise Exception("Invalid checksum byte order.")
+		self.__drop=drop
+		self.__counts={} # per source id: [number of valid, number of corrupt, number too short to validate] frames
+		self.__unpushed={} # the frames (by id) that failed to be pushed along the last time (so counted already)
+
+	def __counted(self,sourceId,index):
+		counts=self.__counts.get(sourceId)
+		if counts is None:
+			counts=self.__counts[sourceId]=[0,0,0]
+		counts[index]+=1
+
+	# _validated() returns the BytesRead frame to push along (or None when dropped)
+	def _validated(self,bytesRead):
+		valid=self.__isValid(bytesRead)
+		if self.__unpushed.get(id(bytesRead)) is bytesRead: # pushed again: counted already
+			del self.__unpushed[id(bytesRead)]
+			valid=bool(valid)
+		elif valid is None: # can't tell: considered corrupt
+			self.__counted(bytesRead.getSourceId(),2)
+			valid=False
+		else:
+			self.__counted(bytesRead.getSourceId(),(1,0)[valid])
+		if valid:
+			return bytesRead
+		if self.__drop:
+			return None
+		return bytesRead.setValid(False)
+
+	def _processed(self,bytesRead):
+		bytesRead=self._validated(bytesRead)
+		if bytesRead is None or self._pushed(bytesRead):
+			return True
+		self.__unpushed={id(bytesRead):bytesRead}
+		return False
+	# _processedBatch() returns the number of frames pushed along or dropped, i.e. up to the first frame that failed to be pushed along
+	def _processedBatch(self,bytesReadList):
+		validBytesReadList=[]
+		indices=[] # the index of every frame to push along in bytesReadList
+		for (index,bytesRead) in enumerate(map(self._validated,bytesReadList)):
+			if bytesRead is not None:
+				validBytesReadList.append(bytesRead)
+				indices.append(index)
+		if validBytesReadList:
+			numberOfPushed=self._pushedBatch(validBytesReadList)
+			if numberOfPushed<len(validBytesReadList):
+				self._reporting("ERROR: Failed to push along "+str(len(validBytesReadList)-numberOfPushed)+" of "+str(len(validBytesReadList))+" frames.")
+				self.__unpushed=dict((id(bytesRead),bytesRead) for bytesRead in validBytesReadList[numberOfPushed:])
+				return indices[numberOfPushed]
+		return len(bytesReadList)
+
+	def getCounts(self,sourceId=None):
+		return tuple(self.__counts.get(sourceId,(0,0,0)))
+	def getNumberOfCorrupt(self):
+		return sum(counts[1]+counts[2] for counts in self.__counts.values())
+	def getSourceIds(self):
+		return self.__counts.keys()
+
+	def __repr__(self):
+		result=super().__repr__()+" - "+self.__checksum
+		for (sourceId,counts) in self.__counts.items():
+			result+=" - "+str(sourceId)+": valid="+str(counts[0])+" corrupt="+str(counts[1])+" short="+str(counts[2])
+		return result
@@ -0,0 +1,238 @@
+"""
+Pipelined command/response multiplexer on top of SerialByteSource.write()
+- CommandMultiplexer sits behind a LineByteProcessor and matches the lines (responses) to the commands sent, allowing up to window commands in flight
+- matching: 'fifo' (every response line answers the oldest outstanding command) or 'key' (a regular expression extracts the key of a response, a tag or sequence field)
+- in 'key' mode a command without a key gets the next sequence number as key, substituted for {seq} in the command (if present)
+- send() returns a concurrent.futures.Future resolving to the response (BytesRead) or failing with TimeoutError, sendAsync() is the asyncio equivalent
+- unsolicited lines (matching the unsolicited regular expression, not matching any outstanding command or arriving while none is outstanding) are pushed along to the next byte consumer
+  NOTE a response arriving after its command timed out is unsolicited as well (in 'fifo' mode it would answer the next command, so pass unsolicited to avoid that)
+- run this module from the command line to benchmark pipelined versus stop-and-wait commands on a simulated device (on a pseudo terminal):
+  python sd2command.py [<number of commands>] [<device latency in ms>] [<window>]
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import os
+import re
+import sys
+import threading
+import time
+import serial
+import serialdata2 as sd2
+
+# a Command is an outstanding command
+class Command:
+	def __init__(self,data,key,deadline):
+		self.data=data
+		self.key=key
+		self.deadline=deadline
+		self.future=concurrent.futures.Future()
+		self.sentTime=None
+
+class CommandMultiplexer(sd2.ByteProcessor):
+	# serialByteSource: what to write commands to, its byte consumer should be a LineByteProcessor pushing to this multiplexer (see attach())
+	# responseKey: (in 'key' mode) regular expression (bytes) with a group extracting the key of a response
+	# unsolicited: regular expression (bytes) of lines that are never a response
+	# terminator: appended to every command written
+	def __init__(self,serialByteSource,nextByteConsumer=None,match='fifo',responseKey=None,unsolicited=None,window=8,timeout=1.0,terminator=b'\r\n'):
+		super().__init__(nextByteConsumer)
+		if not isinstance(serialByteSource,sd2.SerialByteSource):
+			raise Exception("No (proper) serial byte source specified.")
+		if match not in ('fifo','key'):
+			raise Exception("Invalid match: should be 'fifo' or 'key'.")
+		if match=='key':
+			if responseKey is None:
+				raise Exception("No response key specified.")
+			self.__responseKey=re.compile(responseKey)
+			if self.__responseKey.groups<1:
+				raise Exception("Invalid response key: should have a group extracting the key.")
+		else:
+			self.__responseKey=None
+		if not isinstance(window,int) or window<=0:
+			raise Exception("Invalid window.")
+		self.__serialByteSource=serialByteSource
+		self.__unsolicited=re.compile(unsolicited).search if unsolicited is not None else None
+		self.__timeout=timeout
+		self.__terminator=terminator
+		self.__window=threading.BoundedSemaphore(window)
+		self.__lock=threading.Condition() # guards the outstanding commands (and writing, so the order written is the order outstanding)
+		self.__outstanding=collections.OrderedDict() # the outstanding commands by key (fifo: by sequence number)
+		self.__sequenceNumber=0
+		self.__expiring=False
+		self.numberOfSent=0
+		self.numberOfResponses=0
+		self.numberOfTimeouts=0
+		self.numberOfUnsolicited=0
+		self.totalRoundTripTime=0.0
+
+	# attach() makes this multiplexer receive the lines read by the serial byte source
+	def attach(self,sepbytes=b'\r\n'):
+		self.__serialByteSource.setByteConsumer(sd2.LineByteProcessor(self,sepbytes))
+		return self
+
+	def __expire(self):
+		with self.__lock:
+			while self.__expiring:
+				now=time.time()
+				expired=[command for command in self.__outstanding.values() if command.deadline<=now]
+				for command in expired:
+					self.__completed(command)
+					self.numberOfTimeouts+=1
+					command.future.set_exception(TimeoutError("No response to '"+str(command.data)+"' within "+str(self.__timeout)+" seconds."))
+				deadline=min((command.deadline for command in self.__outstanding.values()),default=None)
+				self.__lock.wait(max(0,deadline-now) if deadline is not None else None)
+
+	# __completed() removes a command from the outstanding commands (holding the lock)
+	def __completed(self,command):
+		del self.__outstanding[command.key]
+		self.__window.release()
+
+	# send() writes the given command (bytes) and returns the future of its response, waiting at most blockTimeout seconds for room in the window
+	def send(self,data,key=None,timeout=None,blockTimeout=None):
+		if not self.__window.acquire(timeout=blockTimeout):
+			raise TimeoutError("Too many outstanding commands.")
+		with self.__lock:
+			self.__sequenceNumber+=1
+			if self.__responseKey is None:
+				key=self.__sequenceNumber
+			elif key is None:
+				key=str(self.__sequenceNumber).encode('ascii')
+				data=data.replace(b'{seq}',key)
+			if key in self.__outstanding:
+				self.__window.release()
+				raise Exception("Command with key "+str(key)+" already outstanding.")
+			command=Command(data,key,time.time()+(self.__timeout,timeout)[timeout is not None])
+			self.__outstanding[key]=command
+			command.sentTime=time.time()
+			if self.__serialByteSource.write(bytes(data+self.__terminator))<=0:
+				self.__completed(command)
+				command.future.set_exception(IOError("Failed to write '"+str(data)+"'."))
+				return command.future
+			self.numberOfSent+=1
+			if not self.__expiring:
+				self.__expiring=True
+				threading.Thread(target=self.__expire,name='sd2commandexpiry',daemon=True).start()
+			else:
+				self.__lock.notify()
+		return command.future
+
+	# request() sends the given command and waits for its response
+	def request(self,data,key=None,timeout=None):
+		return self.send(data,key,timeout).result()
+
+	async def sendAsync(self,data,key=None,timeout=None):
+		return await asyncio.wrap_future(await asyncio.get_running_loop().run_in_executor(None,self.send,data,key,timeout))
+
+	def _processed(self,bytesRead):
+		if self.__unsolicited is None or self.__unsolicited(bytesRead) is None:
+			with self.__lock:
+				command=None
+				if self.__responseKey is None:
+					if self.__outstanding:
+						command=next(iter(self.__outstanding.values()))
+				else:
+					match=self.__responseKey.search(bytesRead)
+					if match is not None:
+						command=self.__outstanding.get(match.group(1))
+				if command is not None:
+					self.__completed(command)
+					self.numberOfResponses+=1
+					self.totalRoundTripTime+=bytesRead.getTime()-command.sentTime
+			if command is not None:
+				command.future.set_result(bytesRead)
+				return True
+		self.numberOfUnsolicited+=1
+		return self._pushed(bytesRead) if self._byteConsumer else True
+
+	def getNumberOfOutstanding(self):
+		return len(self.__outstanding)
+
+	def close(self):
+		with self.__lock:
+			self.__expiring=False
+			for command in list(self.__outstanding.values()):
+				self.__completed(command)
+				command.future.cancel()
+			self.__lock.notify()
+
+	def __repr__(self):
+		return super().__repr__()+" - sent: "+str(self.numberOfSent)+" - responses: "+str(self.numberOfResponses)+" - timeouts: "+str(self.numberOfTimeouts)+" - unsolicited: "+str(self.numberOfUnsolicited)+" - outstanding: "+str(len(self.__outstanding))+" - mean round trip: "+str(round(1000*self.totalRoundTripTime/max(self.numberOfResponses,1),3))+" ms"
+
+# SimulatedDevice answers every command line written to a pseudo terminal after a fixed latency (e.g. the time to take a measurement)
+class SimulatedDevice:
+	def __init__(self,latency=0.005):
+		(self.__master,slave)=os.openpty()
+		self.port=os.ttyname(slave)
+		self.__slave=slave # keep it open so the pseudo terminal remains
+		self.__latency=latency
+		self.__responses=collections.deque() # (due time,response) in order
+		self.__condition=threading.Condition()
+		self.__running=True
+		threading.Thread(target=self.__read,name='sd2devicereader',daemon=True).start()
+		threading.Thread(target=self.__write,name='sd2devicewriter',daemon=True).start()
+	def __read(self):
+		received=b''
+		while self.__running:
+			try:
+				received+=os.read(self.__master,4096)
+			except OSError:
+				break
+			lines=received.split(b'\r\n')
+			received=lines.pop()
+			with self.__condition:
+				for line in lines:
+					self.__responses.append((time.time()+self.__latency,b'OK '+line+b'\r\n'))
+				self.__condition.notify()
+	def __write(self):
+		while self.__running:
+			with self.__condition:
+				while self.__running and not self.__responses:
+					self.__condition.wait(0.1)
+				if not self.__running:
+					break
+				(dueTime,response)=self.__responses[0]
+				if dueTime>time.time():
+					self.__condition.wait(dueTime-time.time())
+					continue
+				self.__responses.popleft()
+			os.write(self.__master,response)
+	def close(self):
+		self.__running=False
+		for fd in (self.__master,self.__slave):
+			try:
+				os.close(fd)
+			except OSError:
+				pass
+
+def benchmark(numberOfCommands=1000,latency=0.005,window=16):
+	device=SimulatedDevice(latency)
+	serialByteSource=sd2.SerialByteSource(serial.Serial(port=device.port,baudrate=115200,timeout=0))
+	multiplexer=CommandMultiplexer(serialByteSource,match='key',responseKey=rb'^OK (\d+)',window=window,timeout=5.0).attach()
+	serialByteSource.start(0.0001)
+	time.sleep(0.1)
+	results={}
+	try:
+		# stop-and-wait: a single command at a time
+		startTime=time.time()
+		for _ in range(numberOfCommands):
+			multiplexer.request(b'{seq} MEASURE')
+		results['stop-and-wait']=numberOfCommands/(time.time()-startTime)
+		# pipelined: up to window commands in flight
+		startTime=time.time()
+		futures=[multiplexer.send(b'{seq} MEASURE') for _ in range(numberOfCommands)]
+		for future in futures:
+			future.result()
+		results['pipelined (window '+str(window)+')']=numberOfCommands/(time.time()-startTime)
+	finally:
+		multiplexer.close()
+		serialByteSource.stop()
+		time.sleep(0.1)
+		device.close()
+	for (name,commandsPerSecond) in results.items():
+		print(name+": "+str(round(commandsPerSecond))+" commands/s")
+	print(repr(multiplexer))
+	return results
+
+if __name__=='__main__':
+	benchmark(*([int(sys.argv[1])] if len(sys.argv)>1 else [])+([float(sys.argv[2])/1000] if len(sys.argv)>2 else [])+([int(sys.argv[3])] if len(sys.argv)>3 else []))
@@ -0,0 +1,285 @@
+"""
+Server-side subscription filtering: every subscriber only receives the lines matching its filter set
+- FilteringByteConsumer delivers every BytesRead it consumes to the subscribers (any ByteConsumer, local or network) whose filters match
+- a filter set consists of prefixes, literal substrings and/or regular expressions (bytes), a subscriber without any filter receives everything
+- the filters of all subscribers are evaluated together, so the matching cost of prefixes and substrings does not grow with the number of subscribers:
+  prefixes: a single dictionary lookup per distinct prefix length
+  substrings: a single pass over the line through a shared (Aho-Corasick) automaton of all substrings (a dictionary lookup per byte, about 4 µs on a NMEA sentence)
+  regular expressions: a single precompiled search per distinct regular expression (however many subscribers share it)
+  NOTE so only distinct regular expressions add to the cost (about 0.15 µs each on a NMEA sentence), a combined one is no cheaper as Python's re tries every alternative at every position
+- the matcher is rebuilt (and swapped) on every subscription change, so subscribing never blocks the serial thread
+- every subscriber has its own match counter (see getNumberOfMatched())
+- SubscriptionServer lets network subscribers register a filter set over TCP by sending a single line of space-separated filters:
+  prefix:<prefix> substring:<substring> regex:<regular expression> (or an empty line for everything)
+  what matches is sent as in sd2unix with stream framing (length, timestamp, bytes), run this module from the command line to subscribe:
+  python sd2filter.py <host> <port> [<filter> ...]
+
+Usage:
+f=sd2filter.FilteringByteConsumer()
+f.addSubscriber(sd2.UDPByteConsumer(2222),prefixes=(b'$GPGGA',b'$GPRMC'))
+s.setByteConsumer(sd2.LineByteProcessor(f))
+sd2filter.SubscriptionServer(f,2224)
+"""
+
+import collections
+import re
+import socket
+import sys
+import threading
+import serialdata2 as sd2
+import sd2unix
+
+# SubstringAutomaton finds all (subscriber indices of the) substrings occurring in a line in a single pass (Aho-Corasick)
+class SubstringAutomaton:
+	# substringIndices: the subscriber indices by (non-empty) substring
+	def __init__(self,substringIndices):
+		# the trie: the next state by byte per state, and the subscriber indices of the substrings ending in a state
+		trie=[{}]
+		outputs={}
+		for (substring,indices) in substringIndices.items():
+			state=0
+			for byte in substring:
+				if byte not in trie[state]:
+					trie.append({})
+					trie[state][byte]=len(trie)-1
+				state=trie[state][byte]
+			outputs[state]=outputs.get(state,frozenset())|frozenset(indices)
+		# the complete transitions (no failure links to follow while matching): those of the failure state overridden by the trie's own
+		self.transitions=[None]*len(trie)
+		self.transitions[0]=dict(trie[0])
+		failures=collections.deque((state,0) for state in trie[0].values())
+		while failures:
+			(state,failure)=failures.popleft()
+			self.transitions[state]={**self.transitions[failure],**trie[state]}
+			if failure in outputs:
+				outputs[state]=outputs.get(state,frozenset())|outputs[failure]
+			for (byte,nextState) in trie[state].items():
+				failures.append((nextState,self.transitions[failure].get(byte,0)))
+		self.outputs=outputs
+	# matched() returns the subscriber indices of the substrings occurring in the given line
+	def matched(self,line):
+		result=set()
+		transitions=self.transitions
+		outputs=self.outputs
+		state=0
+		for byte in line:
+			state=transitions[state].get(byte,0)
+			if state in outputs:
+				result|=outputs[state]
+		return result
+
+# Matcher holds the combined filters of all subscribers (never changed once built)
+class Matcher:
+	def __init__(self,subscribers):
+		self.subscribers=subscribers # (name,byteConsumer,prefixes,substrings,regexes) tuples
+		# an empty substring matches everything
+		self.everyone=frozenset(index for index in range(len(subscribers)) if not any(subscribers[index][2:]) or b'' in subscribers[index][3])
+		# prefixes: the subscriber indices by prefix, by prefix length
+		prefixTables={}
+		substringIndices={}
+		regexIndices={}
+		for (index,(name,byteConsumer,prefixes,substrings,regexes)) in enumerate(subscribers):
+			for prefix in prefixes:
+				prefixTables.setdefault(len(prefix),{}).setdefault(prefix,set()).add(index)
+			for substring in substrings:
+				if substring:
+					substringIndices.setdefault(substring,set()).add(index)
+			for regex in regexes:
+				regexIndices.setdefault(regex,set()).add(index)
+		self.prefixTables=tuple((length,dict((prefix,frozenset(indices)) for (prefix,indices) in table.items())) for (length,table) in prefixTables.items())
+		self.substringAutomaton=SubstringAutomaton(substringIndices) if substringIndices else None
+		# regular expressions: the subscriber indices by (the search method of the) precompiled distinct regular expression
+		self.searches=tuple((re.compile(regex).search,frozenset(indices)) for (regex,indices) in regexIndices.items())
+	# matched() returns the (sorted) indices of the subscribers the given line should be delivered to
+	def matched(self,line):
+		indices=set(self.everyone)
+		for (length,table) in self.prefixTables:
+			prefixIndices=table.get(line[:length])
+			if prefixIndices:
+				indices|=prefixIndices
+		if self.substringAutomaton is not None:
+			indices|=self.substringAutomaton.matched(line)
+		for (search,searchIndices) in self.searches:
+			if search(line) is not None:
+				indices|=searchIndices
+		return sorted(indices)
+
+# _toBytes() returns the given filter as bytes (a str is UTF-8 encoded)
+def _toBytes(value):
+	if isinstance(value,str):
+		return value.encode('utf-8')
+	return bytes(value)
+
+# prefixes, substrings and regexes: bytes (or str, UTF-8 encoded)
+class FilteringByteConsumer(sd2.ByteConsumer):
+	def __init__(self):
+		super().__init__()
+		self.__lock=threading.Lock() # serializes subscription changes
+		self.__matcher=Matcher(())
+		self.__numberOfMatched={} # by subscriber name
+		self.__numberOfFailed={}
+		self.__numberOfSubscribers=0
+	def __rebuilt(self,subscribers):
+		self.__matcher=Matcher(tuple(subscribers)) # atomic swap
+	# addSubscriber() returns the name of the subscriber (to remove it with)
+	def addSubscriber(self,byteConsumer,prefixes=(),substrings=(),regexes=(),name=None):
+		if not isinstance(byteConsumer,sd2.ByteConsumer):
+			raise Exception("No (proper) byte consumer specified.")
+		prefixes=tuple(_toBytes(prefix) for prefix in prefixes)
+		substrings=tuple(_toBytes(substring) for substring in substrings)
+		regexes=tuple(_toBytes(regex) for regex in regexes)
+		for regex in regexes:
+			re.compile(regex) # raises if invalid
+		with self.__lock:
+			self.__numberOfSubscribers+=1
+			if name is None:
+				name='subscriber'+str(self.__numberOfSubscribers)
+			if any(subscriber[0]==name for subscriber in self.__matcher.subscribers):
+				raise Exception("Subscriber '"+name+"' already subscribed.")
+			self.__numberOfMatched[name]=0
+			self.__numberOfFailed[name]=0
+			self.__rebuilt(self.__matcher.subscribers+((name,byteConsumer,prefixes,substrings,regexes),))
+		return name
+	def removeSubscriber(self,name):
+		with self.__lock:
+			subscribers=tuple(subscriber for subscriber in self.__matcher.subscribers if subscriber[0]!=name)
+			if len(subscribers)==len(self.__matcher.subscribers):
+				return False
+			self.__rebuilt(subscribers)
+		return True
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			matcher=self.__matcher
+			subscribers=matcher.subscribers
+			for index in matcher.matched(bytes(bytesRead)):
+				(name,byteConsumer)=subscribers[index][:2]
+				self.__numberOfMatched[name]+=1
+				try:
+					if not byteConsumer.consumed(bytesRead):
+						self.__numberOfFailed[name]+=1
+				except Exception as ex:
+					self.__numberOfFailed[name]+=1
+					self._reporting("ERROR: '"+str(ex)+"' delivering '"+str(bytesRead)+"' to subscriber '"+name+"'.")
+			return True
+		return False
+	def getSubscriberNames(self):
+		return [subscriber[0] for subscriber in self.__matcher.subscribers]
+	def getNumberOfMatched(self,name):
+		return self.__numberOfMatched.get(name)
+	def getNumberOfFailed(self,name):
+		return self.__numberOfFailed.get(name)
+	def __repr__(self):
+		return super().__repr__()+"".join(" - "+subscriber[0]+": matched="+str(self.__numberOfMatched[subscriber[0]])+" failed="+str(self.__numberOfFailed[subscriber[0]]) for subscriber in self.__matcher.subscribers)
+
+# TCPSubscriberByteConsumer sends what it consumes to a single network subscriber (never blocking, dropping the oldest when it can't keep up)
+# disconnected: a callable called (with the TCPSubscriberByteConsumer) as soon as sending fails because the subscriber disconnected
+class TCPSubscriberByteConsumer(sd2.ByteConsumer):
+	def __init__(self,connection,maxQueued=1024,disconnected=None):
+		super().__init__()
+		self.__subscriber=sd2unix.Subscriber(connection,maxQueued,True)
+		self.__disconnected=disconnected
+		self.connected=True
+	def consumed(self,bytesRead):
+		if self.connected and super().consumed(bytesRead):
+			self.__subscriber.queued(sd2unix.HEADER.pack(bytesRead.getTime()),bytes(bytesRead))
+			if not self.__subscriber.flush():
+				self.connected=False
+				if self.__disconnected is not None:
+					self.__disconnected(self)
+				return False
+			return True
+		return False
+	def close(self):
+		self.connected=False
+		self.__subscriber.close()
+
+# parseFilters() returns the prefixes, substrings and regular expressions in a subscription request line
+def parseFilters(request):
+	filters={b'prefix':[],b'substring':[],b'regex':[]}
+	for word in request.split():
+		(kind,_,value)=word.partition(b':')
+		if kind not in filters or not value:
+			raise Exception("Invalid filter '"+str(word)+"'.")
+		filters[kind].append(value)
+	return (filters[b'prefix'],filters[b'substring'],filters[b'regex'])
+
+class SubscriptionServer(sd2.Reporter):
+	def __init__(self,filteringByteConsumer,port,host='0.0.0.0',maxQueued=1024):
+		super().__init__()
+		self.__filteringByteConsumer=filteringByteConsumer
+		self.__maxQueued=maxQueued
+		self.__subscribers={} # the TCPSubscriberByteConsumer by subscriber name
+		self.__lock=threading.Lock() # guards the subscribers (changed by the subscribing threads and, when disconnecting, by the serial thread)
+		self.__socket=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.__socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		self.__socket.bind((host,port))
+		self.__socket.listen()
+		self.port=self.__socket.getsockname()[1]
+		threading.Thread(target=self.__accept,name='sd2filteraccept',daemon=True).start()
+	def __accept(self):
+		while True:
+			try:
+				(connection,address)=self.__socket.accept()
+			except OSError:
+				break
+			threading.Thread(target=self.__subscribe,args=(connection,address),daemon=True).start()
+	def __subscribe(self,connection,address):
+		try:
+			connection.settimeout(5.0)
+			request=b''
+			while not request.endswith(b'\n') and len(request)<4096:
+				received=connection.recv(4096)
+				if not received:
+					raise Exception("Disconnected.")
+				request+=received
+			(prefixes,substrings,regexes)=parseFilters(request)
+			subscriber=TCPSubscriberByteConsumer(connection,self.__maxQueued,self.__disconnected)
+			# NOTE registering under the lock, so a subscriber disconnecting right away is only removed once registered
+			with self.__lock:
+				name=self.__filteringByteConsumer.addSubscriber(subscriber,prefixes,substrings,regexes)
+				self.__subscribers[name]=subscriber
+		except Exception as ex:
+			self._reporting("ERROR: '"+str(ex)+"' subscribing "+str(address)+".")
+			connection.close()
+			return
+		self._reporting("Subscriber "+str(address)+" subscribed as '"+name+"' to "+str(request.strip())+".")
+	# __disconnected() removes a subscriber as soon as sending to it failed (called on the serial thread)
+	def __disconnected(self,subscriber):
+		with self.__lock:
+			for (name,otherSubscriber) in list(self.__subscribers.items()):
+				if otherSubscriber is subscriber:
+					self.__filteringByteConsumer.removeSubscriber(name)
+					del self.__subscribers[name]
+					self._reporting("Subscriber '"+name+"' disconnected.")
+		subscriber.close()
+	def getNumberOfSubscribers(self):
+		return len(self.__subscribers)
+	def close(self):
+		self.__socket.close()
+		with self.__lock:
+			for (name,subscriber) in list(self.__subscribers.items()):
+				self.__filteringByteConsumer.removeSubscriber(name)
+				subscriber.close()
+			self.__subscribers={}
+
+def main(args):
+	if len(args)<2:
+		print("Need the host and port to subscribe to (optionally followed by filters e.g. prefix:$GPGGA substring:ERR regex:^\\$GP(GGA|RMC))!")
+		return
+	connection=socket.create_connection((args[0],int(args[1])))
+	connection.sendall(' '.join(args[2:]).encode('utf-8')+b'\n')
+	buffer=b''
+	while True:
+		received=connection.recv(1<<16)
+		if not received:
+			break
+		buffer+=received
+		while len(buffer)>=sd2unix.LENGTH.size and len(buffer)>=sd2unix.LENGTH.size+sd2unix.LENGTH.unpack_from(buffer)[0]:
+			length=sd2unix.LENGTH.unpack_from(buffer)[0]
+			message=buffer[sd2unix.LENGTH.size:sd2unix.LENGTH.size+length]
+			buffer=buffer[sd2unix.LENGTH.size+length:]
+			print("Received: '"+str(sd2.BytesRead(message[sd2unix.HEADER.size:],sd2unix.HEADER.unpack_from(message)[0]))+"'.")
+	print("Publisher gone.")
+
+if __name__=='__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,299 @@
+"""
+Disk-backed store-and-forward of BytesRead to a (network) output that may be down or slow
+- StoreAndForwardByteProcessor queues whatever it consumes in memory for at most flushInterval seconds (so ingest never waits for the output)
+- a writer thread appends the queued BytesRead in batches to segment files in a directory, with a single fsync per batch (group commit)
+- a forwarder thread replays the segment files in order to the next byte consumer, retrying (every retryInterval seconds) while it fails
+- segment files forwarded entirely are deleted, the forwarding position is kept in a cursor file so forwarding resumes after a restart
+  NOTE delivery is at least once: what was forwarded after the cursor was last saved is forwarded again after a restart
+- catching up after an outage can be limited to maxRate BytesRead per second and/or maxByteRate bytes per second
+- memory use does not depend on the length of an outage, maxBytes (if set) limits the disk use by dropping the oldest segment files
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2forward.StoreAndForwardByteProcessor(sd2.UDPByteConsumer(2222),'/var/tmp/sd2forward',maxRate=5000)))
+"""
+
+import os
+import struct
+import tempfile
+import threading
+import time
+import serialdata2 as sd2
+
+RECORDHEADER=struct.Struct('<IdH') # data length, time, source id length (NOSOURCEID if none)
+NOSOURCEID=0xFFFF
+CURSOR=struct.Struct('<QQ') # segment index, offset
+CURSORFILENAME='cursor'
+SEGMENTEXTENSION='.sd2q'
+
+def _encoded(bytesRead):
+	sourceId=bytesRead.getSourceId()
+	if sourceId is None:
+		return RECORDHEADER.pack(len(bytesRead),bytesRead.getTime(),NOSOURCEID)+bytesRead
+	sourceId=str(sourceId).encode('utf-8')
+	return RECORDHEADER.pack(len(bytesRead),bytesRead.getTime(),len(sourceId))+sourceId+bytesRead
+
+# _decoded() returns the BytesRead records in the given buffer (from the given offset) and the end offset of every one of them
+def _decoded(buffer,offset=0):
+	bytesReadList=[]
+	endOffsets=[]
+	while offset+RECORDHEADER.size<=len(buffer):
+		(length,time_,sourceIdLength)=RECORDHEADER.unpack_from(buffer,offset)
+		dataOffset=offset+RECORDHEADER.size+(sourceIdLength,0)[sourceIdLength==NOSOURCEID]
+		if dataOffset+length>len(buffer): # incomplete
+			break
+		sourceId=(None,buffer[offset+RECORDHEADER.size:dataOffset].decode('utf-8'))[sourceIdLength!=NOSOURCEID]
+		bytesReadList.append(sd2.BytesRead(buffer[dataOffset:dataOffset+length],time_,sourceId))
+		offset=dataOffset+length
+		endOffsets.append(offset)
+	return (bytesReadList,endOffsets)
+
+class StoreAndForwardByteProcessor(sd2.ByteProcessor):
+	# directory: where to keep the segment files and cursor (a temporary directory by default)
+	# segmentSize: the size (in bytes) beyond which a new segment file is started
+	# flushInterval: how long (in seconds) the writer collects BytesRead before writing them as a single batch (unless maxBatchSize is reached first)
+	def __init__(self,nextByteConsumer=None,directory=None,segmentSize=1<<24,maxBytes=None,flushInterval=0.05,maxBatchSize=10000,maxRate=None,maxByteRate=None,retryInterval=1.0,readSize=1<<16):
+		super().__init__(nextByteConsumer)
+		if not isinstance(segmentSize,int) or segmentSize<=0:
+			raise Exception("Invalid segment size.")
+		if directory is None:
+			directory=tempfile.mkdtemp(prefix='sd2forward')
+		os.makedirs(directory,exist_ok=True)
+		self.__directory=directory
+		self.__segmentSize=segmentSize
+		self.__maxBytes=maxBytes
+		self.__flushInterval=flushInterval
+		self.__maxBatchSize=maxBatchSize
+		self.__maxRate=maxRate
+		self.__maxByteRate=maxByteRate
+		self.__retryInterval=retryInterval
+		self.__readSize=readSize
+		self.__batch=[] # what was consumed but not written yet
+		self.__condition=threading.Condition() # guards the batch, the segment sizes and the committed position
+		# resume where we left off: forward from the cursor, never append to existing segment files
+		self.__segmentSizes=dict((index,os.path.getsize(self.__getSegmentPath(index))) for index in self.__getSegmentIndices())
+		(self.__readIndex,self.__readOffset)=self.__loadCursor()
+		if self.__readIndex not in self.__segmentSizes:
+			(self.__readIndex,self.__readOffset)=(min(self.__segmentSizes.keys(),default=1),0)
+		for index in [index for index in self.__segmentSizes.keys() if index<self.__readIndex]: # already forwarded
+			self.__removeSegment(index)
+		self.__writeIndex=max(self.__segmentSizes.keys(),default=0)+1
+		self.__writeFile=None
+		self.numberOfStored=0
+		self.numberOfForwarded=0
+		self.numberOfFailures=0 # the number of times forwarding failed
+		self.numberOfDroppedBytes=0 # because of maxBytes
+		self.__running=True
+		self.__writer=threading.Thread(target=self.__write,name='sd2forwardwriter',daemon=True)
+		self.__forwarder=threading.Thread(target=self.__forward,name='sd2forwarder',daemon=True)
+		self.__writer.start()
+		self.__forwarder.start()
+
+	def __getSegmentPath(self,index):
+		return os.path.join(self.__directory,'%016d' % index+SEGMENTEXTENSION)
+	def __getSegmentIndices(self):
+		return sorted(int(fileName[:-len(SEGMENTEXTENSION)]) for fileName in os.listdir(self.__directory) if fileName.endswith(SEGMENTEXTENSION) and fileName[:-len(SEGMENTEXTENSION)].isdigit())
+	def __removeSegment(self,index):
+		self.__segmentSizes.pop(index,None)
+		try:
+			os.remove(self.__getSegmentPath(index))
+		except OSError:
+			pass
+	def __loadCursor(self):
+		try:
+			with open(os.path.join(self.__directory,CURSORFILENAME),'rb') as cursorFile:
+				return CURSOR.unpack(cursorFile.read(CURSOR.size))
+		except (OSError,struct.error):
+			return (0,0)
+	def __saveCursor(self):
+		cursorPath=os.path.join(self.__directory,CURSORFILENAME)
+		with open(cursorPath+'.tmp','wb') as cursorFile:
+			cursorFile.write(CURSOR.pack(self.__readIndex,self.__readOffset))
+		os.replace(cursorPath+'.tmp',cursorPath)
+
+	def _processed(self,bytesRead):
+		with self.__condition:
+			self.__batch.append(bytesRead)
+			if len(self.__batch)>=self.__maxBatchSize:
+				self.__condition.notify_all()
+		return True
+	def _processedBatch(self,bytesReadList):
+		with self.__condition:
+			self.__batch.extend(bytesReadList)
+			if len(self.__batch)>=self.__maxBatchSize:
+				self.__condition.notify_all()
+		return len(bytesReadList)
+
+	def __write(self):
+		while True:
+			with self.__condition:
+				if self.__running and len(self.__batch)<self.__maxBatchSize:
+					self.__condition.wait(self.__flushInterval)
+				(batch,self.__batch)=(self.__batch,[])
+				running=self.__running
+			if batch:
+				try:
+					self.__written(batch)
+				except Exception as ex:
+					self._reporting("ERROR: '"+str(ex)+"' in storing "+str(len(batch))+" BytesRead.")
+			if not running:
+				break
+		if self.__writeFile is not None:
+			self.__writeFile.close()
+			self.__writeFile=None
+
+	def __written(self,batch):
+		if self.__writeFile is None:
+			self.__writeFile=open(self.__getSegmentPath(self.__writeIndex),'ab')
+		data=b''.join(map(_encoded,batch))
+		self.__writeFile.write(data)
+		self.__writeFile.flush()
+		os.fsync(self.__writeFile.fileno()) # once for the entire batch
+		with self.__condition:
+			self.__segmentSizes[self.__writeIndex]=self.__segmentSizes.get(self.__writeIndex,0)+len(data)
+			self.numberOfStored+=len(batch)
+			if self.__segmentSizes[self.__writeIndex]>=self.__segmentSize: # start a new segment file with the next batch
+				self.__writeFile.close()
+				self.__writeFile=None
+				self.__writeIndex+=1
+			if self.__maxBytes is not None:
+				while len(self.__segmentSizes)>1 and sum(self.__segmentSizes.values())>self.__maxBytes:
+					oldestIndex=min(self.__segmentSizes.keys())
+					if oldestIndex==self.__writeIndex:
+						break
+					self.numberOfDroppedBytes+=self.__segmentSizes[oldestIndex]-(0,self.__readOffset)[oldestIndex==self.__readIndex]
+					self.__removeSegment(oldestIndex)
+					if oldestIndex==self.__readIndex:
+						(self.__readIndex,self.__readOffset)=(oldestIndex+1,0)
+			self.__condition.notify_all()
+
+	# __limited() sleeps as long as needed to stay within the catch-up rate limits
+	def __limited(self,numberOfBytesRead,numberOfBytes,nextTime):
+		duration=max(numberOfBytesRead/self.__maxRate if self.__maxRate else 0,numberOfBytes/self.__maxByteRate if self.__maxByteRate else 0)
+		now=time.time()
+		if nextTime>now:
+			time.sleep(nextTime-now)
+			now=nextTime
+		return now+duration
+
+	def __forward(self):
+		readFile=None
+		readFileIndex=None
+		nextTime=0.0 # when the rate limits allow forwarding the next batch
+		cursorTime=time.time()
+		while True:
+			with self.__condition:
+				# wait for something to forward
+				while self.__running and self.__readOffset>=self.__segmentSizes.get(self.__readIndex,0) and self.__readIndex>=self.__writeIndex:
+					self.__condition.wait(1.0)
+				if not self.__running:
+					break
+				(readIndex,readOffset)=(self.__readIndex,self.__readOffset)
+				committedSize=self.__segmentSizes.get(readIndex,0)
+				finished=readIndex<self.__writeIndex # nothing will be appended to it anymore
+			if readOffset>=committedSize:
+				if finished: # move on to the next segment file
+					with self.__condition:
+						if self.__readIndex==readIndex:
+							self.__removeSegment(readIndex)
+							(self.__readIndex,self.__readOffset)=(readIndex+1,0)
+							self.__saveCursor()
+					if readFile is not None:
+						readFile.close()
+						readFile=None
+				continue
+			if readFileIndex!=readIndex or readFile is None:
+				if readFile is not None:
+					readFile.close()
+				try:
+					readFile=open(self.__getSegmentPath(readIndex),'rb')
+				except OSError: # dropped in the meantime
+					readFile=None
+					continue
+				readFileIndex=readIndex
+			readFile.seek(readOffset)
+			buffer=readFile.read(min(committedSize-readOffset,self.__readSize))
+			(bytesReadList,endOffsets)=_decoded(buffer)
+			if not bytesReadList:
+				if len(buffer)<self.__readSize: # a truncated record at the end (e.g. after a crash)
+					with self.__condition:
+						if self.__readIndex==readIndex:
+							self.__readOffset=committedSize
+				else: # a record larger than what we read at once
+					self.__readSize*=2
+				continue
+			if self.__maxRate or self.__maxByteRate:
+				nextTime=self.__limited(len(bytesReadList),endOffsets[-1],nextTime)
+			numberOfForwarded=self._pushedBatch(bytesReadList)
+			with self.__condition:
+				self.numberOfForwarded+=numberOfForwarded
+				if self.__readIndex==readIndex and self.__readOffset==readOffset: # not dropped in the meantime
+					self.__readOffset+=(0,endOffsets[numberOfForwarded-1])[numberOfForwarded>0]
+			if numberOfForwarded<len(bytesReadList): # the output is down (or too slow)
+				self.numberOfFailures+=1
+				time.sleep(self.__retryInterval)
+			if time.time()-cursorTime>=1.0:
+				cursorTime=time.time()
+				with self.__condition:
+					self.__saveCursor()
+		if readFile is not None:
+			readFile.close()
+		with self.__condition:
+			self.__saveCursor()
+
+	# getBacklog() returns the number of bytes stored but not forwarded yet
+	def getBacklog(self):
+		with self.__condition:
+			return sum(size for (index,size) in self.__segmentSizes.items() if index>=self.__readIndex)-self.__readOffset
+	def getDirectory(self):
+		return self.__directory
+
+	# stop() writes what is still queued and stops forwarding (what is not forwarded yet remains on disk)
+	def stop(self,timeout=None):
+		with self.__condition:
+			self.__running=False
+			self.__condition.notify_all()
+		self.__writer.join(timeout)
+		self.__forwarder.join(timeout)
+		return self
+
+	def __repr__(self):
+		return super().__repr__()+" - stored: "+str(self.numberOfStored)+" - forwarded: "+str(self.numberOfForwarded)+" - backlog: "+str(self.getBacklog())+" bytes - failures: "+str(self.numberOfFailures)+" - dropped: "+str(self.numberOfDroppedBytes)+" bytes"
+
+# OutageByteConsumer simulates an output that is down for a while
+class OutageByteConsumer(sd2.ByteConsumer):
+	def __init__(self):
+		super().__init__()
+		self.down=True
+		self.numberOfReceived=0
+	def consumed(self,bytesRead):
+		if self.down or not super().consumed(bytesRead):
+			return False
+		self.numberOfReceived+=1
+		return True
+
+def benchmark(numberOfBytesRead=200000,maxRate=100000):
+	import tracemalloc
+	outageByteConsumer=OutageByteConsumer()
+	storeAndForward=StoreAndForwardByteProcessor(outageByteConsumer,segmentSize=1<<22,maxRate=maxRate,retryInterval=0.1)
+	line=b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47'
+	tracemalloc.start()
+	startTime=time.time()
+	for index in range(numberOfBytesRead):
+		storeAndForward.consumed(sd2.BytesRead(line,None,'port1'))
+	ingestTime=time.time()-startTime
+	while storeAndForward.numberOfStored<numberOfBytesRead:
+		time.sleep(0.01)
+	(_,peak)=tracemalloc.get_traced_memory()
+	print("Ingested (output down): "+str(round(numberOfBytesRead/ingestTime))+" BytesRead/s - stored: "+str(storeAndForward.numberOfStored)+" - backlog: "+str(storeAndForward.getBacklog())+" bytes - peak traced memory: "+str(peak>>10)+" KiB")
+	outageByteConsumer.down=False
+	startTime=time.time()
+	while outageByteConsumer.numberOfReceived<numberOfBytesRead:
+		time.sleep(0.01)
+	catchUpTime=time.time()-startTime
+	tracemalloc.stop()
+	print("Caught up in "+str(round(catchUpTime,2))+" s: "+str(round(numberOfBytesRead/catchUpTime))+" BytesRead/s (limit: "+str(maxRate)+")")
+	storeAndForward.stop()
+	print(repr(storeAndForward))
+
+if __name__=='__main__':
+	benchmark()
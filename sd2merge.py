@@ -0,0 +1,194 @@
+"""
+Time-ordered k-way merge of multiple serialdata2 sources
+- every source pushes into its own MergeInput (a ByteConsumer) which tags what it consumes with the source id
+- the TimeOrderedMerger keeps a heap ordered by BytesRead.getTime() and pushes along to its single byte consumer
+- a BytesRead is released as soon as all active sources have passed its time, or when it has waited longer than the reorder window (max lateness)
+- sources that have been silent for longer than the idle timeout do not hold back the watermark, so a silent port never stalls the output
+"""
+
+import _thread
+import heapq
+import threading
+import time
+import serialdata2 as sd2
+
+# a MergeInput passes everything it consumes on to its merger, remembering the time of the last BytesRead consumed
+class MergeInput(sd2.ByteConsumer):
+	def __init__(self,merger,sourceId):
+		super().__init__()
+		self.__merger=merger
+		self.__sourceId=sourceId
+		self.__lastTime=None # the timestamp of the last BytesRead consumed
+		self.__lastSeen=None # when the last BytesRead was consumed (wall clock)
+	def getSourceId(self):
+		return self.__sourceId
+	def getLastTime(self):
+		return self.__lastTime
+	def getLastSeen(self):
+		return self.__lastSeen
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			self.__lastTime=bytesRead.getTime()
+			self.__lastSeen=time.time()
+			return self.__merger._merged(self,bytesRead)
+		return False
+	def __str__(self):
+		return str(self.__sourceId)
+
+class TimeOrderedMerger(sd2.ByteProducer):
+	def __init__(self,byteConsumer=None,maxLateness=0.1,idleTimeout=1.0):
+		super().__init__(byteConsumer)
+		if not isinstance(maxLateness,(int,float)) or maxLateness<0:
+			raise Exception("Invalid maximum lateness.")
+		if not isinstance(idleTimeout,(int,float)) or idleTimeout<=0:
+			raise Exception("Invalid idle timeout.")
+		self.__maxLateness=maxLateness
+		self.__idleTimeout=idleTimeout
+		self.__inputs={} # the merge inputs by source id
+		self.__heap=[]
+		self.__sequence=0 # tie breaker keeping BytesRead with equal timestamps in arrival order
+		self.__lock=threading.Lock()
+		self.__watermark=0.0 # everything up to the watermark has been pushed along
+		self.__numberOfMerged=0
+		self.__numberOfPushed=0
+		self.__numberOfUnpushed=0
+		self.__numberOfLate=0 # BytesRead that arrived behind the watermark
+		self.__running=False
+
+	# addSource() makes the given byte producer (typically a SerialByteSource) push into a new merge input
+	def addSource(self,byteProducer,sourceId=None):
+		if not isinstance(byteProducer,sd2.ByteProducer):
+			raise Exception("No (proper) byte producer specified.")
+		if sourceId is None:
+			sourceId=str(byteProducer)
+		byteProducer.setByteConsumer(self.getInput(sourceId))
+		return self
+	# getInput() returns the merge input of the given source id (created JIT)
+	def getInput(self,sourceId):
+		if sourceId not in self.__inputs:
+			inputs=dict(self.__inputs) # replace the dictionary (iterated by __getWatermark) instead of changing it
+			inputs[sourceId]=MergeInput(self,sourceId)
+			self.__inputs=inputs
+		return self.__inputs[sourceId]
+	def getSourceIds(self):
+		return self.__inputs.keys()
+
+	def __getWatermark(self,now):
+		# anything older than the reorder window is released anyway
+		watermark=now-self.__maxLateness
+		activeWatermark=None
+		for mergeInput in self.__inputs.values():
+			lastSeen=mergeInput.getLastSeen()
+			if lastSeen is None or now-lastSeen>self.__idleTimeout: # silent port: not holding back the output
+				continue
+			if activeWatermark is None or mergeInput.getLastTime()<activeWatermark:
+				activeWatermark=mergeInput.getLastTime()
+		if activeWatermark is not None and activeWatermark>watermark:
+			watermark=activeWatermark
+		return watermark
+
+	# NOTE __emit() should be called with the lock acquired
+	def __emit(self,now):
+		watermark=self.__getWatermark(now)
+		if watermark>self.__watermark:
+			self.__watermark=watermark
+		bytesReadList=[]
+		while self.__heap and self.__heap[0][0]<=self.__watermark:
+			bytesReadList.append(heapq.heappop(self.__heap)[2])
+		while bytesReadList: # pushing along everything that is due as a single batch
+			numberOfPushed=self._pushedBatch(bytesReadList)
+			self.__numberOfPushed+=numberOfPushed
+			if numberOfPushed>=len(bytesReadList):
+				break
+			# the batch push stops at the first failure: count that one as unpushed (as a single push would) and continue with the rest
+			self.__numberOfUnpushed+=1
+			self._reporting("ERROR: Failed to push along '"+str(bytesReadList[numberOfPushed])+"' of source '"+str(bytesReadList[numberOfPushed].getSourceId())+"'.")
+			bytesReadList=bytesReadList[numberOfPushed+1:]
+
+	def _merged(self,mergeInput,bytesRead):
+		with self.__lock:
+			bytesRead.setSourceId(mergeInput.getSourceId())
+			if bytesRead.getTime()<self.__watermark:
+				self.__numberOfLate+=1
+			heapq.heappush(self.__heap,(bytesRead.getTime(),self.__sequence,bytesRead))
+			self.__sequence+=1
+			self.__numberOfMerged+=1
+			self.__emit(time.time())
+		return True
+
+	# tick() releases what is due without any BytesRead coming in (typically called by the watermark thread)
+	def tick(self):
+		with self.__lock:
+			self.__emit(time.time())
+		return self
+	# flush() pushes along everything still held back (e.g. when done)
+	def flush(self):
+		with self.__lock:
+			watermark=self.__watermark
+			self.__watermark=float('inf')
+			self.__emit(time.time())
+			self.__watermark=watermark
+		return self
+
+	def __run(self,_interval):
+		self.__running=True
+		while self.__running:
+			self.tick()
+			time.sleep(_interval)
+
+	# start() and stop() the thread advancing the watermark when all sources are silent
+	def start(self,_interval=None):
+		if _interval is None:
+			_interval=self.__maxLateness/2
+		if not isinstance(_interval,(int,float)) or _interval<=0:
+			self._reporting("Watermark interval invalid.")
+			return None
+		if not self.__running:
+			self.__running=True
+			_thread.start_new_thread(self.__run,(_interval,))
+		return self
+	def stop(self):
+		self.__running=False
+		return self.flush()
+	def isRunning(self):
+		return self.__running
+
+	def __repr__(self):
+		return super().__repr__()+" - sources: "+str(len(self.__inputs))+" - merged: "+str(self.__numberOfMerged)+" - pushed: "+str(self.__numberOfPushed)+" - unpushed: "+str(self.__numberOfUnpushed)+" - late: "+str(self.__numberOfLate)+" - held: "+str(len(self.__heap))
+
+# a ByteConsumer checking the order of what it consumes (used by benchmark())
+class OrderCheckingByteConsumer(sd2.ByteConsumer):
+	def __init__(self):
+		super().__init__()
+		self.numberOfConsumed=0
+		self.numberOfOutOfOrder=0
+		self.__lastTime=0.0
+	def consumed(self,bytesRead):
+		if bytesRead.getTime()<self.__lastTime:
+			self.numberOfOutOfOrder+=1
+		self.__lastTime=bytesRead.getTime()
+		self.numberOfConsumed+=1
+		return True
+
+# NOTE the synthetic timestamps lie in the past, so the reorder window should be wide enough not to release everything immediately
+def benchmark(numberOfSources=16,numberOfBytesReadPerSource=20000,maxLateness=3600.0):
+	orderCheckingByteConsumer=OrderCheckingByteConsumer()
+	merger=TimeOrderedMerger(orderCheckingByteConsumer,maxLateness)
+	mergeInputs=[merger.getInput("source"+str(sourceIndex)) for sourceIndex in range(numberOfSources)]
+	# synthetic timestamps: every source produces every millisecond, with some jitter between the sources
+	startTime=time.time()-numberOfBytesReadPerSource*0.001
+	bytesReadList=[]
+	for index in range(numberOfBytesReadPerSource):
+		for sourceIndex in range(numberOfSources):
+			bytesReadList.append((mergeInputs[sourceIndex],sd2.BytesRead(b'$GPGGA,123519,4807.038,N,01131.000,E*47',startTime+index*0.001+((sourceIndex*7)%13)*0.0001)))
+	t=time.perf_counter()
+	for (mergeInput,bytesRead) in bytesReadList:
+		mergeInput.consumed(bytesRead)
+	merger.flush()
+	elapsed=time.perf_counter()-t
+	print("Merged "+str(len(bytesReadList))+" BytesRead of "+str(numberOfSources)+" sources in "+str(round(elapsed,3))+" s ("+str(int(len(bytesReadList)/elapsed))+" per second).")
+	print("Consumed: "+str(orderCheckingByteConsumer.numberOfConsumed)+" - out of order: "+str(orderCheckingByteConsumer.numberOfOutOfOrder)+".")
+	return elapsed
+
+if __name__=='__main__':
+	benchmark()
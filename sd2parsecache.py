@@ -0,0 +1,61 @@
+"""
+Memoized parsing of lines that repeat (e.g. status lines)
+- ParseCache wraps a (user-supplied) line parser in a least recently used cache keyed on the raw line bytes
+- at most maxSize parsed lines are kept, hits, misses and evictions are counted (see getHitRate())
+- it's safe to use from multiple (worker) threads: the lock is not held while parsing, so a line missed by two threads at once may be parsed twice
+  NOTE the same parsed result is returned for every hit, so the parser should return something immutable (e.g. a tuple)
+- memoized() is the decorator equivalent: @sd2parsecache.memoized(1024) in front of the parser
+
+Usage:
+parse=sd2parsecache.ParseCache(parseStatusLine,4096)
+s.setByteConsumer(sd2.LineByteProcessor(sd2shard.ShardingByteConsumer(lambda line:handle(parse(line)))))
+"""
+
+import collections
+import threading
+
+class ParseCache:
+	def __init__(self,parser,maxSize=1024):
+		if not callable(parser):
+			raise Exception("No (proper) parser specified.")
+		if not isinstance(maxSize,int) or maxSize<=0:
+			raise Exception("Invalid maximum size.")
+		self.__parser=parser
+		self.__maxSize=maxSize
+		self.__cache=collections.OrderedDict() # parsed line by line bytes, least recently used first
+		self.__lock=threading.Lock()
+		self.numberOfHits=0
+		self.numberOfMisses=0
+		self.numberOfEvictions=0
+	def __call__(self,line):
+		key=bytes(line) # BytesRead (a bytearray) is not hashable
+		with self.__lock:
+			try:
+				parsed=self.__cache[key]
+				self.__cache.move_to_end(key)
+				self.numberOfHits+=1
+				return parsed
+			except KeyError:
+				self.numberOfMisses+=1
+		parsed=self.__parser(line)
+		with self.__lock:
+			self.__cache[key]=parsed
+			if len(self.__cache)>self.__maxSize:
+				self.__cache.popitem(last=False)
+				self.numberOfEvictions+=1
+		return parsed
+	def getHitRate(self):
+		numberOfLookups=self.numberOfHits+self.numberOfMisses
+		return self.numberOfHits/numberOfLookups if numberOfLookups else 0.0
+	def clear(self):
+		with self.__lock:
+			self.__cache.clear()
+	def __len__(self):
+		return len(self.__cache)
+	def __repr__(self):
+		return "Parse cache of "+str(len(self.__cache))+"/"+str(self.__maxSize)+" - hits: "+str(self.numberOfHits)+" - misses: "+str(self.numberOfMisses)+" - evictions: "+str(self.numberOfEvictions)+" - hit rate: "+str(round(100*self.getHitRate(),1))+"%"
+
+def memoized(maxSize=1024):
+	def decorator(parser):
+		return ParseCache(parser,maxSize)
+	return decorator
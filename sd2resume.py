@@ -0,0 +1,233 @@
+"""
+Resumable network subscribers of a ByteDispatcher using absolute stream offsets
+- every BytesRead received by a ByteDispatcher has an absolute offset (its index since the dispatcher started, see ByteDispatcher.getBytesReadCount())
+- ResumableTCPServer accepts subscribers on a TCP port, a subscriber starts by sending a single line: RESUME <offset> (or LIVE to start at what comes next)
+- every subscriber gets its own ByteSink (registered with the dispatcher at that offset), so the retained history is sent first and live data follows seamlessly
+- every frame holds the kind, offset, timestamp and length of a BytesRead followed by its bytes
+- when (part of) what was asked for was disposed already the subscriber gets a DISPOSED frame holding the offsets skipped before the first BytesRead after them
+  NOTE the dispatcher retains what any connected subscriber has not read yet, to resume after a disconnect it should retain a history of its own
+  (see the retainCount, retainSeconds and retainBytes arguments of ByteDispatcher), or whatever the subscriber missed is disposed as soon as it's gone
+- ResumableSubscriber is the matching client: it keeps track of the next offset and reconnects (resuming there) when the connection drops
+- run this module from the command line to print what is received (resuming after a reconnect):
+  python sd2resume.py <host> <port> [<offset>]
+
+Usage:
+d=sd2.ByteDispatcher('port1',retainSeconds=600.0)
+s.setByteConsumer(sd2.LineByteProcessor(d))
+sd2resume.ResumableTCPServer(d,2223)
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+import serialdata2 as sd2
+
+FRAMEHEADER=struct.Struct('<BQdI') # kind, offset, time, length
+DATA=0
+DISPOSED=1 # offset: the first offset skipped, the data: the offset of the first BytesRead after the skipped ones (as text)
+
+# a SubscriberByteSink sends what it reads from the dispatcher to a single subscriber without ever blocking (the serial thread)
+class SubscriberByteSink(sd2.ByteSink):
+	def __init__(self,connection,name):
+		super().__init__(name)
+		connection.setblocking(False)
+		self.__connection=connection
+		self.__unsent=b'' # what's left of the last frame sent (partially)
+		# guards sending: the serial thread (through update(), holding the dispatcher's lock) and the server's flushing thread both send
+		# NOTE never held while acquiring the dispatcher's lock (i.e. around update())
+		self.__lock=threading.Lock()
+		self.connected=True
+	def __sent(self,frame):
+		try:
+			sent=self.__connection.send(frame)
+		except (BlockingIOError,InterruptedError):
+			sent=0
+		except OSError:
+			self.connected=False
+			return False
+		self.__unsent=frame[sent:]
+		return True
+	def __flushed(self):
+		if self.__unsent and self.connected:
+			self.__sent(self.__unsent)
+		return not self.__unsent
+	def flush(self):
+		with self.__lock:
+			return self.__flushed()
+	def _skipped(self,fromOffset,toOffset):
+		super()._skipped(fromOffset,toOffset)
+		data=str(toOffset).encode('ascii')
+		with self.__lock:
+			self.__sent(self.__unsent+FRAMEHEADER.pack(DISPOSED,fromOffset,time.time(),len(data))+data)
+	def _processed(self,bytesRead):
+		# NOTE returning False makes the dispatcher retain the BytesRead, so it is offered again on the next update()
+		with self.__lock:
+			if not self.connected or not self.__flushed():
+				return False
+			return self.__sent(FRAMEHEADER.pack(DATA,self._bytesReadCount,bytesRead.getTime(),len(bytesRead))+bytes(bytesRead))
+	def isBehind(self):
+		return self._bytesReadCount<self._bytesReadAvailable or len(self.__unsent)>0
+	def close(self):
+		self.connected=False
+		try:
+			self.__connection.close()
+		except OSError:
+			pass
+
+class ResumableTCPServer(sd2.Reporter):
+	def __init__(self,byteDispatcher,port,host='0.0.0.0',flushInterval=0.05):
+		super().__init__()
+		if not isinstance(byteDispatcher,sd2.ByteDispatcher):
+			raise Exception("No (proper) byte dispatcher specified.")
+		self.__byteDispatcher=byteDispatcher
+		self.__flushInterval=flushInterval
+		self.__subscribers={} # the byte sink by name
+		self.__lock=threading.Lock()
+		self.__socket=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.__socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		self.__socket.bind((host,port))
+		self.__socket.listen()
+		self.port=self.__socket.getsockname()[1]
+		self.__running=True
+		self.__numberOfSubscribers=0
+		threading.Thread(target=self.__accept,name='sd2resumeaccept',daemon=True).start()
+		threading.Thread(target=self.__flush,name='sd2resumeflush',daemon=True).start()
+	def __accept(self):
+		while self.__running:
+			try:
+				(connection,address)=self.__socket.accept()
+			except OSError:
+				break
+			threading.Thread(target=self.__subscribe,args=(connection,address),daemon=True).start()
+	def __subscribe(self,connection,address):
+		try:
+			connection.settimeout(5.0)
+			request=b''
+			while not request.endswith(b'\n') and len(request)<100:
+				received=connection.recv(100)
+				if not received:
+					raise OSError("Disconnected.")
+				request+=received
+			words=request.split()
+			if len(words)==2 and words[0]==b'RESUME' and words[1].isdigit():
+				offset=int(words[1])
+			elif words==[b'LIVE']:
+				offset=self.__byteDispatcher.getBytesReadCount()
+			else:
+				raise OSError("Invalid request '"+str(request)+"'.")
+		except OSError as ex:
+			self._reporting("ERROR: '"+str(ex)+"' subscribing "+str(address)+".")
+			connection.close()
+			return
+		with self.__lock:
+			self.__numberOfSubscribers+=1
+			name='subscriber'+str(self.__numberOfSubscribers)
+		byteSink=SubscriberByteSink(connection,name)
+		self._reporting("Subscriber "+str(address)+" resuming at offset "+str(offset)+" (available: "+str(self.__byteDispatcher.getNumberOfDisposedBytesRead())+".."+str(self.__byteDispatcher.getBytesReadCount())+").")
+		with self.__lock:
+			self.__subscribers[name]=byteSink
+		self.__byteDispatcher.addByteSink(byteSink,name,offset) # sends the history (as much as it can at once)
+	# __flush() keeps sending to subscribers that are behind (even when nothing new is dispatched) and removes the disconnected ones
+	def __flush(self):
+		while self.__running:
+			time.sleep(self.__flushInterval)
+			with self.__lock:
+				subscribers=list(self.__subscribers.items())
+			for (name,byteSink) in subscribers:
+				if byteSink.connected and byteSink.isBehind():
+					byteSink.flush()
+					byteSink.update()
+				if not byteSink.connected:
+					self.__byteDispatcher.removeByteSinkWithName(name)
+					byteSink.close()
+					with self.__lock:
+						del self.__subscribers[name]
+					self._reporting("Subscriber '"+name+"' disconnected at offset "+str(byteSink.getBytesReadCount())+".")
+	def getNumberOfSubscribers(self):
+		return len(self.__subscribers)
+	def close(self):
+		self.__running=False
+		self.__socket.close()
+		with self.__lock:
+			subscribers=list(self.__subscribers.items())
+			self.__subscribers={}
+		for (name,byteSink) in subscribers:
+			self.__byteDispatcher.removeByteSinkWithName(name)
+			byteSink.close()
+	def __repr__(self):
+		return super().__repr__()+" - port "+str(self.port)+" - subscribers: "+", ".join(repr(byteSink) for byteSink in list(self.__subscribers.values()))
+
+class ResumableSubscriber:
+	# offset: where to start (None for live data only)
+	def __init__(self,host,port,offset=None,reconnectInterval=1.0):
+		self.__address=(host,port)
+		self.nextOffset=offset
+		self.__reconnectInterval=reconnectInterval
+		self.__socket=None
+		self.__buffer=bytearray()
+		self.numberOfSkipped=0 # the number of BytesRead asked for that were disposed already
+		self.numberOfReconnects=-1 # the first connect is not a reconnect
+	def __connect(self):
+		while True:
+			try:
+				self.__socket=socket.create_connection(self.__address)
+				self.__socket.sendall((b'LIVE\n',b'RESUME %d\n' % (self.nextOffset or 0))[self.nextOffset is not None])
+				self.numberOfReconnects+=1
+				return
+			except OSError:
+				self.__socket=None
+				time.sleep(self.__reconnectInterval)
+	def __receivedExactly(self,size):
+		while len(self.__buffer)<size:
+			received=self.__socket.recv(max(1<<16,size))
+			if not received:
+				raise ConnectionError("Disconnected.")
+			self.__buffer+=received
+		result=bytes(self.__buffer[:size])
+		del self.__buffer[:size]
+		return result
+	# receive() returns the next BytesRead (with its offset as source id), reconnecting and resuming if the connection drops
+	def receive(self):
+		while True:
+			if self.__socket is None:
+				self.__buffer=bytearray()
+				self.__connect()
+			try:
+				(kind,offset,time_,length)=FRAMEHEADER.unpack(self.__receivedExactly(FRAMEHEADER.size))
+				data=self.__receivedExactly(length)
+			except OSError:
+				self.__socket.close()
+				self.__socket=None
+				continue
+			if kind==DISPOSED:
+				nextOffset=int(data)
+				self.numberOfSkipped+=nextOffset-offset
+				self.nextOffset=nextOffset
+				continue
+			self.nextOffset=offset+1
+			return sd2.BytesRead(data,time_,offset)
+	def __iter__(self):
+		return self
+	def __next__(self):
+		return self.receive()
+	def close(self):
+		if self.__socket is not None:
+			self.__socket.close()
+			self.__socket=None
+
+def main(args):
+	if len(args)<2:
+		print("Need the host and port to subscribe to (optionally followed by the offset to resume at)!")
+		return
+	subscriber=ResumableSubscriber(args[0],int(args[1]),int(args[2]) if len(args)>2 else None)
+	skipped=0
+	for bytesRead in subscriber:
+		if subscriber.numberOfSkipped>skipped:
+			print("NOTE: "+str(subscriber.numberOfSkipped-skipped)+" BytesRead were disposed before they could be sent.")
+			skipped=subscriber.numberOfSkipped
+		print("#"+str(bytesRead.getSourceId())+": '"+str(bytesRead)+"'.")
+
+if __name__=='__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,264 @@
+"""
+Offline search through captured serial data
+- searches the files written by this project: archives (sd2archive, .sd2a), store-and-forward segments (sd2forward, .sd2q) and trigger captures (sd2capture, .txt)
+- the regular expression is always matched against the bytes of a single BytesRead (so ^, \A, $ and lookbehinds behave the same in every kind of file)
+- files are memory-mapped and searched for the longest literal every match should contain first (so files and blocks without it are skipped at C speed),
+  only around its occurrences are the records (timestamps and source ids) decoded and matched, archives decompress only the blocks that cover the time range
+  NOTE without such a literal (e.g. alternations at the top level) every record is decoded and matched
+- a trigger capture holds the text representation of the bytes, so it's only searched for the literal if that is represented as is (printable, no quotes or backslashes)
+- files are searched in parallel by a process pool, matches are streamed (per file in order) as the files are done
+- run this module from the command line to print the matching lines with their timestamp and source (port) id:
+  python sd2search.py <regular expression> <file or directory> [<file or directory> ...] [from=<time>] [to=<time>] [processes=<n>] [ignorecase=1]
+  where a time is either seconds since the epoch or e.g. 2019-04-08T12:00:00
+  python sd2search.py benchmark [<megabytes> [<processes>]]
+"""
+
+import ast
+import datetime
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+try:
+	from re import _parser as sre_parse
+except ImportError: # before Python 3.11
+	import sre_parse
+import sd2archive
+import sd2forward
+
+CAPTURELINE=re.compile(rb'^(?:TRIGGER\t)?([^\t\n]+)\t([^\t\n]*)\t(.*)$')
+
+def _inRange(time_,startTime,endTime):
+	return (startTime is None or time_>=startTime) and (endTime is None or time_<endTime)
+
+# _getLiterals() returns the runs of literal bytes in the given (parsed) sequence that every match contains
+def _getLiterals(sequence):
+	result=[]
+	literal=bytearray()
+	for (opcode,argument) in sequence:
+		if opcode==sre_parse.LITERAL:
+			literal.append(argument)
+		elif opcode==sre_parse.SUBPATTERN and not argument[1] and not argument[2]: # a group (without flags of its own) matches its contents exactly once
+			subLiterals=_getLiterals(argument[3])
+			if len(subLiterals)==1 and len(subLiterals[0])==len(argument[3]): # nothing but literals
+				literal+=subLiterals[0]
+				continue
+			result+=[bytes(literal)]+subLiterals
+			literal=bytearray()
+		else:
+			result.append(bytes(literal))
+			literal=bytearray()
+	result.append(bytes(literal))
+	return [literal for literal in result if literal]
+
+# _isRepresented() returns whether the given literal shows up as is in the text representation of bytes holding it (as written to a trigger capture)
+def _isRepresented(literal):
+	return all(0x20<=byte<0x7F and byte not in b'\\\'"' for byte in literal)
+
+# _getPrefilter() returns the precompiled search for the longest literal every match of the given regular expression contains (None if there is none)
+# represented: only considering literals that are represented as is in a trigger capture
+def _getPrefilter(regex,flags,represented=False):
+	parsed=sre_parse.parse(regex,flags)
+	literals=[literal for literal in _getLiterals(parsed) if not represented or _isRepresented(literal)]
+	if not literals:
+		return None
+	return re.compile(re.escape(max(literals,key=len)),parsed.state.flags&re.IGNORECASE)
+
+RESYNCDISTANCE=1<<16 # beyond this distance to the next match, find the record holding it by scanning backwards instead of decoding every record in between
+MAXRECORDSIZE=1<<20 # no further back than this
+MAXTIMEDIFFERENCE=30*24*3600.0 # the timestamps in a single segment file are not further apart than this
+
+# _getRecordEnd() returns where the record at the given offset ends, if the header there is a plausible one (None otherwise)
+def _getRecordEnd(buffer,offset,firstTime):
+	if offset+sd2forward.RECORDHEADER.size>len(buffer):
+		return None
+	(length,time_,sourceIdLength)=sd2forward.RECORDHEADER.unpack_from(buffer,offset)
+	if sourceIdLength!=sd2forward.NOSOURCEID and sourceIdLength>1024 or not abs(time_-firstTime)<=MAXTIMEDIFFERENCE:
+		return None
+	end=offset+sd2forward.RECORDHEADER.size+(sourceIdLength,0)[sourceIdLength==sd2forward.NOSOURCEID]+length
+	return end if end<=len(buffer) else None
+
+# _isRecord() returns whether a record starts at the given offset, checking that the next few records are plausible as well
+def _isRecord(buffer,offset,firstTime):
+	for _ in range(4):
+		offset=_getRecordEnd(buffer,offset,firstTime)
+		if offset is None:
+			return False
+		if offset==len(buffer):
+			break
+	return True
+
+# _searchedRecords() returns the (time,source id,bytes) of the records in the given buffer that match (the buffer holding sd2forward records)
+# prefilter: the search for the literal every match contains (None to match every record)
+def _searchedRecords(buffer,pattern,prefilter,startTime,endTime):
+	result=[]
+	if len(buffer)<sd2forward.RECORDHEADER.size:
+		return result
+	# position: where the next occurrence of the literal starts (somewhere in the record holding it, including its header)
+	position=0
+	if prefilter is not None:
+		match=prefilter.search(buffer)
+		if match is None: # the fast path
+			return result
+		position=match.start()
+	firstTime=sd2forward.RECORDHEADER.unpack_from(buffer,0)[1]
+	offset=0 # where the next record starts
+	while position is not None:
+		if position-offset>RESYNCDISTANCE: # skip to the record holding the occurrence
+			for candidate in range(position,max(offset,position-MAXRECORDSIZE),-1):
+				if _isRecord(buffer,candidate,firstTime) and _getRecordEnd(buffer,candidate,firstTime)>position:
+					offset=candidate
+					break
+		if offset+sd2forward.RECORDHEADER.size>len(buffer):
+			break
+		(length,time_,sourceIdLength)=sd2forward.RECORDHEADER.unpack_from(buffer,offset)
+		dataOffset=offset+sd2forward.RECORDHEADER.size+(sourceIdLength,0)[sourceIdLength==sd2forward.NOSOURCEID]
+		end=dataOffset+length
+		if end>len(buffer): # truncated
+			break
+		if position<end: # the occurrence is in this record
+			data=buffer[dataOffset:end]
+			if _inRange(time_,startTime,endTime) and pattern.search(data):
+				sourceId=None if sourceIdLength==sd2forward.NOSOURCEID else bytes(buffer[offset+sd2forward.RECORDHEADER.size:dataOffset]).decode('utf-8')
+				result.append((time_,sourceId,data))
+			if prefilter is None:
+				position=end
+			else:
+				match=prefilter.search(buffer,end)
+				position=None if match is None else match.start()
+		offset=end
+	return result
+
+def _searchedArchive(path,pattern,startTime,endTime):
+	result=[]
+	for bytesRead in sd2archive.ArchiveReader(path).read(startTime,endTime):
+		if pattern.search(bytesRead):
+			result.append((bytesRead.getTime(),bytesRead.getSourceId(),bytes(bytesRead)))
+	return result
+
+# _searchedCapture() returns the (time,source id,bytes) of the lines in the given buffer that match (the buffer holding a trigger capture)
+# prefilter: the search for the literal every match contains as it's represented in the capture (None to match every line)
+def _searchedCapture(buffer,pattern,prefilter,startTime,endTime):
+	result=[]
+	position=0
+	while position<len(buffer):
+		lineStart=position
+		if prefilter is not None:
+			match=prefilter.search(buffer,position)
+			if match is None:
+				break
+			lineStart=buffer.rfind(b'\n',0,match.start())+1
+		lineEnd=buffer.find(b'\n',lineStart)
+		if lineEnd<0:
+			lineEnd=len(buffer)
+		position=lineEnd+1
+		fields=CAPTURELINE.match(buffer[lineStart:lineEnd])
+		if fields is None:
+			continue
+		try:
+			time_=datetime.datetime.fromisoformat(fields.group(1).decode('ascii')).timestamp()
+			data=ast.literal_eval(fields.group(3).decode('ascii'))
+		except (ValueError,SyntaxError):
+			continue
+		if _inRange(time_,startTime,endTime) and pattern.search(data):
+			sourceId=fields.group(2).decode('utf-8')
+			result.append((time_,(sourceId,None)[sourceId in ('','None')],data)) # written as str(sourceId)
+	return result
+
+# _searched() searches a single file (in a worker process), returning the path and the matches
+def _searched(arguments):
+	(path,regex,flags,startTime,endTime)=arguments
+	pattern=re.compile(regex,flags)
+	try:
+		if path.endswith(sd2archive.ARCHIVEEXTENSION):
+			return (path,_searchedArchive(path,pattern,startTime,endTime))
+		with open(path,'rb') as file_:
+			if os.fstat(file_.fileno()).st_size==0:
+				return (path,[])
+			with mmap.mmap(file_.fileno(),0,access=mmap.ACCESS_READ) as buffer:
+				if path.endswith(sd2forward.SEGMENTEXTENSION):
+					return (path,_searchedRecords(buffer,pattern,_getPrefilter(regex,flags),startTime,endTime))
+				return (path,_searchedCapture(buffer,pattern,_getPrefilter(regex,flags,True),startTime,endTime))
+	except Exception as ex:
+		return (path,ex)
+
+def getSearchablePaths(paths):
+	result=[]
+	for path in paths:
+		if os.path.isdir(path):
+			for (directory,directoryNames,fileNames) in os.walk(path):
+				result+=[os.path.join(directory,fileName) for fileName in sorted(fileNames) if fileName.endswith((sd2archive.ARCHIVEEXTENSION,sd2forward.SEGMENTEXTENSION,'.txt'))]
+		else:
+			result.append(path)
+	return result
+
+# search() yields (path,time,source id,bytes) of every match, processing the files in parallel
+def search(regex,paths,startTime=None,endTime=None,processes=None,flags=0):
+	if isinstance(regex,str):
+		regex=regex.encode('utf-8')
+	re.compile(regex,flags) # raises if invalid (here rather than in every worker)
+	paths=sorted(getSearchablePaths(paths),key=lambda path:-os.path.getsize(path)) # the largest first for a better balance
+	with multiprocessing.Pool(processes) as pool:
+		for (path,matches) in pool.imap_unordered(_searched,[(path,regex,flags,startTime,endTime) for path in paths]):
+			if isinstance(matches,Exception):
+				print("ERROR: '"+str(matches)+"' searching '"+path+"'.",file=sys.stderr)
+				continue
+			for (time_,sourceId,data) in matches:
+				yield (path,time_,sourceId,data)
+
+def _getTime(text):
+	try:
+		return float(text)
+	except ValueError:
+		return datetime.datetime.fromisoformat(text).timestamp()
+
+# NOTE every 1024th record is a fault, searched for by a literal that is not there (only the fast path), the fault (every 1024th record decoded) and an alternation (every record decoded)
+def benchmark(megabytes=512,numberOfFiles=8,processes=None):
+	directory=tempfile.mkdtemp(prefix='sd2search')
+	import serialdata2 as sd2
+	record=sd2forward._encoded(sd2.BytesRead(b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47',time.time(),'/dev/ttyUSB0'))
+	chunk=record*1023+sd2forward._encoded(sd2.BytesRead(b'$GPTXT,01,01,02,ANTENNA FAULT*3B',time.time(),'/dev/ttyUSB0'))
+	for fileIndex in range(numberOfFiles):
+		with open(os.path.join(directory,'%016d' % fileIndex+sd2forward.SEGMENTEXTENSION),'wb') as file_:
+			for _ in range((megabytes<<20)//numberOfFiles//len(chunk)):
+				file_.write(chunk)
+	size=sum(os.path.getsize(path) for path in getSearchablePaths([directory]))
+	for regex in (rb'ANTENNA FAILURE',rb'ANTENNA FAULT',rb'GPTXT|GPRMC'):
+		startTime=time.time()
+		numberOfMatches=sum(1 for _ in search(regex,[directory],processes=processes))
+		elapsed=time.time()-startTime
+		print("Searched "+str(size>>20)+" MiB in "+str(numberOfFiles)+" files for "+str(regex)+" in "+str(round(elapsed,2))+" s ("+str(round(size/elapsed/(1<<30)*60,1))+" GiB/minute) using "+str(processes or multiprocessing.cpu_count())+" processes: "+str(numberOfMatches)+" matches")
+	for fileName in os.listdir(directory):
+		os.remove(os.path.join(directory,fileName))
+	os.rmdir(directory)
+
+def main(args):
+	if args and args[0]=='benchmark':
+		benchmark(*[int(arg) for arg in args[1:2]],processes=int(args[2]) if len(args)>2 else None)
+		return
+	settings={}
+	paths=[]
+	for arg in args[1:]:
+		(name,_,value)=arg.partition('=')
+		if value and name in ('from','to','processes','ignorecase'):
+			settings[name]=value
+		else:
+			paths.append(arg)
+	if not args or not paths:
+		print("Need a regular expression followed by the files and/or directories to search (optionally followed by from=<time> to=<time> processes=<n> ignorecase=1)!")
+		return
+	startTime=_getTime(settings['from']) if 'from' in settings else None
+	endTime=_getTime(settings['to']) if 'to' in settings else None
+	processes=int(settings['processes']) if 'processes' in settings else None
+	flags=re.IGNORECASE if settings.get('ignorecase','0')!='0' else 0
+	try:
+		for (path,time_,sourceId,data) in search(args[0],paths,startTime,endTime,processes,flags):
+			print(str(datetime.datetime.fromtimestamp(time_))+"\t"+str(sourceId)+"\t"+str(data)+"\t"+path)
+	except (BrokenPipeError,KeyboardInterrupt):
+		pass
+
+if __name__=='__main__':
+	main(sys.argv[1:])
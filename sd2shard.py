@@ -0,0 +1,136 @@
+"""
+Key-sharded parallel processing of lines (or any BytesRead)
+- ShardingByteConsumer hashes every BytesRead by a key onto one of N shards, each shard has a single worker (thread or process)
+- since a key always maps to the same shard and a shard processes in order, the order is preserved per key while different keys run in parallel
+- the key is a prefix (of given length), a field (by index and separator), a regular expression group or any callable returning bytes
+- every shard has a bounded queue, when full consumed() blocks (at most backpressureTimeout seconds if set) i.e. back pressure to the source
+- the handler is either a callable (receiving the BytesRead) or a ByteConsumer (of which consumed() is called)
+  NOTE with processes the handler should be picklable, and every process works on a copy of it
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2shard.ShardingByteConsumer(handle,4,field=(0,b','))))
+"""
+
+import multiprocessing
+import queue
+import re
+import threading
+import serialdata2 as sd2
+
+# a Shard processes the BytesRead in its queue in order on a single worker thread
+class Shard:
+	def __init__(self,handler,maxQueued,index):
+		self.index=index
+		self.handler=handler
+		self.queue=queue.Queue(maxQueued)
+		self.numberOfQueued=0
+		self.numberOfProcessed=0
+		self.numberOfFailed=0
+		self.worker=threading.Thread(target=self.work,name='sd2shard'+str(index),daemon=True)
+	def start(self):
+		self.worker.start()
+	def work(self):
+		handler=self.handler
+		get=self.queue.get
+		while True:
+			bytesRead=get()
+			if bytesRead is None: # stop
+				break
+			try:
+				if handler(bytesRead) is False:
+					self.numberOfFailed+=1
+			except Exception:
+				self.numberOfFailed+=1
+			self.numberOfProcessed+=1
+	def stop(self,timeout=None):
+		self.queue.put(None)
+		self.worker.join(timeout)
+	def getNumberOfQueued(self):
+		return self.queue.qsize()
+
+def _processShard(handler,shardQueue):
+	while True:
+		bytesRead=shardQueue.get()
+		if bytesRead is None:
+			break
+		try:
+			handler(bytesRead)
+		except Exception:
+			pass
+
+# a ProcessShard processes the BytesRead in its queue in order in a separate process
+class ProcessShard(Shard):
+	def __init__(self,handler,maxQueued,index):
+		self.index=index
+		self.queue=multiprocessing.Queue(maxQueued)
+		self.numberOfQueued=0
+		self.numberOfProcessed=None # not known in this process
+		self.numberOfFailed=None
+		self.worker=multiprocessing.Process(target=_processShard,args=(handler,self.queue),name='sd2shard'+str(index),daemon=True)
+	def getNumberOfQueued(self):
+		try:
+			return self.queue.qsize()
+		except NotImplementedError: # e.g. macOS
+			return -1
+
+class ShardingByteConsumer(sd2.ByteConsumer):
+	def __init__(self,handler,numberOfShards=4,prefix=None,field=None,regex=None,key=None,maxQueued=1000,backpressureTimeout=None,useProcesses=False):
+		super().__init__()
+		if isinstance(handler,sd2.ByteConsumer):
+			handler=handler.consumed
+		if not callable(handler):
+			raise Exception("No (proper) handler specified.")
+		if not isinstance(numberOfShards,int) or numberOfShards<=0:
+			raise Exception("Invalid number of shards.")
+		if prefix is not None:
+			key=lambda bytesRead:bytes(bytesRead[:prefix])
+		elif field is not None:
+			(fieldIndex,separator)=field
+			def key(bytesRead):
+				fields=bytes(bytesRead).split(separator,fieldIndex+1)
+				return fields[fieldIndex] if fieldIndex<len(fields) else b''
+		elif regex is not None:
+			pattern=re.compile(regex)
+			def key(bytesRead):
+				match=pattern.search(bytesRead)
+				if match is None:
+					return b''
+				return match.group((0,1)[pattern.groups>0])
+		elif key is None:
+			key=bytes # the entire line
+		if not callable(key):
+			raise Exception("Invalid key.")
+		self.__key=key
+		self.__backpressureTimeout=backpressureTimeout
+		self.__shards=[(Shard,ProcessShard)[useProcesses](handler,maxQueued,index) for index in range(numberOfShards)]
+		self.__numberOfBackpressured=0 # the number of times a shard queue was full
+		self.__numberOfRejected=0 # the number of BytesRead not queued because the shard queue stayed full
+		for shard in self.__shards:
+			shard.start()
+	def getShardIndex(self,bytesRead):
+		return hash(self.__key(bytesRead))%len(self.__shards)
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			shard=self.__shards[hash(self.__key(bytesRead))%len(self.__shards)]
+			try:
+				shard.queue.put_nowait(bytesRead)
+			except queue.Full:
+				self.__numberOfBackpressured+=1
+				try:
+					shard.queue.put(bytesRead,True,self.__backpressureTimeout)
+				except queue.Full:
+					self.__numberOfRejected+=1
+					self._reporting("ERROR: Shard #"+str(shard.index)+" full: failed to queue '"+str(bytesRead)+"'.")
+					return False
+			shard.numberOfQueued+=1
+			return True
+		return False
+	def stop(self,timeout=None):
+		for shard in self.__shards:
+			shard.stop(timeout)
+		return self
+	def __repr__(self):
+		result=super().__repr__()+" - backpressured: "+str(self.__numberOfBackpressured)+" - rejected: "+str(self.__numberOfRejected)
+		for shard in self.__shards:
+			result+=" - #"+str(shard.index)+": queued="+str(shard.numberOfQueued)+" processed="+str(shard.numberOfProcessed)+" waiting="+str(shard.getNumberOfQueued())
+		return result
@@ -0,0 +1,179 @@
+"""
+Shared memory ring buffer output for local consumer processes
+- SharedMemoryByteConsumer (single producer) writes every BytesRead (with its timestamp) as a record into a multiprocessing.shared_memory ring
+- SharedMemoryReader (any number of processes) attaches to the ring by name, keeps its own cursor and detects being overrun by the producer
+- ring layout: a 64 byte header (magic, capacity, write cursor) followed by the records
+- record layout: length (4 bytes), reserved (4 bytes), time (8 byte double) followed by the data padded to a multiple of 8 bytes
+- the write cursor is the absolute number of bytes written to the ring, a record never wraps (a wrap marker is written instead)
+"""
+
+import struct
+import time
+from multiprocessing import shared_memory
+import serialdata2 as sd2
+
+MAGIC=0x53443252 # SD2R
+HEADER=struct.Struct('<IIQQ') # magic, header size, capacity, write cursor
+HEADERSIZE=64
+WRITECURSOROFFSET=16
+CURSOR=struct.Struct('<Q')
+RECORDHEADER=struct.Struct('<IId') # data length, reserved, time
+LENGTH=struct.Struct('<I') # what's at the start of every record (which may be just the wrap marker, in the last 8 bytes of the ring)
+WRAP=0xFFFFFFFF # record length marking the remainder of the ring as unused
+
+def _padded(length):
+	return (length+7)&~7
+
+class SharedMemoryByteConsumer(sd2.ByteConsumer):
+	def __init__(self,name=None,capacity=1<<24):
+		super().__init__()
+		if not isinstance(capacity,int) or capacity<4096 or capacity%8:
+			raise Exception("Invalid ring capacity: should be a multiple of 8 of at least 4096 bytes.")
+		self.__sharedMemory=shared_memory.SharedMemory(name=name,create=True,size=HEADERSIZE+capacity)
+		self.__buffer=self.__sharedMemory.buf
+		self.__capacity=capacity
+		self.__maxDataLength=capacity//16-RECORDHEADER.size # larger BytesRead are split up (see SharedMemoryReader)
+		self.__writeCursor=0
+		self.__numberOfRecords=0
+		HEADER.pack_into(self.__buffer,0,MAGIC,HEADERSIZE,capacity,0)
+	def getName(self):
+		return self.__sharedMemory.name
+	def getWriteCursor(self):
+		return self.__writeCursor
+	def __written(self,data,time_):
+		recordLength=RECORDHEADER.size+_padded(len(data))
+		offset=self.__writeCursor%self.__capacity
+		if offset+recordLength>self.__capacity: # doesn't fit before the end of the ring: mark and wrap
+			LENGTH.pack_into(self.__buffer,HEADERSIZE+offset,WRAP)
+			self.__writeCursor+=self.__capacity-offset
+			offset=0
+		position=HEADERSIZE+offset
+		RECORDHEADER.pack_into(self.__buffer,position,len(data),0,time_)
+		position+=RECORDHEADER.size
+		self.__buffer[position:position+len(data)]=data
+		# publishing the record by moving the write cursor (after the record was written)
+		self.__writeCursor+=recordLength
+		CURSOR.pack_into(self.__buffer,WRITECURSOROFFSET,self.__writeCursor)
+		self.__numberOfRecords+=1
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			try:
+				time_=bytesRead.getTime()
+				data=memoryview(bytesRead)
+				for dataOffset in range(0,max(len(data),1),self.__maxDataLength):
+					self.__written(data[dataOffset:dataOffset+self.__maxDataLength],time_)
+				return True
+			except Exception as ex:
+				self._reporting("ERROR: '"+str(ex)+"' writing '"+str(bytesRead)+"' to shared memory '"+self.getName()+"'.")
+		return False
+	def close(self,unlink=True):
+		if self.__sharedMemory is not None:
+			self.__buffer=None
+			self.__sharedMemory.close()
+			if unlink:
+				self.__sharedMemory.unlink()
+			self.__sharedMemory=None
+	def __repr__(self):
+		return super().__repr__()+" - shared memory: "+str(self.getName())+" - records: "+str(self.__numberOfRecords)+" - written: "+str(self.__writeCursor)
+
+class SharedMemoryReader:
+	# fromStart: start reading at the oldest record still in the ring instead of at the current write cursor
+	# untrack: should be False when reading in the producing process itself
+	def __init__(self,name,fromStart=False,untrack=True):
+		self.__sharedMemory=shared_memory.SharedMemory(name=name)
+		if untrack:
+			try:
+				# a reader process should never unlink the producer's shared memory (its resource tracker would do so at exit)
+				from multiprocessing import resource_tracker
+				resource_tracker.unregister(self.__sharedMemory._name,'shared_memory')
+			except Exception:
+				pass
+		self.__buffer=self.__sharedMemory.buf
+		(magic,headerSize,self.__capacity,writeCursor)=HEADER.unpack_from(self.__buffer,0)
+		if magic!=MAGIC or headerSize!=HEADERSIZE:
+			raise Exception("Shared memory '"+name+"' does not contain a serial data ring.")
+		# the producer may be writing a record (plus skipping a wrap) ahead of its write cursor of at most an eighth of the capacity
+		# so we're considered overrun as soon as we're lagging behind more than the remaining seven eighths
+		self.__maxLag=self.__capacity-self.__capacity//8
+		# NOTE once the ring wrapped we can't tell where the oldest record starts
+		self.__cursor=(writeCursor,0)[fromStart and writeCursor<=self.__maxLag]
+		self.numberOfRecordsRead=0
+		self.numberOfOverruns=0
+		self.numberOfBytesLost=0
+	def getCursor(self):
+		return self.__cursor
+	def getWriteCursor(self):
+		return CURSOR.unpack_from(self.__buffer,WRITECURSOROFFSET)[0]
+	def __overrun(self,writeCursor):
+		self.numberOfOverruns+=1
+		self.numberOfBytesLost+=writeCursor-self.__cursor
+		self.__cursor=writeCursor
+	# read() returns the BytesRead instances written since the last call (at most maxNumberOfRecords if positive)
+	def read(self,maxNumberOfRecords=0):
+		result=[]
+		buffer=self.__buffer
+		capacity=self.__capacity
+		writeCursor=self.getWriteCursor()
+		if writeCursor-self.__cursor>self.__maxLag: # the producer (may have) already overwritten what we didn't read yet
+			self.__overrun(writeCursor)
+		while self.__cursor<writeCursor and (maxNumberOfRecords<=0 or len(result)<maxNumberOfRecords):
+			offset=self.__cursor%capacity
+			position=HEADERSIZE+offset
+			if LENGTH.unpack_from(buffer,position)[0]==WRAP: # NOTE there may not even be room for an entire record header
+				self.__cursor+=capacity-offset
+				continue
+			(length,reserved,time_)=RECORDHEADER.unpack_from(buffer,position)
+			data=bytes(buffer[position+RECORDHEADER.size:position+RECORDHEADER.size+length])
+			# whatever we copied is only valid if the producer didn't overwrite it meanwhile
+			writeCursor=self.getWriteCursor()
+			if writeCursor-self.__cursor>self.__maxLag:
+				self.__overrun(writeCursor)
+				break
+			result.append(sd2.BytesRead(data,time_))
+			self.__cursor+=RECORDHEADER.size+_padded(length)
+		self.numberOfRecordsRead+=len(result)
+		return result
+	# poll() waits (at most timeout seconds) until something can be read
+	def poll(self,timeout=None,interval=0.001):
+		startTime=time.time()
+		while True:
+			result=self.read()
+			if result or (timeout is not None and time.time()-startTime>=timeout):
+				return result
+			time.sleep(interval)
+	def __iter__(self):
+		return self
+	def __next__(self):
+		# NOTE never ending unless the shared memory got closed
+		if self.__buffer is None:
+			raise StopIteration
+		return self.poll()
+	def close(self):
+		if self.__sharedMemory is not None:
+			self.__buffer=None
+			self.__sharedMemory.close()
+			self.__sharedMemory=None
+	def __repr__(self):
+		return "Shared memory reader - cursor: "+str(self.__cursor)+" - read: "+str(self.numberOfRecordsRead)+" - overruns: "+str(self.numberOfOverruns)+" - lost: "+str(self.numberOfBytesLost)+" bytes"
+
+def benchmark(numberOfBytesRead=200000,capacity=1<<24):
+	sharedMemoryByteConsumer=SharedMemoryByteConsumer(capacity=capacity)
+	sharedMemoryReader=SharedMemoryReader(sharedMemoryByteConsumer.getName(),untrack=False)
+	try:
+		bytesRead=sd2.BytesRead(b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47')
+		numberOfRecordsRead=0
+		t=time.perf_counter()
+		for index in range(numberOfBytesRead):
+			sharedMemoryByteConsumer.consumed(bytesRead)
+			if index%1000==999:
+				numberOfRecordsRead+=len(sharedMemoryReader.read())
+		numberOfRecordsRead+=len(sharedMemoryReader.read())
+		elapsed=time.perf_counter()-t
+		print("Wrote and read "+str(numberOfRecordsRead)+" of "+str(numberOfBytesRead)+" BytesRead in "+str(round(elapsed,3))+" s ("+str(int(numberOfBytesRead/elapsed))+" per second, "+str(int(numberOfBytesRead*len(bytesRead)/elapsed))+" bytes per second).")
+		print(repr(sharedMemoryReader))
+	finally:
+		sharedMemoryReader.close()
+		sharedMemoryByteConsumer.close()
+
+if __name__=='__main__':
+	benchmark()
@@ -0,0 +1,186 @@
+"""
+Tiered BytesRead history for ByteDispatcher
+- the most recent BytesRead instances are kept in memory, older ones are spilled to fixed-size memory-mapped segment files
+- a lagging ByteSink reads through transparently: TieredBytesReadList looks like the deque ByteDispatcher uses by default
+- retention limits (total spilled bytes and age) bound disk use, BytesRead beyond them are disposed (and skipped by lagging sinks)
+- a BytesRead larger than a segment gets a (larger) segment of its own, so spilling never stops
+- a spilled BytesRead keeps its time, source id (a str or int) and valid flag
+
+Usage:
+d=sd2.ByteDispatcher('port1',bytesReadList=sd2spill.TieredBytesReadList('/var/tmp/port1'))
+"""
+
+import collections
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+import serialdata2 as sd2
+
+RECORDHEADER=struct.Struct('<IdHB') # data length, time, source id length (NOSOURCEID if none), flags
+NOSOURCEID=0xFFFF
+INVALID=0x01 # flag: BytesRead.isValid() returned False
+INTSOURCEID=0x02 # flag: the source id is an int (a str otherwise)
+
+# _getRecordHeader() returns the header (source id included) of the record of the given BytesRead
+def _getRecordHeader(bytesRead):
+	sourceId=bytesRead.getSourceId()
+	flags=(INVALID,0)[bytesRead.isValid()]
+	if sourceId is None:
+		return RECORDHEADER.pack(len(bytesRead),bytesRead.getTime(),NOSOURCEID,flags)
+	if isinstance(sourceId,int):
+		flags|=INTSOURCEID
+	sourceId=str(sourceId).encode('utf-8')
+	return RECORDHEADER.pack(len(bytesRead),bytesRead.getTime(),len(sourceId),flags)+sourceId
+
+# a Segment is a single memory-mapped file holding consecutive records
+class Segment:
+	def __init__(self,path,size):
+		self.path=path
+		self.__file=open(path,'w+b')
+		self.__file.truncate(size)
+		self.__mmap=mmap.mmap(self.__file.fileno(),size)
+		self.size=size
+		self.offsets=array('Q') # the offset of every record (the first self.start of which are disposed)
+		self.start=0
+		self.end=0 # where the next record is written
+		self.firstTime=None
+	def getNumberOfRecords(self):
+		return len(self.offsets)-self.start
+	def append(self,bytesRead,recordHeader=None):
+		if recordHeader is None:
+			recordHeader=_getRecordHeader(bytesRead)
+		recordLength=len(recordHeader)+len(bytesRead)
+		if self.end+recordLength>self.size:
+			return False
+		self.__mmap[self.end:self.end+len(recordHeader)]=recordHeader
+		self.__mmap[self.end+len(recordHeader):self.end+recordLength]=bytesRead
+		self.offsets.append(self.end)
+		self.end+=recordLength
+		if self.firstTime is None:
+			self.firstTime=bytesRead.getTime()
+		return True
+	def getTime(self,index):
+		return RECORDHEADER.unpack_from(self.__mmap,self.offsets[self.start+index])[1]
+	def __getitem__(self,index):
+		offset=self.offsets[self.start+index]
+		(length,time_,sourceIdLength,flags)=RECORDHEADER.unpack_from(self.__mmap,offset)
+		offset+=RECORDHEADER.size
+		sourceId=None
+		if sourceIdLength!=NOSOURCEID:
+			sourceId=self.__mmap[offset:offset+sourceIdLength].decode('utf-8')
+			if flags&INTSOURCEID:
+				sourceId=int(sourceId)
+			offset+=sourceIdLength
+		bytesRead=sd2.BytesRead(self.__mmap[offset:offset+length],time_,sourceId)
+		if flags&INVALID:
+			bytesRead.setValid(False)
+		return bytesRead
+	def close(self):
+		self.__mmap.close()
+		self.__file.close()
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+
+class TieredBytesReadList:
+	# directory: where to write the segment files (a temporary directory by default)
+	# memoryCount: the number of (most recent) BytesRead kept in memory
+	# segmentSize: the size of a single segment file in bytes (a BytesRead larger than that gets a segment file of its own)
+	# maxBytes and maxAge (in seconds): the retention limits of what is spilled (None for no limit)
+	def __init__(self,directory=None,memoryCount=10000,segmentSize=1<<24,maxBytes=1<<30,maxAge=None):
+		if not isinstance(memoryCount,int) or memoryCount<0:
+			raise Exception("Invalid number of BytesRead to keep in memory.")
+		if not isinstance(segmentSize,int) or segmentSize<=RECORDHEADER.size:
+			raise Exception("Invalid segment size.")
+		if directory is None:
+			directory=tempfile.mkdtemp(prefix='sd2spill')
+		os.makedirs(directory,exist_ok=True)
+		self.__directory=directory
+		self.__memoryCount=memoryCount
+		self.__segmentSize=segmentSize
+		self.__maxBytes=maxBytes
+		self.__maxAge=maxAge
+		self.__memory=collections.deque() # the most recent BytesRead
+		self.__segments=collections.deque() # the spilled BytesRead (oldest first)
+		self.__numberOfSpilled=0 # the number of BytesRead currently spilled
+		self.__segmentIndex=0 # used to name the segment files
+		self.numberOfRetentionDisposed=0 # the number of BytesRead disposed because of the retention limits
+	def getDirectory(self):
+		return self.__directory
+	def getNumberOfSegments(self):
+		return len(self.__segments)
+	def getNumberOfSpilledBytes(self):
+		return sum(segment.size for segment in self.__segments)
+	def __spill(self,bytesRead):
+		recordHeader=_getRecordHeader(bytesRead)
+		if not self.__segments or not self.__segments[-1].append(bytesRead,recordHeader):
+			self.__segmentIndex+=1
+			# NOTE a BytesRead larger than a segment gets a segment of its own (the next one starts a new segment again)
+			self.__segments.append(Segment(os.path.join(self.__directory,'segment'+str(self.__segmentIndex)+'.sd2'),max(self.__segmentSize,len(recordHeader)+len(bytesRead))))
+			self.__segments[-1].append(bytesRead,recordHeader)
+		self.__numberOfSpilled+=1
+	def __retain(self):
+		# keep disposing of the oldest spilled BytesRead while beyond the retention limits (a whole segment at a time)
+		while len(self.__segments)>1:
+			oldestSegment=self.__segments[0]
+			if self.__maxBytes is not None and self.getNumberOfSpilledBytes()>self.__maxBytes:
+				pass
+			elif self.__maxAge is not None and oldestSegment.getNumberOfRecords() and time.time()-oldestSegment.getTime(oldestSegment.getNumberOfRecords()-1)>self.__maxAge:
+				pass
+			else:
+				break
+			self.numberOfRetentionDisposed+=oldestSegment.getNumberOfRecords()
+			self.__numberOfSpilled-=oldestSegment.getNumberOfRecords()
+			self.__segments.popleft().close()
+	# deque methods used by ByteDispatcher
+	def append(self,bytesRead):
+		self.__memory.append(bytesRead)
+		while len(self.__memory)>self.__memoryCount:
+			self.__spill(self.__memory.popleft())
+		self.__retain()
+	def popleft(self):
+		while self.__segments:
+			segment=self.__segments[0]
+			if segment.getNumberOfRecords():
+				bytesRead=segment[0]
+				segment.start+=1
+				self.__numberOfSpilled-=1
+				if segment.getNumberOfRecords()==0 and len(self.__segments)>1: # never remove the segment we're writing to
+					self.__segments.popleft().close()
+				return bytesRead
+			if len(self.__segments)==1:
+				break
+			self.__segments.popleft().close()
+		return self.__memory.popleft()
+	def clear(self):
+		while self.__segments:
+			self.__segments.popleft().close()
+		self.__numberOfSpilled=0
+		self.__memory.clear()
+	def __len__(self):
+		return self.__numberOfSpilled+len(self.__memory)
+	def __getitem__(self,index):
+		if index<0:
+			index+=len(self)
+		if index<0 or index>=len(self):
+			raise IndexError("BytesRead index out of range.")
+		if index>=self.__numberOfSpilled:
+			return self.__memory[index-self.__numberOfSpilled]
+		for segment in self.__segments:
+			numberOfRecords=segment.getNumberOfRecords()
+			if index<numberOfRecords:
+				return segment[index]
+			index-=numberOfRecords
+		raise IndexError("BytesRead index out of range.")
+	def close(self):
+		self.clear()
+		try:
+			os.rmdir(self.__directory)
+		except OSError:
+			pass
+	def __repr__(self):
+		return "Tiered BytesRead list - in memory: "+str(len(self.__memory))+" - spilled: "+str(self.__numberOfSpilled)+" in "+str(len(self.__segments))+" segments - disposed by retention: "+str(self.numberOfRetentionDisposed)
@@ -0,0 +1,151 @@
+"""
+SQLite archive of lines (or any BytesRead) with bulk inserts
+- SQLiteByteConsumer queues every BytesRead it consumes (with its timestamp and source id) and returns immediately, so it never blocks the serial thread
+- a dedicated writer thread inserts what is queued with executemany() in a single transaction per batch (of at most batchSize rows)
+  every flushInterval seconds or as soon as batchSize rows are queued
+- the database is in WAL mode (with synchronous=NORMAL), so readers (ad-hoc queries) don't block the writer or the other way around
+- at most maxQueued rows are queued, beyond that BytesRead are dropped (and counted) instead of growing memory use when the disk can't keep up
+- run this module from the command line to benchmark rows per second (bulk versus a transaction per row):
+  python sd2sqlite.py [<number of rows>]
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2sqlite.SQLiteByteConsumer('lines.db')))
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import serialdata2 as sd2
+
+class SQLiteByteConsumer(sd2.ByteConsumer):
+	# table: created (if need be) with columns time (REAL, seconds since the epoch), source (TEXT) and data (BLOB)
+	def __init__(self,path,table='lines',batchSize=5000,flushInterval=0.5,maxQueued=100000):
+		super().__init__()
+		if not table.isidentifier():
+			raise Exception("Invalid table name.")
+		if not isinstance(batchSize,int) or batchSize<=0:
+			raise Exception("Invalid batch size.")
+		self.__path=path
+		self.__table=table
+		self.__batchSize=batchSize
+		self.__flushInterval=flushInterval
+		self.__maxQueued=maxQueued
+		self.__queued=[] # (time,source,data) rows
+		self.__condition=threading.Condition()
+		self.numberOfInserted=0
+		self.numberOfDropped=0
+		self.numberOfTransactions=0
+		self.__running=True
+		self.__ready=threading.Event()
+		self.__error=None
+		self.__writer=threading.Thread(target=self.__write,name='sd2sqlitewriter',daemon=True)
+		self.__writer.start()
+		self.__ready.wait()
+		if self.__error is not None:
+			raise Exception("Failed to open '"+path+"': "+self.__error+".")
+
+	# NOTE what doesn't fit is dropped (and counted) but still consumed, so upstream doesn't hold on to it (and e.g. merge it with the next line)
+	def __queue(self,rows):
+		with self.__condition:
+			room=self.__maxQueued-len(self.__queued)
+			if room<len(rows):
+				self.numberOfDropped+=len(rows)-max(room,0)
+				rows=rows[:max(room,0)]
+			self.__queued.extend(rows)
+			if len(self.__queued)>=self.__batchSize:
+				self.__condition.notify()
+
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			sourceId=bytesRead.getSourceId()
+			self.__queue(((bytesRead.getTime(),(None,str(sourceId))[sourceId is not None],bytes(bytesRead)),))
+			return True
+		return False
+	def consumedBatch(self,bytesReadList):
+		if not self._acceptedBatch(bytesReadList):
+			return super().consumedBatch(bytesReadList)
+		self.__queue([(bytesRead.getTime(),(None,str(bytesRead.getSourceId()))[bytesRead.getSourceId() is not None],bytes(bytesRead)) for bytesRead in bytesReadList])
+		return len(bytesReadList)
+
+	def __write(self):
+		# the connection is used by this thread only
+		try:
+			connection=sqlite3.connect(self.__path,isolation_level=None) # transactions are started explicitly
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.execute("PRAGMA synchronous=NORMAL")
+			connection.execute("CREATE TABLE IF NOT EXISTS "+self.__table+" (time REAL NOT NULL,source TEXT,data BLOB NOT NULL)")
+			connection.execute("CREATE INDEX IF NOT EXISTS "+self.__table+"_time ON "+self.__table+" (time)")
+		except sqlite3.Error as ex:
+			self.__error=str(ex)
+			self.__ready.set()
+			return
+		self.__ready.set()
+		insert="INSERT INTO "+self.__table+" (time,source,data) VALUES (?,?,?)"
+		while True:
+			with self.__condition:
+				if self.__running and len(self.__queued)<self.__batchSize:
+					self.__condition.wait(self.__flushInterval)
+				rows=self.__queued[:self.__batchSize]
+				del self.__queued[:self.__batchSize]
+				running=self.__running or len(self.__queued)>0 # write everything queued before stopping
+			if rows:
+				try:
+					connection.execute("BEGIN")
+					connection.executemany(insert,rows)
+					connection.execute("COMMIT")
+					self.numberOfInserted+=len(rows)
+					self.numberOfTransactions+=1
+				except sqlite3.Error as ex:
+					if connection.in_transaction:
+						connection.execute("ROLLBACK")
+					self.numberOfDropped+=len(rows)
+					self._reporting("ERROR: '"+str(ex)+"' inserting "+str(len(rows))+" rows into '"+self.__path+"'.")
+			if not running:
+				break
+		connection.close()
+
+	def getNumberOfQueued(self):
+		return len(self.__queued)
+
+	# close() writes what is still queued and closes the database
+	def close(self,timeout=None):
+		with self.__condition:
+			self.__running=False
+			self.__condition.notify()
+		self.__writer.join(timeout)
+
+	def __repr__(self):
+		return super().__repr__()+" - '"+self.__path+"' - inserted: "+str(self.numberOfInserted)+" in "+str(self.numberOfTransactions)+" transactions - queued: "+str(len(self.__queued))+" - dropped: "+str(self.numberOfDropped)
+
+def benchmark(numberOfRows=200000):
+	directory=tempfile.mkdtemp(prefix='sd2sqlite')
+	line=b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47'
+	# a transaction per row (what a per-line insert consumer does)
+	path=os.path.join(directory,'perrow.db')
+	connection=sqlite3.connect(path,isolation_level=None)
+	connection.execute("PRAGMA journal_mode=WAL")
+	connection.execute("CREATE TABLE lines (time REAL NOT NULL,source TEXT,data BLOB NOT NULL)")
+	numberOfPerRowRows=min(numberOfRows,20000)
+	startTime=time.time()
+	for _ in range(numberOfPerRowRows):
+		connection.execute("INSERT INTO lines (time,source,data) VALUES (?,?,?)",(time.time(),'port1',line))
+	print("A transaction per row: "+str(round(numberOfPerRowRows/(time.time()-startTime)))+" rows/s")
+	connection.close()
+	# bulk
+	path=os.path.join(directory,'bulk.db')
+	sqliteByteConsumer=SQLiteByteConsumer(path,maxQueued=numberOfRows)
+	startTime=time.time()
+	for _ in range(numberOfRows):
+		sqliteByteConsumer.consumed(sd2.BytesRead(line,None,'port1'))
+	consumeTime=time.time()-startTime
+	sqliteByteConsumer.close()
+	print("Bulk: consumed "+str(round(numberOfRows/consumeTime))+" rows/s, inserted "+str(round(sqliteByteConsumer.numberOfInserted/(time.time()-startTime)))+" rows/s ("+str(sqliteByteConsumer.numberOfTransactions)+" transactions)")
+	for fileName in os.listdir(directory):
+		os.remove(os.path.join(directory,fileName))
+	os.rmdir(directory)
+
+if __name__=='__main__':
+	benchmark(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,186 @@
+"""
+HTTP Server-Sent Events endpoint streaming lines (or any BytesRead) to browsers (asyncio, no extra dependencies)
+- SSEByteConsumer runs an asyncio HTTP server on its own thread, clients GET the path (default /events) to receive a text/event-stream
+- every client gets what was consumed at most every coalesceInterval seconds, as a single event holding a data: line per line received in the meantime
+- every client has a bounded buffer (maxBuffered lines), when a client can't keep up the oldest lines are dropped (and counted) for that client only
+- what is consumed on the serial thread is handed to the event loop in batches (a single wake-up per batch), every line is encoded once for all clients
+- run this module from the command line for a local load test with hundreds of clients:
+  python sd2sse.py [<number of clients>] [<lines per second>] [<seconds>]
+
+Usage:
+s.setByteConsumer(sd2.LineByteProcessor(sd2sse.SSEByteConsumer(8080)))
+and in the browser: new EventSource('http://<host>:8080/events').onmessage=function(event){...event.data.split('\\n')...}
+"""
+
+import asyncio
+import collections
+import sys
+import threading
+import time
+import serialdata2 as sd2
+
+RESPONSEHEADERS=b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: keep-alive\r\nAccess-Control-Allow-Origin: *\r\n\r\n'
+NOTFOUND=b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+# an SSEClient is a connected client with its own bounded buffer of encoded data: lines
+class SSEClient:
+	def __init__(self,writer,maxBuffered):
+		self.writer=writer
+		self.buffer=collections.deque(maxlen=maxBuffered)
+		self.event=asyncio.Event()
+		self.numberOfSent=0
+		self.numberOfDropped=0
+	def queued(self,dataLines):
+		overflow=len(self.buffer)+len(dataLines)-self.buffer.maxlen
+		if overflow>0:
+			self.numberOfDropped+=overflow
+		self.buffer.extend(dataLines)
+		self.event.set()
+
+class SSEByteConsumer(sd2.ByteConsumer):
+	def __init__(self,port=8080,host='0.0.0.0',path='/events',coalesceInterval=0.1,maxBuffered=1000):
+		super().__init__()
+		self.__path=path.encode('ascii')
+		self.__coalesceInterval=coalesceInterval
+		self.__maxBuffered=maxBuffered
+		self.__clients=set()
+		self.__pending=[] # encoded data: lines not handed to the event loop yet
+		self.__lock=threading.Lock() # guards the pending lines
+		self.__wakeUpScheduled=False
+		self.numberOfConnected=0
+		self.numberOfDisconnected=0
+		self.__loop=asyncio.new_event_loop()
+		self.__server=self.__loop.run_until_complete(asyncio.start_server(self.__serve,host,port))
+		self.port=self.__server.sockets[0].getsockname()[1] # in case port 0 was passed in
+		threading.Thread(target=self.__loop.run_forever,name='sd2sse',daemon=True).start()
+
+	async def __serve(self,reader,writer):
+		try:
+			requestLine=await reader.readline()
+			while (await reader.readline()) not in (b'\r\n',b'\n',b''): # skip the request headers
+				pass
+			parts=requestLine.split()
+			if len(parts)<2 or parts[0]!=b'GET' or parts[1].split(b'?')[0]!=self.__path:
+				writer.write(NOTFOUND)
+				await writer.drain()
+				writer.close()
+				return
+			writer.write(RESPONSEHEADERS+b'retry: 1000\n\n')
+			await writer.drain()
+		except (ConnectionError,asyncio.IncompleteReadError):
+			writer.close()
+			return
+		client=SSEClient(writer,self.__maxBuffered)
+		self.__clients.add(client)
+		self.numberOfConnected+=1
+		try:
+			while True:
+				await client.event.wait()
+				client.event.clear()
+				dataLines=list(client.buffer)
+				client.buffer.clear()
+				writer.write(b''.join(dataLines)+b'\n') # a single event
+				await writer.drain()
+				client.numberOfSent+=len(dataLines)
+				await asyncio.sleep(self.__coalesceInterval) # whatever arrives in the meantime goes in the next event
+		except (ConnectionError,OSError):
+			pass
+		finally:
+			self.__clients.discard(client)
+			self.numberOfDisconnected+=1
+			writer.close()
+
+	# __distribute() runs on the event loop: handing the pending lines to every client
+	def __distribute(self):
+		with self.__lock:
+			(dataLines,self.__pending)=(self.__pending,[])
+			self.__wakeUpScheduled=False
+		for client in self.__clients:
+			client.queued(dataLines)
+
+	def __published(self,dataLines):
+		with self.__lock:
+			self.__pending.extend(dataLines)
+			if self.__wakeUpScheduled:
+				return
+			self.__wakeUpScheduled=True
+		self.__loop.call_soon_threadsafe(self.__distribute)
+
+	@staticmethod
+	def _encoded(bytesRead):
+		data=bytes(bytesRead)
+		if b'\r' in data or b'\n' in data: # would end the data: line
+			data=data.replace(b'\r',b'').replace(b'\n',b'')
+		return b'data: '+data+b'\n'
+
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			self.__published((self._encoded(bytesRead),))
+			return True
+		return False
+	def consumedBatch(self,bytesReadList):
+		if not self._acceptedBatch(bytesReadList):
+			return super().consumedBatch(bytesReadList)
+		self.__published([self._encoded(bytesRead) for bytesRead in bytesReadList])
+		return len(bytesReadList)
+
+	def getNumberOfClients(self):
+		return len(self.__clients)
+	def getNumberOfDropped(self):
+		return sum(client.numberOfDropped for client in list(self.__clients))
+
+	def close(self):
+		async def closed():
+			self.__server.close()
+			for client in list(self.__clients):
+				client.writer.close()
+		asyncio.run_coroutine_threadsafe(closed(),self.__loop).result(5)
+		self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+	def __repr__(self):
+		return super().__repr__()+" - port "+str(self.port)+" - clients: "+str(len(self.__clients))+" - connected: "+str(self.numberOfConnected)+" - disconnected: "+str(self.numberOfDisconnected)+" - dropped: "+str(self.getNumberOfDropped())
+
+def loadtest(numberOfClients=300,linesPerSecond=2000,seconds=5.0):
+	sseByteConsumer=SSEByteConsumer(0,'127.0.0.1')
+	received=[0]*numberOfClients # lines received by every client
+	events=[0]*numberOfClients
+	async def client(index):
+		(reader,writer)=await asyncio.open_connection('127.0.0.1',sseByteConsumer.port)
+		writer.write(b'GET /events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n')
+		await writer.drain()
+		while True:
+			line=await reader.readline()
+			if not line:
+				break
+			if line.startswith(b'data: '):
+				received[index]+=1
+			elif line==b'\n':
+				events[index]+=1
+		writer.close()
+	async def clients():
+		await asyncio.gather(*[client(index) for index in range(numberOfClients)],return_exceptions=True)
+	clientLoop=asyncio.new_event_loop()
+	threading.Thread(target=clientLoop.run_until_complete,args=(clients(),),name='sd2sseclients',daemon=True).start()
+	while sseByteConsumer.getNumberOfClients()<numberOfClients:
+		time.sleep(0.05)
+	print(str(numberOfClients)+" clients connected.")
+	line=b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47'
+	numberOfLines=int(linesPerSecond*seconds)
+	startTime=time.time()
+	cpuTime=time.process_time()
+	for index in range(numberOfLines):
+		sseByteConsumer.consumed(sd2.BytesRead(line))
+		delay=startTime+(index+1)/linesPerSecond-time.time()
+		if delay>0:
+			time.sleep(delay)
+	sendTime=time.time()-startTime
+	while sum(received)+sseByteConsumer.getNumberOfDropped()<numberOfClients*numberOfLines and time.time()-startTime<seconds+10: # let the clients catch up
+		time.sleep(0.1)
+	elapsed=time.time()-startTime
+	cpu=(time.process_time()-cpuTime)/elapsed
+	dropped=sseByteConsumer.getNumberOfDropped()
+	sseByteConsumer.close()
+	print("Sent "+str(numberOfLines)+" lines at "+str(round(numberOfLines/sendTime))+" lines/s to "+str(numberOfClients)+" clients: received "+str(min(received))+".."+str(max(received))+" lines per client in "+str(min(events))+".."+str(max(events))+" events - dropped: "+str(dropped)+" - all received after "+str(round(elapsed,2))+" s - CPU (both sides): "+str(round(100*cpu))+"%")
+
+if __name__=='__main__':
+	loadtest(*[(int,int,float)[index](arg) for (index,arg) in enumerate(sys.argv[1:4])])
@@ -0,0 +1,210 @@
+"""
+Multi-process supervisor: one worker process per serial port
+- every worker runs its own SerialByteSource and LineByteProcessor (so the ports don't share a single core because of the GIL)
+- the lines extracted are sent in batches (of timestamp and bytes) through a multiprocessing queue to the supervisor
+- the supervisor is a ByteProducer pushing the lines of all ports (tagged with the port as source id) along to its byte consumer (the shared outputs)
+- crashed workers are restarted automatically (with a back-off), the CPU use and throughput of every worker are reported
+
+Usage from the command line:
+python sd2supervisor.py <port> [<name>=<value> ...] [<port> [<name>=<value> ...] ...] [udp=<destination port>]
+where the <name>=<value> settings of the serial port (e.g. baudrate=115200) follow the port they apply to
+"""
+
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import serial
+import serialdata2 as sd2
+
+SETTINGS=('baudrate','bytesize','parity','stopbits','timeout','xonxoff','rtscts','write_timeout','dsrdtr','inter_byte_timeout','exclusive')
+
+# QueueByteConsumer collects what it consumes and puts it on a multiprocessing queue in batches
+class QueueByteConsumer(sd2.ByteConsumer):
+	def __init__(self,outputQueue,port,batchInterval=0.01,maxBatchSize=1000):
+		super().__init__()
+		self.__outputQueue=outputQueue
+		self.__port=port
+		self.__batchInterval=batchInterval
+		self.__maxBatchSize=maxBatchSize
+		self.__batch=[]
+		self.__batchTime=time.time()
+		self.__lock=threading.Lock()
+		self.numberOfBytes=0
+		self.numberOfLines=0
+	def flush(self):
+		with self.__lock:
+			batch=self.__batch
+			self.__batch=[]
+			self.__batchTime=time.time()
+		if batch:
+			self.__outputQueue.put(('data',self.__port,batch))
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			with self.__lock:
+				self.__batch.append((bytesRead.getTime(),bytes(bytesRead)))
+				self.numberOfBytes+=len(bytesRead)
+				self.numberOfLines+=1
+				due=len(self.__batch)>=self.__maxBatchSize or time.time()-self.__batchTime>=self.__batchInterval
+			if due:
+				self.flush()
+			return True
+		return False
+
+# _work() is what a worker process runs: reading a single serial port until it fails
+def _work(port,settings,outputQueue,batchInterval,statsInterval):
+	serialInputDevice=serial.Serial(port=port,baudrate=sd2.getBaudrate(settings['baudrate']),bytesize=sd2.getBytesize(settings['bytesize']),parity=sd2.getParity(settings['parity']),stopbits=sd2.getStopbits(settings['stopbits']),timeout=sd2.getTimeout(settings['timeout']),xonxoff=sd2.getXonxoff(settings['xonxoff']),rtscts=sd2.getRtscts(settings['rtscts']),write_timeout=sd2.getWrite_timeout(settings['write_timeout']),dsrdtr=sd2.getDsrdtr(settings['dsrdtr']),inter_byte_timeout=sd2.getInter_byte_timeout(settings['inter_byte_timeout']),exclusive=sd2.getExclusive(settings['exclusive']))
+	queueByteConsumer=QueueByteConsumer(outputQueue,port,batchInterval)
+	serialByteSource=sd2.SerialByteSource(serialInputDevice).setByteConsumer(sd2.LineByteProcessor(queueByteConsumer))
+	if serialByteSource.start(0.001) is None:
+		raise Exception("Failed to start reading from '"+port+"'.")
+	time.sleep(batchInterval) # giving the reader thread time to start
+	statsTime=time.time()
+	while serialByteSource.isRunning():
+		time.sleep(batchInterval)
+		queueByteConsumer.flush()
+		if time.time()-statsTime>=statsInterval:
+			statsTime=time.time()
+			outputQueue.put(('stats',port,(statsTime,time.process_time(),queueByteConsumer.numberOfBytes,queueByteConsumer.numberOfLines)))
+	queueByteConsumer.flush()
+	raise Exception("Stopped reading from '"+port+"'.")
+
+# WorkerStats keeps track of the CPU use and throughput of a single worker (between the last two stats received)
+class WorkerStats:
+	def __init__(self):
+		self.restarts=-1 # the first start is not a restart
+		self.cpu=0.0 # fraction of a single core
+		self.bytesPerSecond=0.0
+		self.linesPerSecond=0.0
+		self.__previous=None
+	def updated(self,stats):
+		if self.__previous is not None and stats[0]>self.__previous[0] and stats[2]>=self.__previous[2]:
+			elapsed=stats[0]-self.__previous[0]
+			self.cpu=(stats[1]-self.__previous[1])/elapsed
+			self.bytesPerSecond=(stats[2]-self.__previous[2])/elapsed
+			self.linesPerSecond=(stats[3]-self.__previous[3])/elapsed
+		self.__previous=stats
+	def restarted(self):
+		self.restarts+=1
+		self.__previous=None
+	def __str__(self):
+		return "CPU: "+str(round(100*self.cpu,1))+"% - "+str(int(self.bytesPerSecond))+" bytes/s - "+str(int(self.linesPerSecond))+" lines/s - restarts: "+str(self.restarts)
+
+class Supervisor(sd2.ByteProducer):
+	# ports: a dictionary of serial port settings (by port name) using the keys in SETTINGS, missing settings get their default value
+	def __init__(self,ports,byteConsumer=None,batchInterval=0.01,statsInterval=5.0,maxRestartDelay=30.0):
+		super().__init__(byteConsumer)
+		self.__ports={}
+		for (port,settings) in ports.items():
+			self.__ports[port]=dict((setting,str(settings.get(setting,''))) for setting in SETTINGS)
+		self.__batchInterval=batchInterval
+		self.__statsInterval=statsInterval
+		self.__maxRestartDelay=maxRestartDelay
+		self.__context=multiprocessing.get_context()
+		self.__outputQueue=self.__context.Queue()
+		self.__workers={} # the worker process by port
+		self.__restartTimes={} # when to (re)start the worker of a port
+		self.__restartDelays={}
+		self.__stats=dict((port,WorkerStats()) for port in self.__ports.keys())
+		self.__running=False
+		self.__lock=threading.Lock() # serializes (re)starting workers and stopping
+		self.__supervisingThread=None
+	def __startWorker(self,port):
+		worker=self.__context.Process(target=_work,args=(port,self.__ports[port],self.__outputQueue,self.__batchInterval,self.__statsInterval),name='sd2worker '+port,daemon=True)
+		worker.start()
+		self.__workers[port]=worker
+		self.__stats[port].restarted()
+	def __supervise(self):
+		while self.__running:
+			now=time.time()
+			for port in self.__ports.keys():
+				with self.__lock: # so stop() can't interfere with restarting a worker
+					if not self.__running:
+						break
+					worker=self.__workers.get(port)
+					if worker is not None and worker.is_alive():
+						continue
+					if worker is not None: # crashed: restart after a delay that doubles every time (up to the maximum)
+						self._reporting("ERROR: Worker of '"+port+"' exited with code "+str(worker.exitcode)+".")
+						self.__workers[port]=None
+						self.__restartDelays[port]=min(self.__maxRestartDelay,2*self.__restartDelays.get(port,0.5))
+						self.__restartTimes[port]=now+self.__restartDelays[port]
+					if now>=self.__restartTimes.get(port,0):
+						self.__startWorker(port)
+			time.sleep(0.1)
+	def __aggregate(self):
+		while self.__running:
+			try:
+				(kind,port,content)=self.__outputQueue.get(timeout=0.5)
+			except queue.Empty:
+				continue
+			if kind=='data':
+				self.__restartDelays[port]=0.5 # it's working (again)
+				numberOfPushed=self._pushedBatch([sd2.BytesRead(data,time_,port) for (time_,data) in content])
+				if numberOfPushed<len(content):
+					self._reporting("ERROR: Failed to push along "+str(len(content)-numberOfPushed)+" lines of '"+port+"'.")
+			elif kind=='stats':
+				self.__stats[port].updated(content)
+	def start(self):
+		if not self.__running:
+			self.__running=True
+			threading.Thread(target=self.__aggregate,name='sd2aggregator',daemon=True).start()
+			self.__supervisingThread=threading.Thread(target=self.__supervise,name='sd2supervisor',daemon=True)
+			self.__supervisingThread.start()
+		return self
+	def stop(self):
+		with self.__lock:
+			self.__running=False
+		# the supervising thread won't start any worker anymore, but wait for it to finish anyway before terminating the workers
+		if self.__supervisingThread is not None and self.__supervisingThread is not threading.current_thread():
+			self.__supervisingThread.join()
+			self.__supervisingThread=None
+		for worker in self.__workers.values():
+			if worker is not None:
+				worker.terminate()
+		for worker in self.__workers.values():
+			if worker is not None:
+				worker.join(5)
+		self.__workers={}
+		return self
+	def isRunning(self):
+		return self.__running
+	def getStats(self,port):
+		return self.__stats.get(port)
+	def __str__(self):
+		return "\n".join(port+" - "+str(stats) for (port,stats) in self.__stats.items())
+	def __repr__(self):
+		return super().__repr__()+"\n"+self.__str__()
+
+def main(args):
+	ports={}
+	port=None
+	udpPort=None
+	for arg in args:
+		if '=' in arg:
+			(name,value)=arg.split('=',1)
+			if name=='udp':
+				udpPort=int(value)
+			elif port is not None and name in SETTINGS:
+				ports[port][name]=value
+			else:
+				print("WARNING: Setting '"+arg+"' ignored.")
+		else:
+			port=arg
+			ports[port]={}
+	if not ports:
+		print("Need at least the name of a serial port! Any settings should follow the port in the format <name>=<value> e.g. baudrate=9600!")
+		return
+	supervisor=Supervisor(ports,(None,sd2.UDPByteConsumer(udpPort))[udpPort is not None]).start()
+	try:
+		while True:
+			time.sleep(10)
+			print(str(supervisor))
+			supervisor.report()
+	except KeyboardInterrupt:
+		pass
+	supervisor.stop()
+
+if __name__=='__main__':
+	main(sys.argv[1:])
@@ -1,4 +1,5 @@
 # server-side part of example sd2udp2222
+# NOTE for local consumers use sd2unix.py instead (python sd2unix.py <socket path>)
 
 import socket
 import sys
@@ -12,5 +13,5 @@ sock.bind(('127.0.0.1', 2222))
 print('\nReady to receive messages.')
 
 while True:
-    (data,address)=sock.recvfrom(1024)
+    (data,address)=sock.recvfrom(65535) # the maximum UDP payload, so long lines are not truncated
     print("Received: '"+str(data)+"'.")
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+Unix domain socket publisher for local subscribers (replacing loopback UDP)
+- UnixSocketByteConsumer listens on a Unix domain socket path and publishes every BytesRead it consumes to all connected subscribers
+- framing: 'seqpacket' (SOCK_SEQPACKET, one message per BytesRead) or 'stream' (SOCK_STREAM, every message preceded by its length)
+- every message starts with a header holding the timestamp of the BytesRead (8 byte double)
+- seqpacket framing: a BytesRead larger than MAXMESSAGESIZE (header included) is split up into several messages (with the same timestamp)
+- every subscriber has its own bounded queue, when full the oldest messages are dropped (and counted)
+- queued messages are written with a single sendmsg() (writev) call per subscriber as much as possible (whenever something is consumed)
+- UnixSocketReceiver is the matching receiver, run this module from the command line to print what is received:
+  python sd2unix.py <socket path> [stream]
+"""
+
+import _thread
+import collections
+import errno
+import itertools
+import os
+import socket
+import struct
+import sys
+import threading
+import serialdata2 as sd2
+
+HEADER=struct.Struct('<d') # timestamp
+LENGTH=struct.Struct('<I') # stream framing: the length of the message that follows (header included)
+MAXMESSAGESPERCALL=64 # at most this number of queued messages per sendmsg() call
+MAXMESSAGESIZE=1<<16 # seqpacket framing: the maximum size of a message (header included), well within the default socket send buffer
+
+def _getSocketType(framing):
+	if framing=='seqpacket':
+		return socket.SOCK_SEQPACKET
+	if framing=='stream':
+		return socket.SOCK_STREAM
+	raise Exception("Invalid framing: should be 'seqpacket' or 'stream'.")
+
+# a Subscriber is a connected client with its own bounded queue of buffers to send
+class Subscriber:
+	def __init__(self,connection,maxQueued,stream):
+		connection.setblocking(False)
+		self.connection=connection
+		self.stream=stream
+		self.queue=collections.deque() # seqpacket: (header,data) tuples, stream: buffers
+		self.maxQueued=maxQueued
+		self.numberOfSent=0
+		self.numberOfDropped=0
+		self.sentOffset=0 # stream framing: the number of bytes of the first queued buffer already sent
+	def queued(self,header,data):
+		if self.stream:
+			message=LENGTH.pack(len(header)+len(data))+header+data
+			if len(self.queue)>=self.maxQueued:
+				self.numberOfDropped+=1
+				if self.sentOffset==0:
+					self.queue.popleft()
+				elif len(self.queue)>1: # never drop a partially sent buffer, so drop the one after it
+					del self.queue[1]
+				else: # nothing to drop but the partially sent buffer, so drop the new one
+					return
+			self.queue.append(message)
+		else:
+			maxDataSize=MAXMESSAGESIZE-len(header)
+			for offset in range(0,max(len(data),1),maxDataSize):
+				if len(self.queue)>=self.maxQueued:
+					self.queue.popleft()
+					self.numberOfDropped+=1
+				self.queue.append((header,data[offset:offset+maxDataSize]))
+	# flush() sends as much as possible without blocking, returns False when the subscriber disconnected
+	def flush(self):
+		try:
+			while self.queue:
+				if self.stream:
+					buffers=list(itertools.islice(self.queue,MAXMESSAGESPERCALL))
+					if self.sentOffset:
+						buffers[0]=memoryview(buffers[0])[self.sentOffset:]
+					sent=self.connection.sendmsg(buffers)
+					# dispose of whatever was sent entirely
+					sent+=self.sentOffset
+					self.sentOffset=0
+					while self.queue and sent>=len(self.queue[0]):
+						sent-=len(self.queue.popleft())
+						self.numberOfSent+=1
+					self.sentOffset=sent
+				else:
+					try:
+						self.connection.sendmsg(self.queue[0])
+						self.numberOfSent+=1
+					except OSError as ex:
+						if ex.errno!=errno.EMSGSIZE:
+							raise
+						self.numberOfDropped+=1 # never fits: drop the message (not the subscriber)
+					self.queue.popleft()
+		except (BlockingIOError,InterruptedError):
+			pass
+		except OSError: # disconnected
+			return False
+		return True
+	def close(self):
+		try:
+			self.connection.close()
+		except OSError:
+			pass
+
+class UnixSocketByteConsumer(sd2.ByteConsumer):
+	def __init__(self,path,framing='seqpacket',maxQueued=1024):
+		super().__init__()
+		self.__path=path
+		self.__stream=_getSocketType(framing)==socket.SOCK_STREAM
+		self.__maxQueued=maxQueued
+		self.__subscribers=() # replaced (not changed) by the accepting thread and when subscribers disconnect
+		self.__subscribersLock=threading.Lock() # serializes replacing the subscribers
+		self.__numberOfDisconnected=0
+		if os.path.exists(path):
+			os.remove(path)
+		self.__socket=socket.socket(socket.AF_UNIX,_getSocketType(framing))
+		self.__socket.bind(path)
+		self.__socket.listen()
+		self.__listening=True
+		_thread.start_new_thread(self.__accept,())
+	def __accept(self):
+		while self.__listening:
+			try:
+				(connection,address)=self.__socket.accept()
+			except OSError:
+				break
+			with self.__subscribersLock:
+				self.__subscribers=self.__subscribers+(Subscriber(connection,self.__maxQueued,self.__stream),)
+				numberOfSubscribers=len(self.__subscribers)
+			self._reporting("Subscriber #"+str(numberOfSubscribers)+" connected to '"+self.__path+"'.")
+	def __published(self,header,data):
+		disconnected=None
+		for subscriber in self.__subscribers:
+			subscriber.queued(header,data)
+			if not subscriber.flush():
+				disconnected=(disconnected or [])+[subscriber]
+		if disconnected:
+			self.__disconnected(disconnected)
+	def __disconnected(self,disconnected):
+		for subscriber in disconnected:
+			subscriber.close()
+		with self.__subscribersLock:
+			self.__numberOfDisconnected+=len(disconnected)
+			self.__subscribers=tuple(subscriber for subscriber in self.__subscribers if subscriber not in disconnected)
+		self._reporting(str(len(disconnected))+" subscriber(s) disconnected from '"+self.__path+"'.")
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			self.__published(HEADER.pack(bytesRead.getTime()),bytes(bytesRead))
+			return True
+		return False
+	def consumedBatch(self,bytesReadList):
+		if not self._acceptedBatch(bytesReadList):
+			return super().consumedBatch(bytesReadList)
+		# queue everything first, then flush every subscriber once
+		subscribers=self.__subscribers
+		for bytesRead in bytesReadList:
+			header=HEADER.pack(bytesRead.getTime())
+			data=bytes(bytesRead)
+			for subscriber in subscribers:
+				subscriber.queued(header,data)
+		disconnected=[subscriber for subscriber in subscribers if not subscriber.flush()]
+		if disconnected:
+			self.__disconnected(disconnected)
+		return len(bytesReadList)
+	def getNumberOfSubscribers(self):
+		return len(self.__subscribers)
+	def close(self):
+		self.__listening=False
+		self.__socket.close()
+		with self.__subscribersLock:
+			(subscribers,self.__subscribers)=(self.__subscribers,())
+		for subscriber in subscribers:
+			subscriber.close()
+		try:
+			os.remove(self.__path)
+		except OSError:
+			pass
+	def __repr__(self):
+		result=super().__repr__()+" - '"+self.__path+"' - subscribers: "+str(len(self.__subscribers))+" - disconnected: "+str(self.__numberOfDisconnected)
+		for subscriber in self.__subscribers:
+			result+=" - sent: "+str(subscriber.numberOfSent)+" queued: "+str(len(subscriber.queue))+" dropped: "+str(subscriber.numberOfDropped)
+		return result
+
+# maxMessageSize: seqpacket framing: larger messages are truncated by the socket, they're dropped (and counted) instead of returned
+class UnixSocketReceiver:
+	def __init__(self,path,framing='seqpacket',maxMessageSize=MAXMESSAGESIZE):
+		self.__stream=_getSocketType(framing)==socket.SOCK_STREAM
+		self.__socket=socket.socket(socket.AF_UNIX,_getSocketType(framing))
+		self.__socket.connect(path)
+		self.__maxMessageSize=maxMessageSize
+		self.__buffer=bytearray() # stream framing: what was received but not returned yet
+		self.numberOfTruncated=0
+	def __receivedExactly(self,size):
+		while len(self.__buffer)<size:
+			received=self.__socket.recv(max(self.__maxMessageSize,size-len(self.__buffer)))
+			if not received:
+				return None
+			self.__buffer+=received
+		result=bytes(self.__buffer[:size])
+		del self.__buffer[:size]
+		return result
+	# receive() blocks until a message arrives and returns it as a BytesRead (or None when the publisher went away)
+	def receive(self):
+		if self.__stream:
+			length=self.__receivedExactly(LENGTH.size)
+			message=length and self.__receivedExactly(LENGTH.unpack(length)[0])
+		else:
+			while True:
+				(message,ancillaryData,flags,address)=self.__socket.recvmsg(self.__maxMessageSize)
+				if not flags&socket.MSG_TRUNC:
+					break
+				self.numberOfTruncated+=1
+		if not message:
+			return None
+		return sd2.BytesRead(message[HEADER.size:],HEADER.unpack_from(message)[0])
+	def __iter__(self):
+		return self
+	def __next__(self):
+		bytesRead=self.receive()
+		if bytesRead is None:
+			raise StopIteration
+		return bytesRead
+	def close(self):
+		self.__socket.close()
+
+def main(args):
+	if not len(args):
+		print("Need the path of the Unix domain socket to receive from (optionally followed by stream)!")
+		return
+	unixSocketReceiver=UnixSocketReceiver(args[0],('seqpacket','stream')[len(args)>1 and args[1]=='stream'])
+	print('\nReady to receive messages.')
+	for bytesRead in unixSocketReceiver:
+		print("Received: '"+str(bytesRead)+"'.")
+	print("Publisher gone.")
+
+if __name__=='__main__':
+	main(sys.argv[1:])
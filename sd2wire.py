@@ -0,0 +1,263 @@
+"""
+Compact binary wire format for sending BytesRead over UDP (with their timestamp, unlike UDPByteConsumer)
+- a datagram starts with a version byte and the number of records it holds, every record has a fixed header followed by the data:
+  source id (16 bits), timestamp (64 bits, nanoseconds since the epoch), sequence number (32 bits, per source id) and data length (32 bits)
+- WireUDPByteConsumer is the encoder: consumed() sends a single record per datagram, consumedBatch() packs as many records as fit in maxDatagramSize
+  the source id is the BytesRead source id if an int, otherwise a number assigned to it (see getSourceIds()) or defaultSourceId if None
+- WireDecoder decodes datagrams into BytesRead (with the numeric source id) and counts per source id what is missing (gaps) and what arrived late (reordered)
+- WireUDPReceiver receives datagrams on a UDP port and pushes the decoded BytesRead along (in batches) to its byte consumer
+- run this module from the command line to print what is received (and the counters), or to benchmark encoding and decoding:
+  python sd2wire.py <UDP port>
+  python sd2wire.py benchmark
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+import serialdata2 as sd2
+
+VERSION=1
+DATAGRAMHEADER=struct.Struct('<BB') # version, number of records
+RECORDHEADER=struct.Struct('<HQII') # source id, timestamp (ns), sequence number, data length
+MAXRECORDSPERDATAGRAM=255
+SEQUENCEMASK=0xFFFFFFFF
+
+class WireUDPByteConsumer(sd2.ByteConsumer):
+	# maxDatagramSize: the default avoids IP fragmentation on Ethernet (a single record larger than that is sent in a datagram of its own)
+	def __init__(self,destinationPort,destinationIPAddress='127.0.0.1',maxDatagramSize=1472,defaultSourceId=0):
+		super().__init__()
+		self.__destination=(destinationIPAddress,destinationPort)
+		self.__udpSocket=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.__maxDatagramSize=maxDatagramSize
+		self.__defaultSourceId=defaultSourceId
+		self.__sourceIds={} # the number assigned to every (non-numeric) source id
+		self.__sequenceNumbers={} # the next sequence number by (numeric) source id
+		self.__buffer=bytearray(max(maxDatagramSize,DATAGRAMHEADER.size+RECORDHEADER.size)) # reused for every datagram
+		self.numberOfDatagrams=0
+	def getSourceIds(self):
+		return dict(self.__sourceIds)
+	def __getSourceId(self,sourceId):
+		if sourceId is None:
+			return self.__defaultSourceId
+		if isinstance(sourceId,int):
+			return sourceId
+		result=self.__sourceIds.get(sourceId)
+		if result is None:
+			result=self.__sourceIds[sourceId]=len(self.__sourceIds)+1
+			self._reporting("Source id "+str(result)+" assigned to '"+str(sourceId)+"'.")
+		return result
+	# __packed() writes the record of the given BytesRead into the buffer at the given offset (growing the buffer if need be), returning the offset after it
+	# or None if it can't be packed (e.g. a numeric source id that doesn't fit in 16 bits)
+	def __packed(self,bytesRead,offset):
+		try:
+			sourceId=self.__getSourceId(bytesRead.getSourceId())
+			sequenceNumber=self.__sequenceNumbers.get(sourceId,0)
+			end=offset+RECORDHEADER.size+len(bytesRead)
+			if end>len(self.__buffer):
+				self.__buffer.extend(bytes(end-len(self.__buffer)))
+			RECORDHEADER.pack_into(self.__buffer,offset,sourceId,int(bytesRead.getTime()*1e9),sequenceNumber,len(bytesRead))
+		except Exception as ex:
+			self._reporting("ERROR: '"+str(ex)+"' in packing '"+str(bytesRead)+"' of source '"+str(bytesRead.getSourceId())+"'.")
+			return None
+		self.__sequenceNumbers[sourceId]=(sequenceNumber+1)&SEQUENCEMASK # only once packed (so the receiver doesn't count a gap)
+		self.__buffer[offset+RECORDHEADER.size:end]=bytesRead
+		return end
+	def __sent(self,numberOfRecords,size):
+		DATAGRAMHEADER.pack_into(self.__buffer,0,VERSION,numberOfRecords)
+		try:
+			if self.__udpSocket.sendto(memoryview(self.__buffer)[:size],self.__destination)==size:
+				self.numberOfDatagrams+=1
+				return True
+			self._reporting("ERROR: Failed to send "+str(size)+" bytes to "+str(self.__destination)+".")
+		except Exception as ex:
+			self._reporting("ERROR: '"+str(ex)+"' in sending "+str(numberOfRecords)+" records to "+str(self.__destination)+".")
+		return False
+	def consumed(self,bytesRead):
+		if super().consumed(bytesRead):
+			size=self.__packed(bytesRead,DATAGRAMHEADER.size)
+			return size is not None and self.__sent(1,size)
+		return False
+	def consumedBatch(self,bytesReadList):
+		if not self._acceptedBatch(bytesReadList):
+			return super().consumedBatch(bytesReadList)
+		numberOfSent=0
+		numberOfRecords=0
+		offset=DATAGRAMHEADER.size
+		for bytesRead in bytesReadList:
+			if numberOfRecords and (numberOfRecords==MAXRECORDSPERDATAGRAM or offset+RECORDHEADER.size+len(bytesRead)>self.__maxDatagramSize): # full
+				if not self.__sent(numberOfRecords,offset):
+					return numberOfSent
+				numberOfSent+=numberOfRecords
+				numberOfRecords=0
+				offset=DATAGRAMHEADER.size
+			end=self.__packed(bytesRead,offset)
+			if end is None: # send what was packed before it
+				if numberOfRecords and self.__sent(numberOfRecords,offset):
+					numberOfSent+=numberOfRecords
+				return numberOfSent
+			offset=end
+			numberOfRecords+=1
+		if numberOfRecords:
+			if not self.__sent(numberOfRecords,offset):
+				return numberOfSent
+			numberOfSent+=numberOfRecords
+		return numberOfSent
+	def __repr__(self):
+		return super().__repr__()+" - datagrams sent: "+str(self.numberOfDatagrams)
+
+# SourceCounters keeps track of the sequence numbers received from a single source id
+class SourceCounters:
+	def __init__(self):
+		self.nextSequenceNumber=None
+		self.numberOfReceived=0
+		self.numberOfMissing=0 # skipped sequence numbers not (yet) received
+		self.numberOfReordered=0 # received after a later sequence number
+	def __str__(self):
+		return "received: "+str(self.numberOfReceived)+" - missing: "+str(self.numberOfMissing)+" - reordered: "+str(self.numberOfReordered)
+
+class WireDecoder:
+	def __init__(self):
+		self.__counters={} # SourceCounters by source id
+		self.numberOfInvalid=0 # datagrams that could not be decoded (entirely)
+	# decoded() returns the BytesRead records in the given datagram (updating the counters)
+	def decoded(self,datagram):
+		result=[]
+		if len(datagram)<DATAGRAMHEADER.size:
+			self.numberOfInvalid+=1
+			return result
+		(version,numberOfRecords)=DATAGRAMHEADER.unpack_from(datagram)
+		if version!=VERSION:
+			self.numberOfInvalid+=1
+			return result
+		if not isinstance(datagram,bytes): # BytesRead only takes bytes
+			datagram=bytes(datagram)
+		offset=DATAGRAMHEADER.size
+		unpack=RECORDHEADER.unpack_from
+		headerSize=RECORDHEADER.size
+		counters=self.__counters
+		for _ in range(numberOfRecords):
+			if offset+headerSize>len(datagram):
+				self.numberOfInvalid+=1
+				break
+			(sourceId,timestamp,sequenceNumber,length)=unpack(datagram,offset)
+			offset+=headerSize
+			if offset+length>len(datagram):
+				self.numberOfInvalid+=1
+				break
+			result.append(sd2.BytesRead(datagram[offset:offset+length],timestamp/1e9,sourceId))
+			offset+=length
+			sourceCounters=counters.get(sourceId)
+			if sourceCounters is None:
+				sourceCounters=counters[sourceId]=SourceCounters()
+				sourceCounters.nextSequenceNumber=sequenceNumber
+			sourceCounters.numberOfReceived+=1
+			difference=(sequenceNumber-sourceCounters.nextSequenceNumber)&SEQUENCEMASK
+			if difference==0: # as expected
+				sourceCounters.nextSequenceNumber=(sequenceNumber+1)&SEQUENCEMASK
+			elif difference<0x80000000: # ahead: what's in between is missing (so far)
+				sourceCounters.numberOfMissing+=difference
+				sourceCounters.nextSequenceNumber=(sequenceNumber+1)&SEQUENCEMASK
+			else: # behind: arrived late
+				sourceCounters.numberOfReordered+=1
+				if sourceCounters.numberOfMissing>0:
+					sourceCounters.numberOfMissing-=1
+		return result
+	def getCounters(self,sourceId=None):
+		if sourceId is None:
+			return dict(self.__counters)
+		return self.__counters.get(sourceId)
+	def __str__(self):
+		return "\n".join("Source id "+str(sourceId)+" - "+str(sourceCounters) for (sourceId,sourceCounters) in self.__counters.items())+("","\nInvalid datagrams: "+str(self.numberOfInvalid))[self.numberOfInvalid>0]
+
+# WireUDPReceiver pushes along whatever it receives on a UDP port (every datagram as a batch)
+class WireUDPReceiver(sd2.ByteProducer):
+	def __init__(self,port,byteConsumer=None,ipAddress='127.0.0.1',receiveBufferSize=1<<22):
+		super().__init__(byteConsumer)
+		self.__socket=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.__socket.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,receiveBufferSize)
+		self.__socket.bind((ipAddress,port))
+		self.__socket.settimeout(0.5)
+		self.decoder=WireDecoder()
+		self.__running=False
+	def __receive(self):
+		buffer=bytearray(65535)
+		while self.__running:
+			try:
+				size=self.__socket.recv_into(buffer)
+			except socket.timeout:
+				continue
+			except OSError:
+				break
+			bytesReadList=self.decoder.decoded(buffer[:size])
+			if bytesReadList and self._pushedBatch(bytesReadList)<len(bytesReadList):
+				self._reporting("ERROR: Failed to push along "+str(len(bytesReadList))+" records received.")
+	def start(self):
+		if not self.__running:
+			self.__running=True
+			threading.Thread(target=self.__receive,name='sd2wirereceiver',daemon=True).start()
+		return self
+	def stop(self):
+		self.__running=False
+		return self
+	def close(self):
+		self.stop()
+		self.__socket.close()
+	def __repr__(self):
+		return super().__repr__()+"\n"+str(self.decoder)
+
+def benchmark(numberOfBytesRead=200000,batchSize=100):
+	port=22222
+	received=[]
+	class CountingByteConsumer(sd2.ByteConsumer):
+		def consumedBatch(self,bytesReadList):
+			received.append(len(bytesReadList))
+			return len(bytesReadList)
+	receiver=WireUDPReceiver(port,CountingByteConsumer()).start()
+	encoder=WireUDPByteConsumer(port)
+	line=b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47'
+	bytesReadList=[sd2.BytesRead(line,None,'port1') for _ in range(batchSize)]
+	startTime=time.time()
+	for _ in range(numberOfBytesRead//batchSize):
+		encoder.consumedBatch(bytesReadList)
+		time.sleep(0) # give the receiver a chance to keep up
+	encodingTime=time.time()-startTime
+	time.sleep(0.5)
+	receiver.close()
+	print("Encoded and sent: "+str(round(numberOfBytesRead/encodingTime))+" records/s in "+str(encoder.numberOfDatagrams)+" datagrams")
+	print("Received: "+str(sum(received))+" records")
+	print(str(receiver.decoder))
+	# decoding alone
+	datagram=bytearray(DATAGRAMHEADER.pack(VERSION,20))
+	for sequenceNumber in range(20):
+		datagram+=RECORDHEADER.pack(1,time.time_ns(),sequenceNumber,len(line))+line
+	decoder=WireDecoder()
+	startTime=time.time()
+	for _ in range(numberOfBytesRead//20):
+		decoder.decoded(datagram)
+	print("Decoded: "+str(round(numberOfBytesRead/(time.time()-startTime)))+" records/s")
+
+def main(args):
+	if not len(args):
+		print("Need the UDP port to receive on (or benchmark)!")
+		return
+	if args[0]=='benchmark':
+		benchmark()
+		return
+	class PrintingByteConsumer(sd2.ByteConsumer):
+		def consumed(self,bytesRead):
+			print("Received from source id "+str(bytesRead.getSourceId())+": '"+str(bytesRead)+"'.")
+			return True
+	receiver=WireUDPReceiver(int(args[0]),PrintingByteConsumer()).start()
+	print('\nReady to receive messages.')
+	try:
+		while True:
+			time.sleep(10)
+			print(str(receiver.decoder))
+	except KeyboardInterrupt:
+		pass
+	receiver.close()
+
+if __name__=='__main__':
+	main(sys.argv[1:])
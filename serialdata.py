@@ -13,6 +13,7 @@ import queue
 import sys
 import time
 import datetime
+from serialdata2 import CopyOnWriteDict # shared with serialdata2 (so the byte readers can be changed while being iterated)
 
 class Reporter():
 	def __init__(self):
@@ -195,7 +196,7 @@ class SerialDataDispatcher(Reporter):
 		self.numberOfUnstoredBytes=0 # the number of bytes we failed to store somehow (perhaps retrievableBytes is full?????)
 		self.numberOfAnonymouslyReadBytes=0 # keep track of the number of bytes anonymously read so far
 		self.retrievableBytes=bytearray() # all bytes currently available 
-		self.byteReaders={} # the parties interested in reading the packets registered by some unique key (name)
+		self.byteReaders=CopyOnWriteDict() # the parties interested in reading the packets registered by some unique key (name)
 		self.reporter=self # by default reports to itself...
 		self.serialInputDevice=_serialInputDevice
 		self.name=self.serialInputDevice.name # even if we kill the reference
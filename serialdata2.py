@@ -16,6 +16,9 @@ import sys
 import time
 import datetime
 import socket
+import cProfile
+import pstats
+import io
 
 __DEBUG__=False
 
@@ -31,17 +34,29 @@ class BytesRead(bytearray):
 			pass
 		# return the amount appended...
 		return len(self)-l
-	def __init__(self,bytes_=None,time_=None):
+	def __init__(self,bytes_=None,time_=None,sourceId=None):
 		if not isinstance(time_,float):
 			self.__time=time.time()
 		else:
 			self.__time=time_
+		self.__sourceId=sourceId # optional tag telling where the bytes came from (e.g. the serial port name)
+		self.__valid=True # validating byte processors may tag corrupt frames instead of dropping them
 		if isinstance(bytes_,bytes):
 			super().__init__(bytes_)
 		else:
 			super().__init__()
 	def getTime(self):
 		return self.__time
+	def getSourceId(self):
+		return self.__sourceId
+	def setSourceId(self,sourceId):
+		self.__sourceId=sourceId
+		return self
+	def isValid(self):
+		return self.__valid
+	def setValid(self,valid):
+		self.__valid=valid
+		return self
 	def getBytes(self):
 		return bytes(self) # return immutable version of my contents!!
 	def __str__(self):
@@ -81,6 +96,40 @@ class Reporter:
 	def __repr__(self):
 		return "Reported: "+str(self.reported())+" - reportable: "+str(self.toreport());
 
+# CopyOnWriteDict never changes the dictionary it holds but replaces it (under a lock) on every change
+# so the reading thread can iterate over keys(), values() or items() without locking while other threads add or remove entries
+class CopyOnWriteDict:
+	def __init__(self):
+		self.__dict={}
+		self.__lock=threading.Lock()
+	def __setitem__(self,key,value):
+		with self.__lock:
+			dict_=dict(self.__dict)
+			dict_[key]=value
+			self.__dict=dict_ # atomic swap
+	def __delitem__(self,key):
+		with self.__lock:
+			dict_=dict(self.__dict)
+			del dict_[key]
+			self.__dict=dict_
+	def __getitem__(self,key):
+		return self.__dict[key]
+	def __contains__(self,key):
+		return key in self.__dict
+	def __len__(self):
+		return len(self.__dict)
+	def get(self,key,default=None):
+		return self.__dict.get(key,default)
+	# NOTE the views returned are views of a dictionary that never changes (i.e. a snapshot)
+	def keys(self):
+		return self.__dict.keys()
+	def values(self):
+		return self.__dict.values()
+	def items(self):
+		return self.__dict.items()
+	def __repr__(self):
+		return repr(self.__dict)
+
 # a ByteConsumer implements consumed() to process a BytesRead instance, passed to it by a ByteProducer
 class ByteConsumer(Reporter):
 	def __init__(self,echo=False):
@@ -97,6 +146,29 @@ class ByteConsumer(Reporter):
 			except:
 				super()._reporting("ERROR: '"+str(ex)+"' consuming '"+str(bytesRead)+"'.")
 		return False
+	# _fused() returns what to call instead of consumed() once the chain is frozen (see ByteSource.freeze())
+	# stages override it to skip input validation and counter updates on the hot path
+	def _fused(self):
+		return self.consumed
+	# consumedBatch() consumes a list of BytesRead at once, returning how many were consumed (in order)
+	# this default adapter simply calls consumed() for every BytesRead, override it to pay the per-call overhead once per batch
+	def consumedBatch(self,bytesReadList):
+		consumed=self.consumed
+		numberOfConsumed=0
+		for bytesRead in bytesReadList:
+			if not consumed(bytesRead):
+				break
+			numberOfConsumed+=1
+		return numberOfConsumed
+	# _acceptedBatch() is what consumed() does to a single BytesRead for an entire batch (returning False if anything in it is not a BytesRead)
+	def _acceptedBatch(self,bytesReadList):
+		for bytesRead in bytesReadList:
+			if not isinstance(bytesRead,BytesRead):
+				return False
+		if bytesReadList:
+			self.__consumed=bytesReadList[-1]
+			self.__consumedIndex+=len(bytesReadList)
+		return True
 	def __repr__(self):
 		result=super().__repr__()
 		if self.__consumed:
@@ -127,6 +199,18 @@ class UDPByteConsumer(ByteConsumer):
 			super()._reporting("ERROR: No or invalid BytesRead to consume!")
 		#####print("ERROR: Consuming '"+str(bytesRead)+"' failed.")
 		return False
+	def _fused(self):
+		if type(self).consumed is not UDPByteConsumer.consumed:
+			return self.consumed
+		udpSocket=self.__udpSocket
+		destination=self.__destination
+		def sent(bytesRead):
+			try:
+				return udpSocket.sendto(bytesRead,destination)==len(bytesRead)
+			except Exception as ex:
+				self._reporting("ERROR: '"+str(ex)+"' in sending '"+str(bytesRead)+"'' to "+str(destination)+".")
+			return False
+		return sent
 
 # a ByteProducer knows it byte consumer to push along what it receives
 # LineByteConsumer cuts out the line ends but does not send what it receives along
@@ -140,23 +224,42 @@ class LineByteConsumer(ByteConsumer):
 		self.__maxsepcount=maxsepcount
 		self.__line=None
 		self.__linesep=None
+		self.__lines=None # collects the lines extracted when consuming a batch
+		self.__unpushedLines=[] # the lines of a batch that failed to be pushed along (pushed along first next time)
 
 	# _pushed() is actually a ByteProducer method
 	def _pushed(self,bytesRead):
 		# I suppose without a next byte processor we can simply print it, or even better report it
 		self._reporting("Line '"+str(bytesRead)+"'.");
 		return True	# my implementation of _processed calls _passedAlong for any line
+	def _pushedBatch(self,bytesReadList):
+		numberOfPushed=0
+		for bytesRead in bytesReadList:
+			if not self._pushed(bytesRead):
+				break
+			numberOfPushed+=1
+		return numberOfPushed
+
+	# __pushedUnpushedLines() pushes along what failed to be pushed along in a previous batch, returning False if (still) not everything was
+	def __pushedUnpushedLines(self):
+		if self.__unpushedLines:
+			del self.__unpushedLines[:self._pushedBatch(self.__unpushedLines)]
+		return not self.__unpushedLines
 
 	def __pushLine(self):
-		if self.__line: # something to push along
-			if not self._pushed(self.__line): # failed to push along what we have to push along
+		if self.__lines is not None: # consuming a batch: pushed along (as a batch) afterwards
+			if self.__line:
+				self.__lines.append(self.__line)
+				self.__line=None
+		elif self.__line: # something to push along
+			if not self.__pushedUnpushedLines() or not self._pushed(self.__line): # failed to push along what we have to push along
 				self.__line.appendBytes(self.__linesep)
 				self.__linesep=bytearray()
 			else:
 				self.__line=None
 
-	def __newline(self,time):
-		self.__line=BytesRead(time_=time) # using the time passed in to initialize the BytesRead with
+	def __newline(self,time,sourceId=None):
+		self.__line=BytesRead(time_=time,sourceId=sourceId) # using the time (and source id) passed in to initialize the BytesRead with
 		self.__linesep=bytearray() # keep track of the current separator
 
 	def _processed(self,bytesRead):
@@ -165,7 +268,7 @@ class LineByteConsumer(ByteConsumer):
 		try:
 			# if we do not have a line yet, get one with the timestamp of what we are to process!!!
 			if not self.__line:
-				self.__newline(bytesRead.getTime())
+				self.__newline(bytesRead.getTime(),bytesRead.getSourceId())
 			for byteRead in bytesRead:
 				if byteRead in self.__sepbytes: # a line separator byte
 					self.__linesep.append(byteRead)
@@ -176,7 +279,7 @@ class LineByteConsumer(ByteConsumer):
 						self.__pushLine()
 					# we need a BytesRead instance in self.__line to append our byte to
 					if not self.__line:
-						self.__newline(bytesRead.getTime())
+						self.__newline(bytesRead.getTime(),bytesRead.getSourceId())
 					self.__line.append(byteRead)
 			result=True
 		except Exception as ex:
@@ -185,9 +288,37 @@ class LineByteConsumer(ByteConsumer):
 
 	def consumed(self,producedBytesRead):
 		return super().consumed(producedBytesRead)and self._processed(producedBytesRead)
+	def _fused(self):
+		return (self.consumed,self._processed)[type(self).consumed is LineByteConsumer.consumed]
+
+	def consumedBatch(self,producedBytesReadList):
+		if type(self).consumed is not LineByteConsumer.consumed: # can't bypass an overridden consumed()
+			return super().consumedBatch(producedBytesReadList)
+		if not self._acceptedBatch(producedBytesReadList):
+			return super().consumedBatch(producedBytesReadList)
+		lines=self.__lines=self.__unpushedLines # what failed to be pushed along before goes first
+		self.__unpushedLines=[]
+		try:
+			for producedBytesRead in producedBytesReadList:
+				self._processed(producedBytesRead)
+		finally:
+			self.__lines=None
+		if lines:
+			numberOfPushed=self._pushedBatch(lines)
+			if numberOfPushed<len(lines):
+				# like a single line that fails to be pushed along, the lines are kept (to be pushed along first next time) instead of dropped
+				# so all BytesRead in the batch were consumed: their bytes are either pushed along or kept here
+				self.__unpushedLines=lines[numberOfPushed:]
+				self._reporting("ERROR: Failed to push along "+str(len(lines)-numberOfPushed)+" of "+str(len(lines))+" lines (kept to push along again).")
+		return len(producedBytesReadList)
+	def getNumberOfUnpushedLines(self):
+		return len(self.__unpushedLines)
 
 class ByteProducer(Reporter):
+	_frozen=False # set by ByteSource.freeze()
 	def setByteConsumer(self,byteConsumer):
+		if self._frozen:
+			raise Exception("Can't change the byte consumer of '"+str(self)+"': the chain is frozen.")
 		if __DEBUG__:
 			if byteConsumer:
 				print("Setting the byte consumer to '"+str(byteConsumer)+"!")
@@ -208,6 +339,11 @@ class ByteProducer(Reporter):
 	# call _pushed() to push along what was produced
 	def _pushed(self,producedBytesRead):
 		return self._byteConsumer is None or self._byteConsumer.consumed(producedBytesRead)
+	# call _pushedBatch() to push along a list of BytesRead at once, returns the number pushed along
+	def _pushedBatch(self,producedBytesReadList):
+		if self._byteConsumer is None:
+			return len(producedBytesReadList)
+		return self._byteConsumer.consumedBatch(producedBytesReadList)
 
 # a ByteProcessor is both a ByteProducer and a ByteConsumer
 class ByteProcessor(ByteProducer,ByteConsumer):
@@ -235,11 +371,33 @@ class ByteProcessor(ByteProducer,ByteConsumer):
 			except Exception as ex:
 				super()._reporting("ERROR: '"+str(ex)+"' in processing '"+str(bytesRead)+"'.")
 		return result
+	# _processedBatch() processes a list of BytesRead at once, returning the number processed (in order)
+	def _processedBatch(self,bytesReadList):
+		processed=self._processed
+		numberOfProcessed=0
+		for bytesRead in bytesReadList:
+			if not processed(bytesRead):
+				break
+			numberOfProcessed+=1
+		return numberOfProcessed
+	def _fused(self):
+		return (self.consumed,self._processed)[type(self).consumed is ByteProcessor.consumed]
+	def consumedBatch(self,bytesReadList):
+		if type(self).consumed is not ByteProcessor.consumed or not self._acceptedBatch(bytesReadList):
+			return super().consumedBatch(bytesReadList)
+		try:
+			return self._processedBatch(bytesReadList)
+		except Exception as ex:
+			self._reporting("ERROR: '"+str(ex)+"' in processing a batch of "+str(len(bytesReadList))+" BytesRead.")
+		return 0
 
 class LineByteProcessor(LineByteConsumer,ByteProducer):
 	def __init__(self,nextByteProcessor=None,sepbytes=b'\r\n',maxsepcount=2):
 		LineByteConsumer.__init__(self,sepbytes,maxsepcount)
 		ByteProducer.__init__(self,nextByteProcessor)
+
+	def _pushedBatch(self,bytesReadList):
+		return ByteProducer._pushedBatch(self,bytesReadList)
 	
 	def _pushed(self,bytesRead):
 		if self._byteConsumer:
@@ -247,17 +405,96 @@ class LineByteProcessor(LineByteConsumer,ByteProducer):
 		print("No byte consumer to push to!")
 		return super()._pushed(bytesRead)
 
+# getChain() returns the byte consumers following the given byte producer (in order)
+def getChain(byteProducer):
+	chain=[]
+	byteConsumer=(None,byteProducer)[isinstance(byteProducer,ByteProducer)]
+	while isinstance(byteConsumer,ByteProducer):
+		byteConsumer=byteConsumer.getByteConsumer()
+		if not isinstance(byteConsumer,ByteConsumer) or byteConsumer in chain:
+			break
+		chain.append(byteConsumer)
+	return chain
+
+# a StageProfile temporarily replaces the consumed() and _processed() methods of a single stage (instance) with timing wrappers
+# NOTE removing the wrappers restores the class methods, so there's no overhead whatsoever when not profiling
+class StageProfile:
+	METHODNAMES=('consumed','_processed')
+	def __init__(self,stage):
+		self.__stage=stage
+		self.__timings={} # per method name: [call count,cumulative time]
+	def __wrap(self,methodName):
+		method=getattr(self.__stage,methodName)
+		timing=self.__timings[methodName]=[0,0.0]
+		def timed(*args):
+			t=time.perf_counter()
+			try:
+				return method(*args)
+			finally:
+				timing[1]+=time.perf_counter()-t
+				timing[0]+=1
+		return timed
+	def install(self):
+		for methodName in StageProfile.METHODNAMES:
+			if hasattr(self.__stage,methodName):
+				setattr(self.__stage,methodName,self.__wrap(methodName))
+		return self
+	def uninstall(self):
+		for methodName in self.__timings.keys():
+			try:
+				delattr(self.__stage,methodName)
+			except AttributeError:
+				pass
+		return self
+	def getStage(self):
+		return self.__stage
+	def getCallCount(self,methodName='consumed'):
+		return self.__timings.get(methodName,(0,0.0))[0]
+	def getCumulativeTime(self,methodName='consumed'):
+		return self.__timings.get(methodName,(0,0.0))[1]
+	def __str__(self):
+		result=type(self.__stage).__name__
+		for (methodName,timing) in self.__timings.items():
+			result+=" - "+methodName+": "+str(timing[0])+" calls, "+str(round(timing[1],6))+" s"
+		return result
+
+# ChainProfile is what ByteSource.profile() returns: the per-stage timings and the top functions of the reader thread (if profiled)
+class ChainProfile:
+	def __init__(self,stageProfiles,seconds,profiler=None,numberOfFunctions=20):
+		self.stageProfiles=stageProfiles
+		self.seconds=seconds
+		self.functions=None
+		if profiler is not None:
+			stream=io.StringIO()
+			pstats.Stats(profiler,stream=stream).sort_stats('cumulative').print_stats(numberOfFunctions)
+			self.functions=stream.getvalue()
+	# getOwnTime() returns the time spent in consumed() of the stage with given index excluding the time spent in the stages following it
+	def getOwnTime(self,stageIndex):
+		ownTime=self.stageProfiles[stageIndex].getCumulativeTime()
+		if stageIndex+1<len(self.stageProfiles):
+			ownTime-=self.stageProfiles[stageIndex+1].getCumulativeTime()
+		return ownTime
+	def __str__(self):
+		result="Profiled "+str(len(self.stageProfiles))+" stages during "+str(self.seconds)+" s."
+		for stageIndex in range(len(self.stageProfiles)):
+			result+="\n"+str(stageIndex+1)+". "+str(self.stageProfiles[stageIndex])+" - own: "+str(round(self.getOwnTime(stageIndex),6))+" s"
+		if self.functions:
+			result+="\n"+self.functions
+		return result
+	def __repr__(self):
+		return self.__str__()
+
 # ByteSource receives the raw bytes in its _register method and is the first element in the chain of byte processors, so immediately pushes it along to the associated byte processor
 class ByteSource(ByteProducer):
 	def __init__(self,byteConsumer):
 		super().__init__(byteConsumer)
 		self.__bytesRead=None
-	def _registered(self,bytes):
+	def _registered(self,bytes,time_=None):
 		# the issue here is that we do not want to loose any bytes received...
 		result=False
 		try:
 			if self.__bytesRead is None:
-				self.__bytesRead=BytesRead(bytes)
+				self.__bytesRead=BytesRead(bytes,time_)
 			else:
 				self.__bytesRead.appendBytes(bytes)
 			# if we manage to push the constructed __bytesRead along, we can get rid of self.__bytesRead
@@ -266,32 +503,113 @@ class ByteSource(ByteProducer):
 		except Exception as ex:
 			self._reporting("ERROR: '"+str(ex)+"' in registering '"+str(bytes)+"' by byte source '"+str(self)+"'.")
 		return self.__bytesRead is None
+	# freeze() fuses the chain: every producer in it pushes straight into the _fused() callable of its byte consumer
+	# i.e. skipping the validation and counter updates of consumed(), until thaw() is called
+	# NOTE the byte consumers of a frozen chain can't be changed
+	def freeze(self):
+		if not self._frozen:
+			frozenByteProducers=[]
+			for byteProducer in [self]+getChain(self):
+				if isinstance(byteProducer,ByteProducer):
+					byteConsumer=byteProducer.getByteConsumer()
+					if byteConsumer is not None:
+						byteProducer._pushed=byteConsumer._fused()
+					byteProducer._frozen=True
+					frozenByteProducers.append(byteProducer)
+			self.__frozenByteProducers=frozenByteProducers
+		return self
+	def thaw(self):
+		if self._frozen:
+			for byteProducer in self.__frozenByteProducers:
+				if '_pushed' in vars(byteProducer):
+					del byteProducer._pushed
+				del byteProducer._frozen
+			self.__frozenByteProducers=None
+		return self
+	def isFrozen(self):
+		return self._frozen
+	# _setProfiler() should have the thread calling _registered() enable (or disable when None) the given profiler, returning True when it did
+	def _setProfiler(self,profiler):
+		return False
+	# profile() times every stage in the chain for the given number of seconds (also running cProfile on the reader thread if possible)
+	# NOTE a frozen chain bypasses the timing wrappers, so it is thawed while profiling (and frozen again afterwards)
+	def profile(self,seconds=10,numberOfFunctions=20,cprofile=True):
+		if not isinstance(seconds,(int,float)) or seconds<=0:
+			raise Exception("Invalid number of seconds to profile.")
+		frozen=self._frozen
+		if frozen:
+			self._reporting("Thawing the chain to profile it.")
+			self.thaw()
+		stageProfiles=[StageProfile(stage).install() for stage in getChain(self)]
+		profiler=(None,cProfile.Profile())[cprofile]
+		try:
+			if profiler is not None and not self._setProfiler(profiler):
+				self._reporting("Not profiling functions: no reader thread to profile.")
+				profiler=None
+			time.sleep(seconds)
+		finally:
+			if profiler is not None:
+				self._setProfiler(None)
+			for stageProfile in stageProfiles:
+				stageProfile.uninstall()
+			if frozen:
+				self.freeze()
+		return ChainProfile(stageProfiles,seconds,profiler,numberOfFunctions)
 
 # ByteSink is what a ByteDispatcher dispatches to which has a relationship with 
 class ByteSink(ByteProcessor):
 	
-	def __init__(self,name,_nextByteProcessor):
+	def __init__(self,name='',_nextByteProcessor=None):
 		super().__init__(_nextByteProcessor)
 		self.__name=name # remember the name
+		self.__byteDispatcher=None
 		self._bytesReadCount=0
+		self._bytesReadAvailable=0
+		self._numberOfSkipped=0 # the number of BytesRead disposed before being read
 	
+	# _skipped() is called with the (absolute) offsets of the BytesRead disposed before being read (from included, to excluded)
+	def _skipped(self,fromOffset,toOffset):
+		self._reporting("WARNING: "+str(toOffset-fromOffset)+" BytesRead disposed before being read.")
+
+	# NOTE update() may be called by any thread: it holds the dispatcher's lock (so the dispatcher doesn't change what it holds meanwhile)
 	def update(self):
-		if self.__byteDispatcher:
-			self._bytesReadAvailable=self.__byteDispatcher.getBytesReadCount()
-			# push all we can immediately
-			while self._bytesReadCount<self._bytesReadAvailable:
-				if not self.processed(self.__byteDispatcher.getBytesRead(self._bytesReadCount)):
-					break
-				self.bytesReadCount+=1 # one less to retrieve
+		byteDispatcher=self.__byteDispatcher
+		if byteDispatcher:
+			with byteDispatcher._lock:
+				self._bytesReadAvailable=byteDispatcher.getBytesReadCount()
+				# skip what the dispatcher had to dispose of before we got to read it
+				numberOfDisposedBytesRead=byteDispatcher.getNumberOfDisposedBytesRead()
+				if self._bytesReadCount<numberOfDisposedBytesRead:
+					self._numberOfSkipped+=numberOfDisposedBytesRead-self._bytesReadCount
+					self._skipped(self._bytesReadCount,numberOfDisposedBytesRead)
+					self._bytesReadCount=numberOfDisposedBytesRead
+				# push all we can immediately
+				while self._bytesReadCount<self._bytesReadAvailable:
+					if not self.consumed(byteDispatcher.getBytesRead(self._bytesReadCount)):
+						break
+					self._bytesReadCount+=1 # one less to retrieve
 
-	def setByteDispatcher(self,byteDispatcher):
-		self.__byteDispatcher=byteDispatcher
-		if self.__byteDispatcher:
-			self._bytesReadCount=self.__byteDispatcher.getNumberOfDisposedBytesRead() # can't (and won't) read what isn't there anymore...
-			self.update() # force an update to get up to speed!!!
+	# the dispatcher holds on to what we fail to push along, so no need to collect it here
+	def _processed(self,bytesRead):
+		return self._pushed(bytesRead)
+
+	# offset: the (absolute) offset of the first BytesRead to read (e.g. to resume where a previous sink left off), by default the oldest one still available
+	def setByteDispatcher(self,byteDispatcher,offset=None):
+		if byteDispatcher:
+			with byteDispatcher._lock:
+				if offset is None:
+					self._bytesReadCount=byteDispatcher.getNumberOfDisposedBytesRead() # can't (and won't) read what isn't there anymore...
+				else: # if disposed already update() will skip to what's still there
+					self._bytesReadCount=max(0,min(offset,byteDispatcher.getBytesReadCount()))
+				self.__byteDispatcher=byteDispatcher
+				self.update() # force an update to get up to speed!!!
+		else:
+			self.__byteDispatcher=byteDispatcher
 
 	def getBytesReadCount(self): # should be available to the dispatcher at all times...
 		return self._bytesReadCount
+	def getNumberOfSkipped(self):
+		return self._numberOfSkipped
 	
 	def __str__(self):
 		return self.__name
@@ -303,48 +621,72 @@ class ByteSink(ByteProcessor):
 # so as opposed to ByteProcessor it has to keep its received BytesRead packets until they are requested
 class ByteDispatcher(ByteSink):
 
-	def __init__(self,_name,_nextByteProcessor=None): # typically won't have a next byte processor just ByteSinks
+	# bytesReadList: where to keep the BytesRead instances (defaults to a deque), anything supporting append(), popleft(), clear(), len() and indexing will do
+	# retainCount, retainSeconds and retainBytes: the history kept regardless of the byte sinks (e.g. for sinks to resume reading after reconnecting)
+	# i.e. at least the last retainCount BytesRead, those of the last retainSeconds seconds and the last retainBytes bytes (whichever is most)
+	def __init__(self,_name,_nextByteProcessor=None,bytesReadList=None,retainCount=0,retainSeconds=0.0,retainBytes=0): # typically won't have a next byte processor just ByteSinks
 		super().__init__(_name,_nextByteProcessor) # can have a next but unlikely
-		self.__byteSinks={} # keep a dictionary of byte sinks (by name)
-		self.__bytesReadList=collections.deque() # a thread-safe list i.e. supporting atomic actions
+		if not isinstance(retainCount,int) or retainCount<0 or not isinstance(retainSeconds,(int,float)) or retainSeconds<0 or not isinstance(retainBytes,int) or retainBytes<0:
+			raise Exception("Invalid retention.")
+		self.__byteSinks=CopyOnWriteDict() # keep a dictionary of byte sinks (by name), changed by the user's thread while iterated by the serial thread
+		self.__bytesReadList=(bytesReadList,collections.deque())[bytesReadList is None]
+		self.__retainCount=retainCount
+		self.__retainSeconds=retainSeconds
+		self.__retainBytes=retainBytes
+		self.__numberOfBytes=0 # in the BytesRead list
+		# guards the BytesRead list and count: byte sinks may be updated by other threads than the one the dispatcher consumes on
+		self._lock=threading.RLock()
 
 	def getNumberOfDisposedBytesRead(self):
-		return self._bytesReadCount-len(self.__bytesReadList)
+		with self._lock:
+			return self._bytesReadCount-len(self.__bytesReadList)
+
+	# __isRetained() returns whether the oldest BytesRead (in the list) is to be retained according to the retention settings
+	def __isRetained(self,minTime):
+		if len(self.__bytesReadList)<=self.__retainCount:
+			return True
+		bytesRead=self.__bytesReadList[0]
+		return bytesRead.getTime()>=minTime or self.__numberOfBytes-len(bytesRead)<self.__retainBytes
 
 	def _cleanup(self):
 		# cleans up the list of BytesRead instances
 		minSinkBytesReadCount=len(self.__bytesReadList) # the maximum number of disposable BytesRead instances
 		if minSinkBytesReadCount: # something in the BytesRead list right now
-			if len(self.__byteSinks): # we have byte sinks not up to date
-				bytesReadDisposed=self.getNumberOfDisposedBytesRead() # the number of BytesRead instances disposed
-				for byteSink in self.__byteSinks.values():
-					sinkBytesReadCount=byteSink.getBytesReadCount()-bytesReadDisposed # what was read since the last disposal (MUST be zero or positive!!)
-					if sinkBytesReadCount<minSinkBytesReadCount:
-						minSinkBytesReadCount=sinkBytesReadCount
-				if minSinkBytesReadCount>0:
-					self._reporting("Will remove "+str(minSinkBytesReadCount)+" BytesRead instances.")
-					while minSinkBytesReadCount>0:
-						minSinkBytesReadCount-=1
-						self.__bytesReadList.popleft()
-				else:
-					self._reporting("No BytesRead to remove.")
-			else: # I guess we can get rid of the entire contents...
-				self.__bytesReadList.clear()
+			bytesReadDisposed=self.getNumberOfDisposedBytesRead() # the number of BytesRead instances disposed
+			for byteSink in self.__byteSinks.values():
+				sinkBytesReadCount=byteSink.getBytesReadCount()-bytesReadDisposed # what was read since the last disposal (MUST be zero or positive!!)
+				if sinkBytesReadCount<minSinkBytesReadCount:
+					minSinkBytesReadCount=sinkBytesReadCount
+			if not self.__retainCount and not self.__retainSeconds and not self.__retainBytes:
+				if minSinkBytesReadCount>=len(self.__bytesReadList): # nothing to retain for anyone: get rid of the entire contents...
+					self.__bytesReadList.clear()
+					self.__numberOfBytes=0
+					return
+				minTime=float('inf')
+			else:
+				minTime=(float('inf'),time.time()-self.__retainSeconds)[self.__retainSeconds>0]
+			while minSinkBytesReadCount>0 and not self.__isRetained(minTime):
+				minSinkBytesReadCount-=1
+				self.__numberOfBytes-=len(self.__bytesReadList.popleft())
 	def getBytesRead(self,index):
 		# NOTE index is an absolute index unless it's negative
-		try:
-			if index>=0:
-				index-=self.getNumberOfDisposedBytesRead()
-			return self.__bytesReadList[index]
-		except:
-			self._reporting("ERROR: '"+str(ex)+"' returning bytes read #"+str(index)+" by dispatcher "+self.name+".")
+		with self._lock:
+			try:
+				if index>=0:
+					index-=self.getNumberOfDisposedBytesRead()
+					if index<0: # disposed already
+						return None
+				return self.__bytesReadList[index]
+			except Exception as ex:
+				self._reporting("ERROR: '"+str(ex)+"' returning bytes read #"+str(index)+" by dispatcher "+str(self)+".")
 		return None
 
-	def processed(self,bytesRead):
+	def _processed(self,bytesRead):
 		result=False
-		if isinstance(bytesRead,BytesRead):
+		with self._lock:
 			try:
 				self.__bytesReadList.append(bytesRead)
+				self.__numberOfBytes+=len(bytesRead)
 				self._bytesReadCount+=1 # another one available...
 				# tell all byte sinks to update themselves
 				for byteSink in self.__byteSinks.values():
@@ -352,13 +694,15 @@ class ByteDispatcher(ByteSink):
 						byteSink.update()
 					except:
 						pass
-
-				result=super().processed(_bytesReadList[-1]) # push along the last element in the list
+				result=super()._processed(bytesRead) # push along
 			except Exception as ex:
 				self._reporting("ERROR: '"+str(ex)+"' processing '"+str(bytesRead)+".")
-		self._cleanup() # TODO under what condition should we cleanup????
+			self._cleanup() # TODO under what condition should we cleanup????
 		return result
 
+	def getNumberOfRetainedBytesRead(self):
+		return len(self.__bytesReadList)
+
 	# ByteSinks support
 	def removeByteSinkWithName(self,byteSinkName):
 		if not isinstance(byteSinkName,str):
@@ -369,30 +713,32 @@ class ByteDispatcher(ByteSink):
 				del self.__byteSinks[byteSinkName] # might fail if it wasn't present to start with
 				self._reporting("Byte sink with name '"+byteSinkName+"' removed!")
 			except:
-				self._reporting("ERROR: Failed to remove byte sink '"+byteSinkName+"' from the list of byte sinks of dispatcher '"+self.name+"'.")
+				self._reporting("ERROR: Failed to remove byte sink '"+byteSinkName+"' from the list of byte sinks of dispatcher '"+str(self)+"'.")
 		return not byteSinkName in self.__byteSinks # if not present (anymore), remove its reference to me
 	def removeByteSink(self,byteSink):
 		for byteSinkName in self.__byteSinks.keys():
 			if byteSink==self.__byteSinks[byteSinkName]:
 				return self.removeByteSinkWithName(byteSinkName)
 		return False
-	def addByteSink(self,byteSink,byteSinkName=''):
+	# offset: the (absolute) offset of the first BytesRead the byte sink should read (see ByteSink.setByteDispatcher())
+	def addByteSink(self,byteSink,byteSinkName='',offset=None):
 		if not isinstance(byteSinkName,str) or not isinstance(byteSink,ByteSink):
 			raise Exception("Undefined/invalid byte sink or byte sink name!")
 		# needs to be a ByteReader to start with
 		result=False
 		if not byteSinkName in self.__byteSinks: # not currently registered (under that name)
 			try:
-				self.__byteSinks[byteSinkName]=byteSink
-				byteSink.setByteDispatcher(self) # won't raise an exception because the input is not invalid
+				with self._lock: # so nothing is disposed of before the byte sink starts reading
+					self.__byteSinks[byteSinkName]=byteSink
+					byteSink.setByteDispatcher(self,offset) # won't raise an exception because the input is not invalid
 				result=True
 			except Exception as ex:
-				self._reporting("ERROR: '"+str(ex)+"' in adding byte sink '"+byteSinkName+"' to the list of byte sinks of dispatcher '"+self.name+"'.")
-		elif self.__byteSinks[_byteSinkName]==_byteSink: # already have it!!!
+				self._reporting("ERROR: '"+str(ex)+"' in adding byte sink '"+byteSinkName+"' to the list of byte sinks of dispatcher '"+str(self)+"'.")
+		elif self.__byteSinks[byteSinkName]==byteSink: # already have it!!!
 			result=True
 		else:
-			self._reporting("ERROR: Another byte sink called '"+byteSinkName+"' already registered with dispatcher '"+self.name+"'.")
-		return (None,_byteSink)[result]
+			self._reporting("ERROR: Another byte sink called '"+byteSinkName+"' already registered with dispatcher '"+str(self)+"'.")
+		return (None,byteSink)[result]
 
 	def getByteSink(self,byteSinkName=''):
 		if isinstance(byteSinkName,str):
@@ -406,6 +752,60 @@ class ByteDispatcher(ByteSink):
 	def getByteSinkNames(self):
 		return self.__byteSinks.keys()		
 
+# a ReadPolicy decides when the bytes read by a SerialByteSource are to be registered (as a single BytesRead)
+# i.e. when the target chunk size is reached, nothing was received for the inter-byte gap or the oldest byte waited for the maximum latency (whichever comes first)
+# when adaptive the target chunk size follows the observed rate i.e. what is received during the maximum latency
+class ReadPolicy:
+	def __init__(self,targetChunkSize=1024,interByteGap=0.002,maxLatency=0.02,adaptive=True,minChunkSize=16,maxChunkSize=65536):
+		if not isinstance(targetChunkSize,int) or targetChunkSize<=0:
+			raise Exception("Invalid target chunk size.")
+		if not isinstance(interByteGap,(int,float)) or interByteGap<0:
+			raise Exception("Invalid inter-byte gap.")
+		if not isinstance(maxLatency,(int,float)) or maxLatency<0:
+			raise Exception("Invalid maximum latency.")
+		self.__targetChunkSize=targetChunkSize
+		self.__interByteGap=interByteGap
+		self.__maxLatency=maxLatency
+		self.__adaptive=adaptive
+		self.__minChunkSize=minChunkSize
+		self.__maxChunkSize=maxChunkSize
+		self.__rate=None # the observed rate (in bytes per second)
+		self.__lastFlushTime=None
+		self.__chunkSizeCounts=collections.Counter() # chunk size distribution by power of 2 (upper bound)
+	def getTargetChunkSize(self):
+		return self.__targetChunkSize
+	def getRate(self):
+		return self.__rate
+	# isDue() returns True when the pending bytes should be registered now
+	def isDue(self,numberOfPendingBytes,firstByteTime,lastByteTime,now):
+		return numberOfPendingBytes>=self.__targetChunkSize or now-lastByteTime>=self.__interByteGap or now-firstByteTime>=self.__maxLatency
+	# getSleep() returns how long the reader can sleep at most before the pending bytes are due
+	def getSleep(self,firstByteTime,lastByteTime,now):
+		return max(0.0,min(lastByteTime+self.__interByteGap,firstByteTime+self.__maxLatency)-now)
+	def flushed(self,chunkSize,now):
+		self.__chunkSizeCounts[1<<(chunkSize-1).bit_length()]+=1
+		if self.__lastFlushTime is not None and now>self.__lastFlushTime:
+			rate=chunkSize/(now-self.__lastFlushTime)
+			if self.__rate is None:
+				self.__rate=rate
+			else:
+				self.__rate=0.8*self.__rate+0.2*rate
+			if self.__adaptive:
+				self.__targetChunkSize=max(self.__minChunkSize,min(self.__maxChunkSize,int(self.__rate*self.__maxLatency)))
+		self.__lastFlushTime=now
+	def getChunkSizeDistribution(self):
+		return dict(sorted(self.__chunkSizeCounts.items()))
+	def __repr__(self):
+		return "Read policy - target: "+str(self.__targetChunkSize)+" bytes - gap: "+str(self.__interByteGap)+" s - latency: "+str(self.__maxLatency)+" s - rate: "+str(self.__rate and int(self.__rate))+" bytes/s - chunk sizes: "+str(self.getChunkSizeDistribution())
+
+# presets to use with SerialByteSource.setReadPolicy()
+def getReadPolicy(preset):
+	if preset=='lowlatency':
+		return ReadPolicy(targetChunkSize=64,interByteGap=0.0005,maxLatency=0.002,minChunkSize=1,maxChunkSize=1024)
+	if preset=='highthroughput':
+		return ReadPolicy(targetChunkSize=4096,interByteGap=0.01,maxLatency=0.1,minChunkSize=256,maxChunkSize=1<<20)
+	raise Exception("Invalid read policy preset: should be 'lowlatency' or 'highthroughput'.")
+
 # culmunating in SerialByteSource which acts as a ByteSource to a serial input device (of type Serial.serial)
 class SerialByteSource(ByteSource):
 
@@ -419,6 +819,9 @@ class SerialByteSource(ByteSource):
 		self.__paused=False
 		self.__running=False
 		self.__numberOfBytesRead=0 # count the number of bytes read...
+		self.__profilerRequest=None # (profiler,event) to be handled by the reader thread
+		self.__profilerLock=threading.Lock() # guards taking (or withdrawing) the profiler request
+		self.__readPolicy=None # by default whatever is read is registered immediately
 
 	def __del__(self):
 		if self.__thread:
@@ -434,27 +837,79 @@ class SerialByteSource(ByteSource):
 			self.__paused=False
 			self.__running=True
 			# keep reading as long as the serial input device is (still) open
+			profiler=None
+			pendingBytes=bytearray() # what was read but not registered yet (according to the read policy)
+			firstByteTime=lastByteTime=None
 			while self.__running:
+				if self.__profilerRequest is not None: # (un)install the requested profiler on this thread
+					with self.__profilerLock:
+						(profilerRequest,self.__profilerRequest)=(self.__profilerRequest,None)
+					if profilerRequest is not None: # not withdrawn meanwhile
+						if profiler is not None:
+							profiler.disable()
+						(profiler,profiled)=profilerRequest
+						if profiler is not None:
+							profiler.enable()
+						profiled.set()
 				if self.__serialInputDevice.isOpen:
 					if self.__serialInputDevice.out_waiting:
 						self.__serialInputDevice.flush() # write everything that can be written
 					# when paused, assume nothing to read...
 					numberOfBytesToRead=(self.__serialInputDevice.in_waiting,0)[self.__paused]
-					if numberOfBytesToRead:
-						if self._registered(self.__serialInputDevice.read(size=numberOfBytesToRead)):
-							self.__numberOfBytesRead+=numberOfBytesToRead
-						else:
-							self._reporting("ERROR: Failed to register "+str(numberOfBytesToRead)+" serial bytes read.")
-					if _sleep>0:
-						time.sleep(_sleep)
+					readPolicy=self.__readPolicy
+					if readPolicy is None:
+						if pendingBytes: # the read policy was removed
+							self.__registerPending(bytes(pendingBytes),firstByteTime)
+							pendingBytes=bytearray()
+						if numberOfBytesToRead:
+							self.__registerPending(self.__serialInputDevice.read(size=numberOfBytesToRead))
+						if _sleep>0:
+							time.sleep(_sleep)
+					else:
+						now=time.time()
+						if numberOfBytesToRead:
+							if not pendingBytes:
+								firstByteTime=now
+							pendingBytes+=self.__serialInputDevice.read(size=numberOfBytesToRead)
+							lastByteTime=now
+						if pendingBytes:
+							if readPolicy.isDue(len(pendingBytes),firstByteTime,lastByteTime,now):
+								readPolicy.flushed(len(pendingBytes),now)
+								self.__registerPending(bytes(pendingBytes),firstByteTime)
+								pendingBytes=bytearray()
+							elif _sleep>0:
+								time.sleep(min(_sleep,readPolicy.getSleep(firstByteTime,lastByteTime,now)))
+						elif _sleep>0:
+							time.sleep(_sleep)
 				else:
 					self._reporting("Serial input device (still) not open!")
 					time.sleep(1)
+			if pendingBytes:
+				self.__registerPending(bytes(pendingBytes),firstByteTime)
+			if profiler is not None:
+				profiler.disable()
 			self._reporting("'"+self.__name+"' finished running...")
 			self.__close() # as soon as the loop ends close the serial port connection as well...
 		else:
 			self._reporting("Can't start '"+self.__name+"': no associated serial input device (anymore).")
 
+	def __registerPending(self,bytes_,time_=None):
+		if self._registered(bytes_,time_):
+			self.__numberOfBytesRead+=len(bytes_)
+		else:
+			self._reporting("ERROR: Failed to register "+str(len(bytes_))+" serial bytes read.")
+
+	# setReadPolicy() accepts a ReadPolicy, the name of a preset ('lowlatency' or 'highthroughput') or None to register whatever is read immediately
+	def setReadPolicy(self,readPolicy):
+		if isinstance(readPolicy,str):
+			readPolicy=getReadPolicy(readPolicy)
+		elif readPolicy is not None and not isinstance(readPolicy,ReadPolicy):
+			raise Exception("Invalid read policy.")
+		self.__readPolicy=readPolicy
+		return self
+	def getReadPolicy(self):
+		return self.__readPolicy
+
 	def __close(self):
 		# deciding NOT to dispose of self.serialInputDevice unless self.__thread is no longer defined!!!
 		if self.__serialInputDevice:
@@ -480,6 +935,20 @@ class SerialByteSource(ByteSource):
 	def isRunning(self):
 		return self.__running
 
+	def _setProfiler(self,profiler):
+		if not self.__running:
+			return False
+		profilerRequest=(profiler,threading.Event())
+		with self.__profilerLock:
+			self.__profilerRequest=profilerRequest
+		if profilerRequest[1].wait(5.0): # the reader thread should respond well within that time
+			return True
+		with self.__profilerLock:
+			if self.__profilerRequest is profilerRequest: # not taken by the reader thread: withdraw it (so it never enables a profiler nobody disables)
+				self.__profilerRequest=None
+				return False
+		return profilerRequest[1].wait(5.0) # taken just now
+
 	def isRunnable(self):
 		# considered runnable if it is not currently running and can be run...
 		return not self.__running and self.__serialInputDevice is not None
@@ -743,6 +1212,56 @@ def main(args):
 	else:
 		print("Need at least the name of the serial input device! Any parameters should be presented on the command-line in the format <name>=<value> e.g. baudrate=9600!")		
 
+# benchmark() measures the per-line overhead of a LineByteProcessor pushing into a UDPByteConsumer before and after freezing the chain
+def benchmark(numberOfLines=100000,linesPerChunk=4,udpPort=2222):
+	line=b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n'
+	chunks=[BytesRead(line*linesPerChunk) for index in range(numberOfLines//linesPerChunk)]
+	byteSource=ByteSource(LineByteProcessor(UDPByteConsumer(udpPort)))
+	for frozen in (False,True):
+		if frozen:
+			byteSource.freeze()
+		t=time.perf_counter()
+		for chunk in chunks:
+			byteSource._pushed(chunk)
+		elapsed=time.perf_counter()-t
+		print(("Unfrozen","Frozen")[frozen]+": "+str(round(1e6*elapsed/(len(chunks)*linesPerChunk),3))+" microseconds per line.")
+	byteSource.thaw()
+
+# stresstest() has a ByteDispatcher consume BytesRead at full rate while another thread keeps adding and removing byte sinks
+def stresstest(seconds=10,numberOfSinkNames=16):
+	byteDispatcher=ByteDispatcher('stress')
+	stressing=[True]
+	changes=[0]
+	def changed():
+		index=0
+		while stressing[0]:
+			byteSinkName='sink'+str(index%numberOfSinkNames)
+			if byteSinkName in byteDispatcher.getByteSinkNames():
+				byteDispatcher.removeByteSinkWithName(byteSinkName)
+			else:
+				byteDispatcher.addByteSink(ByteSink(byteSinkName),byteSinkName)
+			changes[0]+=1
+			index+=1
+	switchInterval=sys.getswitchinterval()
+	sys.setswitchinterval(1e-6) # switching threads as often as possible to provoke changes during iterations
+	changer=threading.Thread(target=changed)
+	changer.start()
+	numberOfConsumed=numberOfFailed=0
+	bytesRead=b'$GPGGA,123519,4807.038,N,01131.000,E*47'
+	startTime=time.time()
+	try:
+		while time.time()-startTime<seconds:
+			if byteDispatcher.consumed(BytesRead(bytesRead)):
+				numberOfConsumed+=1
+			else:
+				numberOfFailed+=1
+	finally:
+		stressing[0]=False
+		changer.join()
+		sys.setswitchinterval(switchInterval)
+	print("Consumed "+str(numberOfConsumed)+" BytesRead ("+str(numberOfFailed)+" failed) while making "+str(changes[0])+" byte sink changes.")
+	return numberOfFailed==0
+
 def test():
 	# try to get a dispatcher that starts immediately
 	serialByteSource=getSerialByteSource(None)
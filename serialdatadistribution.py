@@ -60,7 +60,8 @@ class SerialDataDistributor(threading.Thread):
 		self.lines=queue.Queue() # the list of received lines
 		self.lastChar='\0'
 		self.line="" # the line composed so far
-		self.lineReaders=[] # no line reader(s) so far
+		self.lineReaders=() # no line reader(s) so far, replaced (not changed) when adding or removing a line reader
+		self.lineReadersLock=threading.Lock() # serializes replacing self.lineReaders
 		self.lineReaderCount=0
 		if _report:
 			self.reporter=Reporter() # by default write to console
@@ -215,8 +216,12 @@ class SerialDataDistributor(threading.Thread):
 	def deleteLineReaderWithIndex(self,_lineReaderIndex):
 		# can't actually remove
 		try:
-			if self.lineReaders[_lineReaderIndex-1] is not None:
-				self.lineReaders[_lineReaderIndex-1]=None
+			with self.lineReadersLock:
+				if self.lineReaders[_lineReaderIndex-1] is None:
+					return
+				lineReaders=list(self.lineReaders)
+				lineReaders[_lineReaderIndex-1]=None
+				self.lineReaders=tuple(lineReaders)
 				self.lineReaderCount-=1 # one registered line reader left...
 				self.__report("Number of line readers associated with '"+self.name+"': "+str(self.lineReaderCount)+".")
 		except:
@@ -224,10 +229,12 @@ class SerialDataDistributor(threading.Thread):
 	def addLineReader(self,_lineReader):
 		if _lineReader is None or not hasattr(_lineReader,'read') or type(_lineReader.read)!="<class 'method'>":
 			raise Exception("Undefined line reader or line reader that does not have a read() method.")
-		self.lineReaders.append(_lineReader)
-		self.lineReaderCount+=1 # another line reader...
+		with self.lineReadersLock:
+			self.lineReaders=self.lineReaders+(_lineReader,)
+			self.lineReaderCount+=1 # another line reader...
+			lineReaderIndex=len(self.lineReaders)
 		self.__report("Number of line readers associated with '"+self.name+"': "+str(self.lineReaderCount)+".")
-		return len(self.lineReaders)
+		return lineReaderIndex
 			
 # keep a dictionary of serial data distributors (by name)
 serialDataDistributors={}
@@ -0,0 +1,306 @@
+"""
+Soak harness checking that memory use stays bounded when reading serial data for a long time
+- synthetic serial input devices (SyntheticSerial) produce NMEA-like lines at a set rate
+- consumers can be slow, stalled or detaching (after a given number of seconds)
+- the serialdata2dispatcher scenario has a ByteDispatcher (retaining a history of RETAINSECONDS seconds) with a fast byte sink and a byte sink that is slow, stalled or detaching
+- RSS, tracemalloc (current and top allocators) and the sizes of the buffers involved are sampled over time
+- samples are written as CSV time series (<output>.csv and <output>.top.csv) for plotting
+- the soak fails if (traced) memory keeps growing over the last part of the run
+
+Usage from the command line:
+python serialdatasoak.py <module> <seconds> [rate=<bytes/s>] [sources=<n>] [consumer=slow|stalled|detaching|normal] [output=<prefix>]
+where <module> is one of serialdata2, serialdata2dispatcher, serialdata or serialdatadistribution
+"""
+
+import csv
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import serial
+
+# SyntheticSerial pretends to be an open serial input device that receives lines at a fixed rate (in bytes per second)
+class SyntheticSerial(serial.Serial):
+	def __init__(self,name='synthetic',rate=9600):
+		super().__init__()
+		self.port=name
+		self.name=name
+		self.isOpen=True
+		self.__rate=rate
+		self.__startTime=time.time()
+		self.__numberOfBytesProduced=0
+		self.__numberOfLinesProduced=0
+		self.__buffer=bytearray()
+		self.__lock=threading.Lock()
+	def __produce(self):
+		# append complete lines as long as we're behind on the number of bytes that should have been received
+		numberOfBytesDue=int((time.time()-self.__startTime)*self.__rate)
+		while self.__numberOfBytesProduced<numberOfBytesDue:
+			self.__numberOfLinesProduced+=1
+			line=b'$SOAK,'+str(self.__numberOfLinesProduced).encode('ascii')+b',4807.038,N,01131.000,E*00\r\n'
+			self.__buffer+=line
+			self.__numberOfBytesProduced+=len(line)
+	@property
+	def in_waiting(self):
+		with self.__lock:
+			self.__produce()
+			return len(self.__buffer)
+	@property
+	def out_waiting(self):
+		return 0
+	def read(self,size=1):
+		with self.__lock:
+			readBytes=bytes(self.__buffer[:size])
+			del self.__buffer[:size]
+		return readBytes
+	def write(self,data):
+		return len(data)
+	def flush(self):
+		pass
+	def flushInput(self):
+		pass
+	def flushOutput(self):
+		pass
+	def open(self):
+		self.isOpen=True
+	def close(self):
+		self.isOpen=False
+	def getNumberOfBytesProduced(self):
+		return self.__numberOfBytesProduced
+
+# returns the resident set size (in bytes) of this process (if available)
+def getRSS():
+	try:
+		with open('/proc/self/statm') as statm:
+			return int(statm.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+	except Exception:
+		pass
+	try:
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024 # peak RSS, not current (Linux reports kilobytes)
+	except Exception:
+		return 0
+
+# a Scenario builds the sources and consumers and knows the buffer sizes to probe (by name)
+class Scenario:
+	def __init__(self,numberOfSources,rate,consumer,detachAfter):
+		self.serials=[SyntheticSerial('synthetic'+str(index),rate) for index in range(numberOfSources)]
+		self.consumer=consumer
+		self.detachAfter=detachAfter
+		self.probes={} # probe name: function returning the current size of a buffer
+		self.threads=[]
+		self.running=False
+	# _drained() is what a consumer thread of a queue-based module should do, returning False when to stop draining
+	def _drained(self,drain,startTime):
+		if self.consumer=='stalled':
+			return True # never drains at all
+		if self.consumer=='detaching' and time.time()-startTime>self.detachAfter:
+			return False
+		drain()
+		if self.consumer=='slow':
+			time.sleep(0.1)
+		return True
+	def _startDraining(self,drain):
+		def drained():
+			startTime=time.time()
+			while self.running and self._drained(drain,startTime):
+				time.sleep(0.001)
+		thread=threading.Thread(target=drained,daemon=True)
+		self.threads.append(thread)
+		thread.start()
+	def start(self):
+		self.running=True
+	def stop(self):
+		self.running=False
+	def sample(self):
+		result={}
+		for (probeName,probe) in self.probes.items():
+			try:
+				result[probeName]=probe()
+			except Exception:
+				result[probeName]=-1
+		return result
+
+class SerialData2Scenario(Scenario):
+	def start(self):
+		super().start()
+		import serialdata2 as sd2
+		scenario=self
+		class SoakByteConsumer(sd2.ByteConsumer):
+			def __init__(self):
+				super().__init__()
+				self.startTime=time.time()
+			def consumed(self,bytesRead):
+				if scenario.consumer=='slow':
+					time.sleep(0.001)
+				elif scenario.consumer=='stalled' and time.time()-self.startTime>scenario.detachAfter:
+					return False # the producer has to hold on to what it produced
+				return super().consumed(bytesRead)
+		self.sources=[]
+		for syntheticSerial in self.serials:
+			lineByteProcessor=sd2.LineByteProcessor(SoakByteConsumer())
+			source=sd2.SerialByteSource(syntheticSerial).setByteConsumer(lineByteProcessor)
+			self.sources.append(source.start(0.001))
+			self.probes[syntheticSerial.name+'.reportqueue']=source.toreport
+			self.probes[syntheticSerial.name+'.line.reportqueue']=lineByteProcessor.toreport
+			self.probes[syntheticSerial.name+'.consumer.reportqueue']=lineByteProcessor.getByteConsumer().toreport
+			self.probes[syntheticSerial.name+'.pending']=lambda source=source:len(source._ByteSource__bytesRead or b'')
+			if self.consumer=='detaching':
+				threading.Timer(self.detachAfter,source.setByteConsumer,(None,)).start()
+	def stop(self):
+		super().stop()
+		for source in self.sources:
+			source.stop()
+
+RETAINSECONDS=5.0 # the history the dispatcher of SerialData2DispatcherScenario retains regardless of its byte sinks
+
+class SerialData2DispatcherScenario(Scenario):
+	def start(self):
+		super().start()
+		import serialdata2 as sd2
+		# SoakByteSink only reads when drained (so not at all when stalled)
+		class SoakByteSink(sd2.ByteSink):
+			def __init__(self,name):
+				super().__init__(name)
+				self.reading=False
+			def consumed(self,bytesRead):
+				return self.reading and super().consumed(bytesRead)
+		self.sources=[]
+		for syntheticSerial in self.serials:
+			byteDispatcher=sd2.ByteDispatcher(syntheticSerial.name,retainSeconds=RETAINSECONDS)
+			fastByteSink=byteDispatcher.addByteSink(sd2.ByteSink('fast'),'fast')
+			slowByteSink=byteDispatcher.addByteSink(SoakByteSink('slow'),'slow')
+			source=sd2.SerialByteSource(syntheticSerial).setByteConsumer(sd2.LineByteProcessor(byteDispatcher))
+			self.sources.append(source.start(0.001))
+			self.probes[syntheticSerial.name+'.retained']=byteDispatcher.getNumberOfRetainedBytesRead
+			self.probes[syntheticSerial.name+'.dispatcher.reportqueue']=byteDispatcher.toreport
+			self.probes[syntheticSerial.name+'.fast.lag']=lambda byteDispatcher=byteDispatcher,byteSink=fastByteSink:byteDispatcher.getBytesReadCount()-byteSink.getBytesReadCount()
+			self.probes[syntheticSerial.name+'.fast.reportqueue']=fastByteSink.toreport
+			self.probes[syntheticSerial.name+'.slow.lag']=lambda byteDispatcher=byteDispatcher,byteSink=slowByteSink:byteDispatcher.getBytesReadCount()-byteSink.getBytesReadCount()
+			self.probes[syntheticSerial.name+'.slow.reportqueue']=slowByteSink.toreport
+			def drain(byteSink=slowByteSink):
+				byteSink.reading=True
+				byteSink.update()
+				byteSink.reading=False
+			if self.consumer=='detaching':
+				threading.Timer(self.detachAfter,byteDispatcher.removeByteSinkWithName,('slow',)).start()
+			self._startDraining(drain)
+	def stop(self):
+		super().stop()
+		for source in self.sources:
+			source.stop()
+
+class SerialDataScenario(Scenario):
+	def start(self):
+		super().start()
+		import serialdata
+		class StalledByteReader(serialdata.ByteReader):
+			def update(self,_numberOfStoredBytes):
+				self.updateCount+=1 # not reading anything
+		self.dispatchers=[]
+		for syntheticSerial in self.serials:
+			dispatcher=serialdata.SerialDataDispatcher(syntheticSerial)
+			byteReader=(serialdata.LineByteReader(),StalledByteReader())[self.consumer=='stalled']
+			dispatcher.addByteReader(byteReader,'soak')
+			dispatcher.start(0.001)
+			self.dispatchers.append(dispatcher)
+			self.probes[syntheticSerial.name+'.retrievablebytes']=dispatcher.getNumberOfRetrievableBytes
+			self.probes[syntheticSerial.name+'.reportqueue']=dispatcher.queue.qsize
+			self.probes[syntheticSerial.name+'.reader.queue']=byteReader.readBytesQueue.qsize
+			self.probes[syntheticSerial.name+'.reader.reportqueue']=byteReader.queue.qsize
+			def drain(byteReader=byteReader):
+				while byteReader.readBytesQueue.qsize():
+					byteReader.readBytesQueue.get_nowait()
+			if self.consumer=='detaching':
+				threading.Timer(self.detachAfter,byteReader.stop).start()
+			self._startDraining(drain)
+	def stop(self):
+		super().stop()
+		for dispatcher in self.dispatchers:
+			dispatcher.stop()
+
+class SerialDataDistributionScenario(Scenario):
+	def start(self):
+		super().start()
+		import serialdatadistribution
+		self.distributors=[]
+		for syntheticSerial in self.serials:
+			distributor=serialdatadistribution.SerialDataDistributor(syntheticSerial,False)
+			distributor.start(0.001)
+			self.distributors.append(distributor)
+			self.probes[syntheticSerial.name+'.lines']=distributor.lines.qsize
+			def drain(distributor=distributor):
+				while distributor.next() is not None:
+					pass
+			self._startDraining(drain)
+	def stop(self):
+		super().stop()
+		for distributor in self.distributors:
+			distributor.stop()
+
+SCENARIOS={'serialdata2':SerialData2Scenario,'serialdata2dispatcher':SerialData2DispatcherScenario,'serialdata':SerialDataScenario,'serialdatadistribution':SerialDataDistributionScenario}
+
+# isBounded() considers memory bounded when the maximum over the last third of the samples does not exceed the maximum over the middle third by more than the given tolerance
+def isBounded(values,tolerance=0.1,slack=1<<20):
+	if len(values)<3:
+		return True
+	third=len(values)//3
+	middleMaximum=max(values[third:2*third])
+	lastMaximum=max(values[2*third:])
+	return lastMaximum<=middleMaximum*(1+tolerance)+slack
+
+def soak(module='serialdata2',seconds=3600,rate=115200//10,numberOfSources=1,consumer='normal',detachAfter=60,sampleInterval=1.0,output='soak',numberOfTopAllocators=10):
+	if not module in SCENARIOS:
+		raise Exception("Invalid module: should be one of "+str(tuple(SCENARIOS.keys()))+".")
+	if not consumer in ('normal','slow','stalled','detaching'):
+		raise Exception("Invalid consumer: should be normal, slow, stalled or detaching.")
+	tracemalloc.start()
+	scenario=SCENARIOS[module](numberOfSources,rate,consumer,detachAfter)
+	scenario.start()
+	startTime=time.time()
+	tracedValues=[]
+	with open(output+'.csv','w',newline='') as samplesFile,open(output+'.top.csv','w',newline='') as topFile:
+		samplesWriter=csv.writer(samplesFile)
+		topWriter=csv.writer(topFile)
+		probeNames=list(scenario.probes.keys())
+		samplesWriter.writerow(['time','rss','traced','tracedpeak','bytesproduced']+probeNames)
+		topWriter.writerow(['time','rank','location','size','count'])
+		try:
+			while time.time()-startTime<seconds:
+				time.sleep(sampleInterval)
+				elapsed=round(time.time()-startTime,3)
+				(traced,tracedPeak)=tracemalloc.get_traced_memory()
+				tracedValues.append(traced)
+				probeValues=scenario.sample()
+				samplesWriter.writerow([elapsed,getRSS(),traced,tracedPeak,sum(syntheticSerial.getNumberOfBytesProduced() for syntheticSerial in scenario.serials)]+[probeValues.get(probeName,'') for probeName in probeNames])
+				samplesFile.flush()
+				topStatistics=tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False,tracemalloc.__file__),)).statistics('lineno')
+				for rank in range(min(numberOfTopAllocators,len(topStatistics))):
+					topStatistic=topStatistics[rank]
+					topWriter.writerow([elapsed,rank+1,str(topStatistic.traceback),topStatistic.size,topStatistic.count])
+				topFile.flush()
+		except KeyboardInterrupt:
+			print("Soak interrupted.")
+		finally:
+			scenario.stop()
+			tracemalloc.stop()
+	bounded=isBounded(tracedValues)
+	print(("FAIL: memory NOT bounded","OK: memory bounded")[bounded]+" soaking "+module+" with "+str(numberOfSources)+" "+consumer+" source(s) at "+str(rate)+" bytes/s during "+str(seconds)+" s (samples written to "+output+".csv and "+output+".top.csv).")
+	return bounded
+
+def main(args):
+	if len(args)<2:
+		print("Need at least the module to soak and the number of seconds to soak it!")
+		return 2
+	map={'rate':str(115200//10),'sources':'1','consumer':'normal','detach':'60','interval':'1','output':'soak'}
+	for arg in args[2:]:
+		try:
+			equalPos=arg.index('=')
+			map[arg[:equalPos]]=arg[equalPos+1:]
+		except:
+			pass
+	return (1,0)[soak(args[0],float(args[1]),int(map['rate']),int(map['sources']),map['consumer'],float(map['detach']),float(map['interval']),map['output'])]
+
+if __name__=='__main__':
+	sys.exit(main(sys.argv[1:]))